@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+
+"""
+Microbenchmark of the feature serialization: cost by feature of the previous `make_json_items`
+(copied below, encoded by the json module like `jsonify` did) and of `FeatureSerializer`.
+
+    python -m benchmarks.bench_serializer --features 1000 --repeat 20
+"""
+
+from argparse import ArgumentParser
+from collections import OrderedDict
+from copy import deepcopy
+from datetime import datetime, timedelta
+from json import dumps as json_dumps, loads
+from os import environ, getenv
+from timeit import repeat
+
+environ.setdefault('TIF_ROOT', 'http://www2.dgi.inpe.br/api/download/TIFF')
+environ.setdefault('PNG_ROOT', 'http://www2.dgi.inpe.br/api/download/PNG')
+
+from inpe_stac.serializer import FeatureSerializer, dumps, orjson  # noqa: E402
+
+
+LINKS = [
+    {'href': 'http://localhost/collections/', 'rel': 'self'},
+    {'href': 'http://localhost/collections/', 'rel': 'parent'},
+    {'href': 'http://localhost/collections/', 'rel': 'collection'},
+    {'href': 'http://localhost/stac', 'rel': 'root'}
+]
+
+
+def make_rows(total):
+    rows = []
+
+    for i in range(total):
+        x, y = -60 + (i % 100) * 0.3, -20 + (i % 70) * 0.3
+        path = '/CBERS4/2019_08/CBERS_4_MUX_DRD_2019_08_01.13_00_00/{0}_{1}/2_BC_UTM_WGS84/CBERS_4_MUX_{0}'.format(
+            i, i % 100
+        )
+
+        rows.append({
+            'id': 'CBERS4MUX{:09d}'.format(i),
+            'collection': 'CBERS4_MUX_L2_DN',
+            'datetime': datetime(2019, 1, 1) + timedelta(hours=i),
+            'date': None,
+            'path': 150 + i % 30,
+            'row': 100 + i % 40,
+            'satellite': 'CBERS4',
+            'sensor': 'MUX',
+            'cloud_cover': i % 100,
+            'sync_loss': None,
+            'tl_longitude': x, 'tl_latitude': y + 1,
+            'bl_longitude': x, 'bl_latitude': y,
+            'br_longitude': x + 1, 'br_latitude': y,
+            'tr_longitude': x + 1, 'tr_latitude': y + 1,
+            'thumbnail': path + '.png',
+            'assets': json_dumps([
+                {'band': 'BAND{}'.format(b), 'href': '{}_BAND{}.tif'.format(path, b)} for b in (5, 6, 7, 8)
+            ])
+        })
+
+    return rows
+
+
+##################################################
+# previous serializer
+##################################################
+
+def legacy_bbox(coord_list):
+    box = []
+
+    for i in (0, 1):
+        res = sorted(coord_list[0], key=lambda x: x[i])
+        box.append((res[0][i], res[-1][i]))
+
+    return [box[0][0], box[1][0], box[0][1], box[1][1]]
+
+
+def legacy_make_json_items(items, links):
+    features = []
+
+    gjson = OrderedDict()
+    gjson['type'] = 'FeatureCollection'
+
+    for i in items:
+        feature = OrderedDict()
+
+        feature['type'] = 'Feature'
+        feature['id'] = i['id']
+        feature['collection'] = i['collection']
+
+        geometry = dict()
+        geometry['type'] = 'Polygon'
+        geometry['coordinates'] = [
+          [[i['tl_longitude'], i['tl_latitude']],
+           [i['bl_longitude'], i['bl_latitude']],
+           [i['br_longitude'], i['br_latitude']],
+           [i['tr_longitude'], i['tr_latitude']],
+           [i['tl_longitude'], i['tl_latitude']]]
+        ]
+        feature['geometry'] = geometry
+        feature['bbox'] = legacy_bbox(feature['geometry']['coordinates'])
+
+        feature['properties'] = {
+            'datetime': datetime.fromisoformat(str(i['datetime'])).isoformat(),
+            'path': i['path'],
+            'row': i['row'],
+            'satellite': i['satellite'],
+            'sensor': i['sensor'],
+            'cloud_cover': i['cloud_cover'],
+            'sync_loss': i['sync_loss']
+        }
+
+        feature['assets'] = {}
+
+        i['assets'] = loads(i['assets'])
+
+        for asset in i['assets']:
+            feature['assets'][asset['band']] = {
+                'href': getenv('TIF_ROOT') + asset['href'],
+                'type': 'image/vnd.stac.geotiff'
+            }
+            feature['assets'][asset['band'] + '_xml'] = {
+                'href': getenv('TIF_ROOT') + asset['href'].replace('.tif', '.xml'),
+                'type': 'text/xml'
+            }
+
+        feature['assets']['thumbnail'] = {
+            'href': getenv('PNG_ROOT') + i['thumbnail'],
+            'type': 'image/png'
+        }
+
+        feature['links'] = deepcopy(links)
+        feature['links'][0]['href'] += i['collection'] + "/items/" + i['id']
+        feature['links'][1]['href'] += i['collection']
+        feature['links'][2]['href'] += i['collection']
+
+        features.append(feature)
+
+    gjson['features'] = features
+
+    return gjson
+
+
+def run_legacy(rows):
+    # the previous serializer changed `assets` of the rows, then it receives copies of them
+    items = [dict(row) for row in rows]
+
+    return (json_dumps(legacy_make_json_items(items, deepcopy(LINKS)), separators=(',', ':')) + '\n').encode()
+
+
+def run_current(rows):
+    serializer = FeatureSerializer(LINKS)
+
+    return b'{"type":"FeatureCollection","features":' + dumps([serializer.make_feature(row) for row in rows]) + b'}'
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Compare the cost by feature of the serializers.')
+    parser.add_argument('--features', type=int, default=1000, help='number of features by response')
+    parser.add_argument('--repeat', type=int, default=20, help='number of measures, the best one is shown')
+
+    args = parser.parse_args()
+
+    rows = make_rows(args.features)
+
+    # both serializers must create the same document
+    assert loads(run_legacy(rows)) == loads(run_current(rows))
+
+    print('backend: {}, features: {}'.format('orjson' if orjson is not None else 'json', args.features))
+
+    results = {}
+
+    for name, run in (('legacy', run_legacy), ('current', run_current)):
+        best = min(repeat(lambda: run(rows), number=1, repeat=args.repeat))
+        results[name] = best / args.features * 1e6
+
+        print('{:>8}: {:8.2f} us/feature, {:8.2f} ms/response'.format(name, results[name], best * 1e3))
+
+    print(' speedup: {:.1f}x'.format(results['legacy'] / results['current']))
@@ -0,0 +1,637 @@
+#!/usr/bin/env python3
+
+"""
+Load test of a running instance of the application, by a synthetic mix of requests or by the replay of
+an access log, that reports the throughput, the latency percentiles and the error rate of each route.
+
+    python -m benchmarks.load --url http://localhost:5000 --concurrency 32 --duration 60
+    python -m benchmarks.load --url http://localhost:5000 --rate 200 --duration 60
+    python -m benchmarks.load --url http://localhost:5000 --replay access.log --speed 2
+    python -m benchmarks.load --serve --workers 4 --threads 8 --concurrency 64 --duration 30 --output load.json
+
+Without `--rate`, the requests are sent in a closed loop by `--concurrency` connections (i.e. each one
+sends a request after the previous response). With `--rate`, they arrive at random times (a Poisson process)
+whatever the responses, and their latency includes the time that they wait for a free connection.
+A replayed log keeps the intervals between the requests, divided by `--speed`, unless `--rate` is given.
+
+The access log can have the JSON lines of `inpe_stac.access` or the lines of a common log format
+(e.g. `"GET /stac/search?limit=10 HTTP/1.1"`). The POST requests of a log are skipped, since their bodies
+are not logged.
+
+`--serve` starts gunicorn with `--workers` and `--threads` over the synthetic catalog (see `benchmarks.catalog`),
+then the workers and the pools can be sized without a database server or network access.
+"""
+
+from argparse import ArgumentParser
+from datetime import datetime
+from http.client import HTTPConnection, HTTPException
+from json import dump, dumps, loads
+from os import environ, path
+from queue import Queue
+from random import Random
+from re import compile as compile_regex
+from subprocess import Popen
+from sys import executable
+from threading import Lock, Thread
+from time import perf_counter, sleep
+from urllib.parse import quote, urlsplit
+
+from benchmarks.catalog import DEFAULT_DB_PATH, load_catalog, make_sqlite_url
+
+
+# templates of the routes of the application, by the regex of their paths
+ROUTES = [
+    (compile_regex(r'^/collections/[^/]+/items/[^/]+$'), '/collections/<collection_id>/items/<item_id>'),
+    (compile_regex(r'^/collections/[^/]+/items$'), '/collections/<collection_id>/items'),
+    (compile_regex(r'^/collections/[^/]+$'), '/collections/<collection_id>'),
+    (compile_regex(r'^/collections$'), '/collections'),
+    (compile_regex(r'^/stac/search$'), '/stac/search'),
+    (compile_regex(r'^/stac/items$'), '/stac/items'),
+    (compile_regex(r'^/stac$'), '/stac'),
+    (compile_regex(r'^/conformance$'), '/conformance'),
+    (compile_regex(r'^/metrics$'), '/metrics'),
+    (compile_regex(r'^/$'), '/')
+]
+
+# request line of the common log format
+REQUEST_LINE_REGEX = compile_regex(r'"(GET|HEAD|POST|PUT|DELETE) (\S+) HTTP/[\d.]+"')
+
+# default weights of the requests of the synthetic mix
+DEFAULT_MIX = 'search_get=30,search_post=20,items=30,item=20'
+
+PERCENTILES = (50, 90, 95, 99)
+
+
+def get_route(method, url):
+    request_path = urlsplit(url).path.rstrip('/') or '/'
+
+    for regex, template in ROUTES:
+        if regex.match(request_path):
+            return '{} {}'.format(method, template)
+
+    return '{} other'.format(method)
+
+
+class Request:
+
+    def __init__(self, method, url, body=None, offset=None):
+        self.method = method
+        self.url = url
+        self.body = body
+        # seconds since the first request of a replayed log
+        self.offset = offset
+        self.route = get_route(method, url)
+
+
+##################################################
+# sources of requests
+##################################################
+
+def parse_access_log(file_path):
+    """
+    Return the requests of an access log and the number of skipped lines with requests (i.e. POST requests).
+    """
+
+    requests = []
+    skipped = 0
+    first_time = None
+
+    with open(file_path) as log_file:
+        for line in log_file:
+            line = line.strip()
+            start = line.find('{')
+
+            if start >= 0:
+                try:
+                    fields = loads(line[start:])
+                except ValueError:
+                    fields = None
+
+                if isinstance(fields, dict) and 'method' in fields and 'path' in fields:
+                    method = fields['method']
+                    url = fields['path'] + ('?' + fields['query'] if fields.get('query') else '')
+
+                    offset = None
+
+                    if fields.get('time'):
+                        time = datetime.fromisoformat(fields['time']).timestamp()
+                        first_time = time if first_time is None else first_time
+                        offset = time - first_time
+
+                    if method == 'POST':
+                        skipped += 1
+                    else:
+                        requests.append(Request(method, url, offset=offset))
+
+                    continue
+
+            match = REQUEST_LINE_REGEX.search(line)
+
+            if match:
+                if match.group(1) == 'POST':
+                    skipped += 1
+                else:
+                    requests.append(Request(match.group(1), match.group(2)))
+
+    return requests, skipped
+
+
+def parse_mix(mix):
+    weights = {}
+
+    for weight in mix.split(','):
+        name, _, value = weight.partition('=')
+        weights[name.strip()] = float(value)
+
+    return weights
+
+
+class RequestMix:
+    """
+    Random requests of the searches, of the items of the collections and of single items, whose collections,
+    extents and ids are read from the running instance.
+    """
+
+    def __init__(self, client, weights, seed=42):
+        self.random = Random(seed)
+        self.weights = weights
+        self.makers = {
+            'search_get': self.make_search_get,
+            'search_post': self.make_search_post,
+            'items': self.make_items,
+            'item': self.make_item
+        }
+
+        unknown = set(weights) - set(self.makers)
+
+        if unknown:
+            raise ValueError('unknown requests of the mix: {}'.format(', '.join(sorted(unknown))))
+
+        self.collections = [
+            c for c in client.get_json('/collections')['collections'] if c['extent']['spatial'][0] is not None
+        ]
+
+        if not self.collections:
+            raise ValueError('the instance does not have any collection with items')
+
+        self.items = {}
+
+        for collection in self.collections:
+            features = client.get_json('/collections/{}/items?limit=100'.format(quote(collection['id'])))['features']
+            self.items[collection['id']] = [feature['id'] for feature in features]
+
+        self.__lock = Lock()
+
+    def next(self):
+        with self.__lock:
+            name = self.random.choices(list(self.weights), weights=list(self.weights.values()))[0]
+
+            return self.makers[name]()
+
+    def make_bbox(self, collection):
+        min_x, min_y, max_x, max_y = collection['extent']['spatial']
+        size = self.random.choice((0.5, 2, 5))
+
+        x = self.random.uniform(min_x, max(min_x, max_x - size))
+        y = self.random.uniform(min_y, max(min_y, max_y - size))
+
+        return [round(x, 3), round(y, 3), round(x + size, 3), round(y + size, 3)]
+
+    def make_time(self, collection):
+        start, end = collection['extent']['temporal']
+        start = datetime.fromisoformat(start)
+        end = datetime.fromisoformat(end) if end else start
+
+        first = start + (end - start) * self.random.random()
+        last = first + (end - start) * self.random.choice((0.05, 0.2))
+
+        return '{}/{}'.format(first.date().isoformat(), last.date().isoformat())
+
+    def make_search_get(self):
+        collection = self.random.choice(self.collections)
+        params = ['limit={}'.format(self.random.choice((10, 50, 100)))]
+
+        if self.random.random() < 0.7:
+            params.append('bbox={}'.format(','.join(str(v) for v in self.make_bbox(collection))))
+        if self.random.random() < 0.5:
+            params.append('time={}'.format(self.make_time(collection)))
+        if self.random.random() < 0.5:
+            params.append('collections={}'.format(collection['id']))
+
+        return Request('GET', '/stac/search?' + '&'.join(params))
+
+    def make_search_post(self):
+        collection = self.random.choice(self.collections)
+        body = {'limit': self.random.choice((10, 50, 100)), 'collections': [collection['id']]}
+
+        if self.random.random() < 0.7:
+            body['bbox'] = self.make_bbox(collection)
+        if self.random.random() < 0.5:
+            body['query'] = {'cloud_cover': {'lt': self.random.choice((10, 20, 50))}}
+
+        return Request('POST', '/stac/search', body=dumps(body).encode())
+
+    def make_items(self):
+        collection = self.random.choice(self.collections)
+        params = ['limit={}'.format(self.random.choice((10, 50, 100))), 'page={}'.format(self.random.randint(1, 5))]
+
+        if self.random.random() < 0.3:
+            params.append('bbox={}'.format(','.join(str(v) for v in self.make_bbox(collection))))
+
+        return Request('GET', '/collections/{}/items?{}'.format(quote(collection['id']), '&'.join(params)))
+
+    def make_item(self):
+        collection = self.random.choice(self.collections)
+        item = self.random.choice(self.items[collection['id']] or ['missing'])
+
+        return Request('GET', '/collections/{}/items/{}'.format(quote(collection['id']), quote(item)))
+
+
+##################################################
+# load generator
+##################################################
+
+class Results:
+    """
+    Latencies (in seconds), bytes and errors of the responses, by route.
+    """
+
+    def __init__(self):
+        self.routes = {}
+        self.__lock = Lock()
+
+    def add(self, route, latency, size, error=None):
+        with self.__lock:
+            result = self.routes.get(route)
+
+            if result is None:
+                result = self.routes[route] = {'latencies': [], 'bytes': 0, 'errors': {}}
+
+            result['latencies'].append(latency)
+            result['bytes'] += size
+
+            if error is not None:
+                result['errors'][error] = result['errors'].get(error, 0) + 1
+
+    def summarize(self, elapsed):
+        summary = {}
+        everything = {'latencies': [], 'bytes': 0, 'errors': {}}
+
+        for route, result in sorted(self.routes.items()):
+            summary[route] = summarize_route(result, elapsed)
+
+            everything['latencies'] += result['latencies']
+            everything['bytes'] += result['bytes']
+
+            for error, count in result['errors'].items():
+                everything['errors'][error] = everything['errors'].get(error, 0) + count
+
+        summary['total'] = summarize_route(everything, elapsed)
+
+        return summary
+
+
+def get_percentile(values, percentile):
+    # nearest rank of the sorted values
+    return values[max(0, min(len(values) - 1, int(round(percentile / 100 * len(values) + 0.5)) - 1))]
+
+
+def summarize_route(result, elapsed):
+    latencies = sorted(result['latencies'])
+    requests = len(latencies)
+    errors = sum(result['errors'].values())
+
+    summary = {
+        'requests': requests,
+        'throughput': requests / elapsed if elapsed else 0,
+        'errors': errors,
+        'error_rate': errors / requests if requests else 0,
+        'error_kinds': result['errors'],
+        'mean_bytes': result['bytes'] / requests if requests else 0
+    }
+
+    for percentile in PERCENTILES:
+        summary['p{}_ms'.format(percentile)] = get_percentile(latencies, percentile) * 1000 if latencies else None
+
+    summary['max_ms'] = latencies[-1] * 1000 if latencies else None
+
+    return summary
+
+
+class Client:
+    """
+    Keep-alive connection of a worker thread, that is opened again after an error.
+    """
+
+    def __init__(self, url, timeout):
+        self.url = urlsplit(url)
+        self.timeout = timeout
+        self.connection = None
+
+    def send(self, request):
+        """
+        Return the status and the body of the response.
+        """
+
+        if self.connection is None:
+            self.connection = HTTPConnection(self.url.hostname, self.url.port or 80, timeout=self.timeout)
+
+        headers = {'Content-Type': 'application/json'} if request.body is not None else {}
+
+        try:
+            self.connection.request(request.method, self.url.path.rstrip('/') + request.url, request.body, headers)
+            response = self.connection.getresponse()
+
+            return response.status, response.read()
+        except (HTTPException, OSError):
+            self.connection.close()
+            self.connection = None
+            raise
+
+    def get_json(self, url):
+        status, body = self.send(Request('GET', url))
+
+        if status != 200:
+            raise RuntimeError('GET {} returned {}'.format(url, status))
+
+        return loads(body)
+
+
+def send(client, request, results, start_time):
+    try:
+        status, body = client.send(request)
+        size = len(body)
+        error = None if status < 400 else 'HTTP {}'.format(status)
+    except (HTTPException, OSError) as exception:
+        size, error = 0, type(exception).__name__
+
+    results.add(request.route, perf_counter() - start_time, size, error)
+
+
+def run_closed_loop(url, next_request, concurrency, deadline, timeout, results):
+    """
+    Each worker sends its next request after the previous response, until `deadline` or the end of the requests.
+    """
+
+    def work():
+        client = Client(url, timeout)
+
+        while perf_counter() < deadline:
+            request = next_request()
+
+            if request is None:
+                break
+
+            send(client, request, results, perf_counter())
+
+    workers = [Thread(target=work, daemon=True) for _ in range(concurrency)]
+
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+
+def run_open_loop(url, arrivals, concurrency, deadline, timeout, results):
+    """
+    Send the requests at their arrival times (i.e. `arrivals` yields `(seconds since the start, request)`),
+    whatever the responses. The latency is counted from the arrival, then it includes the queueing.
+    """
+
+    queue = Queue()
+    start_time = perf_counter()
+
+    def work():
+        client = Client(url, timeout)
+
+        while True:
+            item = queue.get()
+
+            if item is None:
+                break
+
+            arrival, request = item
+
+            send(client, request, results, arrival)
+
+    workers = [Thread(target=work, daemon=True) for _ in range(concurrency)]
+
+    for worker in workers:
+        worker.start()
+
+    for offset, request in arrivals:
+        arrival = start_time + offset
+
+        if arrival >= deadline:
+            break
+
+        delay = arrival - perf_counter()
+
+        if delay > 0:
+            sleep(delay)
+
+        queue.put((arrival, request))
+
+    for _ in workers:
+        queue.put(None)
+    for worker in workers:
+        worker.join()
+
+
+def iter_poisson_arrivals(next_request, rate, seed=42):
+    random = Random(seed)
+    offset = 0
+
+    while True:
+        request = next_request()
+
+        if request is None:
+            return
+
+        yield offset, request
+
+        offset += random.expovariate(rate)
+
+
+def iter_replay_arrivals(requests, speed):
+    for request in requests:
+        yield (request.offset or 0) / speed, request
+
+
+##################################################
+# server
+##################################################
+
+def start_server(args):
+    """
+    Start gunicorn over the synthetic catalog and wait until it answers.
+    """
+
+    if not path.exists(args.db):
+        load_catalog(make_sqlite_url(args.db), items=args.items)
+
+    env = dict(environ)
+    env.update({
+        'DB_URL': make_sqlite_url(args.db),
+        'GUNICORN_BIND': '127.0.0.1:{}'.format(args.port),
+        'GUNICORN_WORKERS': str(args.workers),
+        'GUNICORN_THREADS': str(args.threads),
+        'DB_POOL_SIZE': str(args.pool_size or args.threads),
+        # the load test measures the requests, not the writes of their logs
+        'INPE_STAC_ACCESS_LOG': env.get('INPE_STAC_ACCESS_LOG', '0')
+    })
+    env.setdefault('TIF_ROOT', 'http://www2.dgi.inpe.br/api/download/TIFF')
+    env.setdefault('PNG_ROOT', 'http://www2.dgi.inpe.br/api/download/PNG')
+
+    command = [executable, '-m', 'gunicorn', '--config', 'python:inpe_stac.gunicorn_conf']
+
+    if args.asgi:
+        command += ['--worker-class', 'uvicorn.workers.UvicornWorker', 'inpe_stac.asgi:app']
+    else:
+        command += ['inpe_stac.app:app']
+
+    server = Popen(command, env=env)
+    url = 'http://127.0.0.1:{}'.format(args.port)
+
+    for _ in range(600):
+        if server.poll() is not None:
+            raise RuntimeError('the server has exited with {}'.format(server.returncode))
+
+        try:
+            connection = HTTPConnection('127.0.0.1', args.port, timeout=5)
+            connection.request('GET', '/')
+
+            if connection.getresponse().status == 200:
+                return server, url
+        except OSError:
+            pass
+
+        sleep(0.1)
+
+    server.terminate()
+
+    raise RuntimeError('the server did not start')
+
+
+##################################################
+# command
+##################################################
+
+def print_summary(summary):
+    print('{:<50} {:>8} {:>9} {:>7} {:>9} {:>9} {:>9} {:>9}'.format(
+        'route', 'requests', 'req/s', 'errors', 'p50 ms', 'p95 ms', 'p99 ms', 'max ms'
+    ))
+
+    for route, s in summary.items():
+        print('{:<50} {:>8} {:>9.1f} {:>6.1%} {:>9.1f} {:>9.1f} {:>9.1f} {:>9.1f}'.format(
+            route, s['requests'], s['throughput'], s['error_rate'],
+            s['p50_ms'] or 0, s['p95_ms'] or 0, s['p99_ms'] or 0, s['max_ms'] or 0
+        ))
+
+
+def run(args):
+    if args.replay:
+        requests, skipped = parse_access_log(args.replay)
+
+        print('{} requests to replay, {} POST requests skipped'.format(len(requests), skipped))
+
+        iterator = iter(requests)
+        lock = Lock()
+
+        def next_request():
+            with lock:
+                return next(iterator, None)
+    else:
+        mix = RequestMix(Client(args.url, args.timeout), parse_mix(args.mix), seed=args.seed)
+
+        remaining = [args.requests]
+        lock = Lock()
+
+        def next_request():
+            with lock:
+                if args.requests:
+                    if remaining[0] <= 0:
+                        return None
+
+                    remaining[0] -= 1
+
+            return mix.next()
+
+    results = Results()
+    start_time = perf_counter()
+    deadline = start_time + args.duration if args.duration else float('inf')
+
+    if args.rate:
+        arrivals = iter_poisson_arrivals(next_request, args.rate, seed=args.seed)
+    elif args.replay and not args.closed_loop:
+        arrivals = iter_replay_arrivals(requests, args.speed)
+    else:
+        arrivals = None
+
+    if arrivals is None:
+        run_closed_loop(args.url, next_request, args.concurrency, deadline, args.timeout, results)
+    else:
+        run_open_loop(args.url, arrivals, args.concurrency, deadline, args.timeout, results)
+
+    elapsed = perf_counter() - start_time
+    summary = results.summarize(elapsed)
+
+    print_summary(summary)
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            dump({
+                'meta': {
+                    'url': args.url, 'concurrency': args.concurrency, 'rate': args.rate, 'duration': elapsed,
+                    'replay': args.replay, 'mix': None if args.replay else args.mix,
+                    'workers': args.workers if args.serve else None, 'threads': args.threads if args.serve else None,
+                    'asgi': args.asgi if args.serve else None
+                },
+                'routes': summary
+            }, output, indent=2, sort_keys=True)
+
+        print('results written to {}'.format(args.output))
+
+
+def main():
+    parser = ArgumentParser(description='Load test of a running instance of the application.')
+    parser.add_argument('--url', default='http://localhost:5000', help='base URL of the instance')
+    parser.add_argument('--concurrency', type=int, default=16, help='number of connections')
+    parser.add_argument('--rate', type=float, help='mean number of requests by second (open loop)')
+    parser.add_argument('--duration', type=float, default=30, help='seconds of the test (0 for no limit)')
+    parser.add_argument('--requests', type=int, default=0, help='number of requests of the mix (0 for no limit)')
+    parser.add_argument('--timeout', type=float, default=60, help='seconds to wait for a response')
+    parser.add_argument('--mix', default=DEFAULT_MIX, help='weights of the synthetic requests')
+    parser.add_argument('--seed', type=int, default=42, help='seed of the synthetic requests and arrivals')
+    parser.add_argument('--replay', help='access log whose requests are sent instead of the mix')
+    parser.add_argument('--speed', type=float, default=1, help='speed of the replay, relative to the log')
+    parser.add_argument('--closed-loop', action='store_true', help='replay the log as fast as the responses arrive')
+    parser.add_argument('--output', help='JSON file of the results')
+
+    server_group = parser.add_argument_group('server', 'start gunicorn over the synthetic catalog')
+    server_group.add_argument('--serve', action='store_true', help='start the instance instead of using `--url`')
+    server_group.add_argument('--workers', type=int, default=2, help='number of worker processes')
+    server_group.add_argument('--threads', type=int, default=4, help='number of threads by worker')
+    server_group.add_argument('--pool-size', type=int, help='connections by worker, by default `--threads`')
+    server_group.add_argument('--asgi', action='store_true', help='run the ASGI application by uvicorn workers')
+    server_group.add_argument('--port', type=int, default=5055, help='port of the instance')
+    server_group.add_argument('--db', default=DEFAULT_DB_PATH, help='SQLite file of the catalog, created if needed')
+    server_group.add_argument('--items', type=int, default=100000, help='number of scenes of a new catalog')
+
+    args = parser.parse_args()
+
+    server = None
+
+    if args.serve:
+        server, args.url = start_server(args)
+
+    try:
+        run(args)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == '__main__':
+    main()
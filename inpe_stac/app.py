@@ -7,16 +7,28 @@ Specification: https://github.com/radiantearth/stac-spec/blob/master/api-spec/ap
 OpenAPI definition: https://stacspec.org/STAC-ext-api.html
 """
 
-from flask import Flask, jsonify, request
+from flask import Flask, Response, abort, jsonify, request, stream_with_context
 from flasgger import Swagger
 from werkzeug.exceptions import BadRequest
+from werkzeug.urls import url_encode
 
 from inpe_stac.data import get_collections, get_collection_items, \
-                            make_json_items, make_json_collection
-from inpe_stac.environment import BASE_URI, API_VERSION
-from inpe_stac.log import logging
+                            make_json_items, make_json_collection, iter_json_items, \
+                            make_json_items_by_ids, collection_catalog
+from inpe_stac.environment import BASE_URI, API_VERSION, INPE_STAC_STREAM_MIN_LIMIT, INPE_STAC_BULK_MAX_IDS, \
+                                  INPE_STAC_ACCESS_LOG, INPE_STAC_SERVER_TIMING, INPE_STAC_METRICS
+from inpe_stac.log import get_logger, log_access
+from inpe_stac.timing import start_request, end_request, get_request_timings
 from inpe_stac.decorator import log_function_header, log_function_footer, \
                                 catch_generic_exceptions
+from inpe_stac.http_cache import cached_response
+from inpe_stac.fields import parse_fields
+from inpe_stac.export import make_export_query, iter_export_rows, iter_ndjson_items, NDJSON_MIMETYPE
+from inpe_stac.metrics import record_request, render_metrics
+from inpe_stac.compression import compress_response
+
+
+logger = get_logger(__name__)
 
 
 app = Flask(__name__)
@@ -31,12 +43,157 @@ app.config["SWAGGER"] = {
 swagger = Swagger(app, template_file="./spec/api/v0.7/STAC.yaml")
 
 
+@app.before_request
+def before_request():
+    start_request()
+
+
 @app.after_request
 def after_request(response):
     response.headers.add('Access-Control-Allow-Origin', '*')
+
+    # the cached responses have been compressed already (see `cached_response`)
+    response = compress_response(response)
+
+    timings = get_request_timings()
+
+    if timings is not None:
+        # the stages of a streamed response that happen while it is being written are not inside the header
+        if INPE_STAC_SERVER_TIMING:
+            response.headers['Server-Timing'] = timings.get_server_timing()
+
+        close_request(response, timings)
+
     return response
 
 
+def close_request(response, timings):
+    """
+    Write the access log and the metrics of the request after its response has been sent (i.e. when it is closed),
+    then the time of a streamed response is complete.
+    """
+
+    route = request.url_rule.rule if request.url_rule is not None else None
+
+    fields = {
+        'method': request.method,
+        'path': request.path,
+        'query': request.query_string.decode('latin1'),
+        'status': response.status_code,
+        'remote_addr': request.remote_addr
+    }
+
+    def close():
+        if INPE_STAC_ACCESS_LOG:
+            # the length of a streamed response is unknown
+            fields['bytes'] = response.content_length
+            fields['rows'] = timings.rows
+            fields['duration_ms'] = round(timings.get_elapsed() * 1000, 3)
+            fields['timings_ms'] = {stage: round(seconds * 1000, 3) for stage, seconds in timings.stages.items()}
+
+            log_access(fields)
+
+        if INPE_STAC_METRICS:
+            record_request(route, fields['method'], fields['status'], timings)
+
+        end_request()
+
+    response.call_on_close(close)
+
+
+def make_cached_response(key, build):
+    """
+    Return the JSON response of a document built from the collections.
+    The document is encoded just once while the collections do not change.
+    """
+
+    body = collection_catalog.memoize(key, lambda: jsonify(build()).get_data())
+
+    return Response(body, mimetype=app.config['JSONIFY_MIMETYPE'])
+
+
+def get_count_mode(context):
+    """
+    Return the way of getting the number of matched items from the `context` parameter.
+    """
+
+    if context is None:
+        return 'exact'
+
+    if context not in ('exact', 'estimate', 'none'):
+        raise BadRequest('`context` parameter must be `exact`, `estimate` or `none`')
+
+    return context
+
+
+def get_context_page(params):
+    """
+    Return the `page` of the context: the first page of a search paginated by keyset is the page 1,
+    the next ones (i.e. by `token`) have not a number.
+    """
+
+    if params['token'] is not None:
+        return None
+
+    return params['page'] if params['page'] is not None else 1
+
+
+def make_items_response(items, links, context, tracker=None, stream=False, fields=None):
+    """
+    Return the items as a FeatureCollection, that is encoded directly to bytes.
+    If `stream` is True, then it is a chunked response, that is written while the rows are read from the database.
+    """
+
+    chunks = iter_json_items(
+        items, links, context, complete=lambda members: add_next_page(members, tracker), fields=fields
+    )
+
+    if stream:
+        return Response(stream_with_context(chunks), mimetype='application/json')
+
+    return Response(b''.join(chunks), mimetype='application/json')
+
+
+def make_export_response(export_query):
+    """
+    Return the items of an `ExportQuery` as a chunked response of newline-delimited GeoJSON Features.
+    """
+
+    return Response(stream_with_context(iter_ndjson_items(iter_export_rows(export_query))), mimetype=NDJSON_MIMETYPE)
+
+
+def add_next_page(gjson, tracker):
+    """
+    If the items have been paginated by keyset, then add the token of the next page
+    to the `context` and the `next` link to the FeatureCollection.
+    """
+
+    if tracker is None:
+        return
+
+    token = tracker.next_token()
+
+    gjson['context']['next'] = token
+
+    # there is not a next page
+    if token is None:
+        return
+
+    if request.method == 'POST':
+        link = {
+            'href': f'{BASE_URI}stac/search', 'rel': 'next',
+            'method': 'POST', 'body': {'token': token}, 'merge': True
+        }
+    else:
+        args = request.args.copy()
+        args.pop('page', None)
+        args['token'] = token
+
+        link = {'href': f'{BASE_URI}{request.path[1:]}?{url_encode(args)}', 'rel': 'next'}
+
+    gjson['links'] = [link]
+
+
 ##################################################
 # OGC API - Features Endpoints
 # Specification: https://github.com/radiantearth/stac-spec/blob/master/api-spec/api-spec.md#ogc-api---features-endpoints
@@ -77,6 +234,7 @@ def conformance():
 
 
 @app.route("/collections", methods=["GET"])
+@cached_response
 @log_function_header
 @log_function_footer
 @catch_generic_exceptions
@@ -85,21 +243,25 @@ def collections():
     Specification: https://github.com/radiantearth/stac-spec/blob/v0.7.0/collection-spec/collection-spec.md#collection-fields
     """
 
-    result = get_collections()
+    def make_collections():
+        result = get_collections()
 
-    collections = {
-        'collections': []
-    }
+        collections = {
+            'collections': []
+        }
 
-    for collection in result:
-        collections['collections'].append(
-            make_json_collection(collection)
-        )
+        for collection in result or []:
+            collections['collections'].append(
+                make_json_collection(collection)
+            )
 
-    return jsonify(collections)
+        return collections
+
+    return make_cached_response('collections', make_collections)
 
 
 @app.route("/collections/<collection_id>", methods=["GET"])
+@cached_response
 @log_function_header
 @log_function_footer
 @catch_generic_exceptions
@@ -115,12 +277,13 @@ def collections_collections_id(collection_id):
         return jsonify({})
 
     # get the only one element inside the list and create the GeoJSON related to collection
-    collection = make_json_collection(result[0])
-
-    return jsonify(collection)
+    return make_cached_response(
+        ('collection', collection_id), lambda: make_json_collection(result[0])
+    )
 
 
 @app.route("/collections/<collection_id>/items", methods=["GET"])
+@cached_response
 @log_function_header
 @log_function_footer
 @catch_generic_exceptions
@@ -136,12 +299,20 @@ def collections_collections_id_items(collection_id):
         'bbox': request.args.get('bbox', None),
         'time': request.args.get('time', None),
         'intersects': request.args.get('intersects', None),
-        'page': int(request.args.get('page', 1)),
+        # if there is not a page, then the items are paginated by keyset
+        'page': request.args.get('page', None, type=int),
         'limit': int(request.args.get('limit', 10)),
-        'ids': request.args.get('ids', None)
+        'ids': request.args.get('ids', None),
+        'token': request.args.get('token', None),
+        'count': get_count_mode(request.args.get('context', None)),
+        'sortby': request.args.get('sortby', None),
+        'fields': parse_fields(request.args.get('fields', None))
     }
 
-    items, matched, _ = get_collection_items(**params)
+    # large pages are streamed instead of being built in memory
+    stream = params['limit'] >= INPE_STAC_STREAM_MIN_LIMIT
+
+    items, matched, _, tracker = get_collection_items(**params, stream=stream)
 
     links = [
         {"href": f"{BASE_URI}collections/", "rel": "self"},
@@ -150,30 +321,25 @@ def collections_collections_id_items(collection_id):
         {"href": f"{BASE_URI}stac", "rel": "root"}
     ]
 
-    items_collection = make_json_items(items, links)
-
-    items_collection['context'] = {
-        "page": params['page'],
+    return make_items_response(items, links, {
+        "page": get_context_page(params),
         "limit": params['limit'],
         "matched": matched,
-        "returned": len(items_collection['features']),
+        "returned": None,
         "meta": None
-    }
-
-    return jsonify(items_collection)
+    }, tracker, stream=stream, fields=params['fields'])
 
 
 @app.route("/collections/<collection_id>/items/<item_id>", methods=["GET"])
+@cached_response
 @log_function_header
 @log_function_footer
 @catch_generic_exceptions
 def collections_collections_id_items_items_id(collection_id, item_id):
-    logging.info('collections_collections_id_items_items_id()')
-
-    logging.info('collections_collections_id_items_items_id() - collection_id: %s', collection_id)
-    logging.info('collections_collections_id_items_items_id() - item_id: %s', item_id)
+    logger.debug('collections_collections_id_items_items_id() - collection_id: %s, item_id: %s', collection_id, item_id)
 
-    item, _, _ = get_collection_items(collection_id=collection_id, item_id=item_id)
+    # just one item is searched, then it is not paginated by keyset
+    item, _, _, _ = get_collection_items(collection_id=collection_id, item_id=item_id, page=1)
 
     links = [
         {"href": f"{BASE_URI}collections/", "rel": "self"},
@@ -184,11 +350,6 @@ def collections_collections_id_items_items_id(collection_id, item_id):
 
     gjson = make_json_items(item, links)
 
-    logging.info('collections_collections_id_items_items_id() - gjson: %s', gjson)
-
-    logging.info('collections_collections_id_items_items_id() - features: %s', gjson['features'])
-    logging.info('collections_collections_id_items_items_id() - features: %s', bool(gjson['features']))
-
     if gjson['features']:
         # I'm looking for one item by item_id, ergo just one feature will be returned,
         # then I get this one feature in order to return it
@@ -197,12 +358,38 @@ def collections_collections_id_items_items_id(collection_id, item_id):
     return jsonify(gjson)
 
 
+@app.route("/collections/<collection_id>/export", methods=["GET"])
+@log_function_header
+@log_function_footer
+@catch_generic_exceptions
+def collections_collections_id_export(collection_id):
+    """
+    Export all items of the collection as newline-delimited GeoJSON Features, in order of id (see `inpe_stac.export`).
+    An interrupted export is resumed by the id of its last item (i.e. `after`).
+
+    Example of full route:
+        - http://localhost:8089/inpe-stac/collections/CBERS4A_MUX_L2_DN/export?after=CBERS4AMUX20913220200115
+    """
+
+    export_query = make_export_query(
+        collections=[collection_id],
+        bbox=request.args.get('bbox', None),
+        time=request.args.get('time', None),
+        query=request.args.get('query', None),
+        intersects=request.args.get('intersects', None),
+        after=request.args.get('after', None)
+    )
+
+    return make_export_response(export_query)
+
+
 ##################################################
 # STAC Endpoints
 # Specification: https://github.com/radiantearth/stac-spec/blob/master/api-spec/api-spec.md#stac-endpoints
 ##################################################
 
 @app.route("/stac", methods=["GET"])
+@cached_response
 @log_function_header
 @log_function_footer
 @catch_generic_exceptions
@@ -211,86 +398,100 @@ def stac():
     Specification: https://github.com/radiantearth/stac-spec/blob/v0.7.0/catalog-spec/catalog-spec.md#catalog-fields
     """
 
-    collections = get_collections()
+    def make_catalog():
+        collections = get_collections()
+
+        catalog = {
+            "stac_version": API_VERSION,
+            "id": "inpe-stac",
+            "description": "INPE STAC Catalog",
+            "links": [
+                {
+                    "href": f"{BASE_URI}stac",
+                    "rel": "self"
+                }
+            ]
+        }
 
-    catalog = {
-        "stac_version": API_VERSION,
-        "id": "inpe-stac",
-        "description": "INPE STAC Catalog",
-        "links": [
-            {
-                "href": f"{BASE_URI}stac",
-                "rel": "self"
-            }
-        ]
-    }
+        for collection in collections or []:
+            catalog["links"].append(
+                {
+                    "href": f"{BASE_URI}collections/{collection['id']}",
+                    "rel": "child",
+                    "title": collection['id']
+                }
+            )
 
-    for collection in collections:
-        catalog["links"].append(
-            {
-                "href": f"{BASE_URI}collections/{collection['id']}",
-                "rel": "child",
-                "title": collection['id']
-            }
-        )
+        return catalog
 
-    return jsonify(catalog)
+    return make_cached_response('stac', make_catalog)
 
 
 @app.route("/stac/search", methods=["GET", "POST"])
+@cached_response
 @log_function_header
 @log_function_footer
 @catch_generic_exceptions
 def stac_search():
-    logging.info('stac_search()')
-
-    logging.info('stac_search() - method: %s', request.method)
+    logger.debug('stac_search() - method: %s', request.method)
 
     if request.method == "POST":
         if request.is_json:
             request_json = request.get_json()
 
-            logging.info('stac_search() - request_json: %s', request_json)
+            logger.debug('stac_search() - request_json: %s', request_json)
 
             params = {
                 'bbox': request_json.get('bbox', None),
+                'intersects': request_json.get('intersects', None),
                 'time': request_json.get('time', None),
                 'ids': request_json.get('ids', None),
                 'collections': request_json.get('collections', None),
-                'page': int(request_json.get('page', 1)),
+                # if there is not a page, then the items are paginated by keyset
+                'page': int(request_json['page']) if 'page' in request_json else None,
                 'limit': int(request_json.get('limit', 10)),
-                'query': request_json.get('query', None)
+                'query': request_json.get('query', None),
+                'token': request_json.get('token', None),
+                'count': get_count_mode(request_json.get('context', None)),
+                'sortby': request_json.get('sortby', None),
+                'fields': parse_fields(request_json.get('fields', None))
             }
 
             if params['bbox'] is not None:
                 params['bbox'] = ','.join([str(x) for x in params['bbox']])
 
-            if params['ids'] is not None:
-                params['ids'] = ','.join([id for id in params['ids']])
-
             # if params['collections'] is not None:
             #     params['collections'] = ','.join([collection for collection in params['collections']])
         else:
             raise BadRequest('POST Request must be an application/json')
 
     elif request.method == 'GET':
-        logging.info('stac_search() - request.args: %s', request.args)
+        logger.debug('stac_search() - request.args: %s', request.args)
 
         params = {
             'bbox': request.args.get('bbox', None),
+            'intersects': request.args.get('intersects', None),
             'time': request.args.get('time', None),
             'ids': request.args.get('ids', None),
             'collections': request.args.get('collections', None),
-            'page': int(request.args.get('page', 1)),
-            'limit': int(request.args.get('limit', 10))
+            # if there is not a page, then the items are paginated by keyset
+            'page': request.args.get('page', None, type=int),
+            'limit': int(request.args.get('limit', 10)),
+            'token': request.args.get('token', None),
+            'count': get_count_mode(request.args.get('context', None)),
+            'sortby': request.args.get('sortby', None),
+            'fields': parse_fields(request.args.get('fields', None))
         }
 
         if isinstance(params['collections'], str):
             params['collections'] = params['collections'].split(',')
 
-    logging.info('stac_search() - params: %s', params)
+    logger.debug('stac_search() - params: %s', params)
+
+    # large pages are streamed instead of being built in memory
+    stream = params['limit'] >= INPE_STAC_STREAM_MIN_LIMIT
 
-    items, matched, metadata_related_to_collections = get_collection_items(**params)
+    items, matched, metadata_related_to_collections, tracker = get_collection_items(**params, stream=stream)
 
     links = [
         {'href': f'{BASE_URI}collections/', 'rel': 'self'},
@@ -299,17 +500,92 @@ def stac_search():
         {'href': f'{BASE_URI}stac', 'rel': 'root'}
     ]
 
-    gjson = make_json_items(items, links=links)
-
-    gjson['context'] = {
-        'page': params['page'],
+    return make_items_response(items, links, {
+        'page': get_context_page(params),
         'limit': params['limit'],
         'matched': matched,
-        'returned': len(gjson['features']),
+        'returned': None,
         'meta': None if not metadata_related_to_collections else metadata_related_to_collections
-    }
+    }, tracker, stream=stream, fields=params['fields'])
 
-    return jsonify(gjson)
+
+@app.route("/stac/export", methods=["GET", "POST"])
+@log_function_header
+@log_function_footer
+@catch_generic_exceptions
+def stac_export():
+    """
+    Export the items of the filters (i.e. the ones of `/stac/search`, without pagination) as newline-delimited
+    GeoJSON Features, in order of id (see `inpe_stac.export`). An interrupted export is resumed by the id
+    of its last item (i.e. `after`).
+    """
+
+    if request.method == "POST":
+        if not request.is_json:
+            raise BadRequest('POST Request must be an application/json')
+
+        params = request.get_json()
+
+        if params.get('bbox', None) is not None:
+            params['bbox'] = ','.join([str(x) for x in params['bbox']])
+    else:
+        params = request.args
+
+    export_query = make_export_query(
+        collections=params.get('collections', None),
+        bbox=params.get('bbox', None),
+        time=params.get('time', None),
+        query=params.get('query', None),
+        intersects=params.get('intersects', None),
+        after=params.get('after', None)
+    )
+
+    return make_export_response(export_query)
+
+
+@app.route("/stac/items", methods=["POST"])
+@log_function_header
+@log_function_footer
+@catch_generic_exceptions
+def stac_items():
+    """
+    Return the items of a list of ids as a FeatureCollection, in the order of the ids.
+
+    Example of body:
+        {"ids": ["CBERS4MUX15713220191231", "CBERS4MUX15713320191231"]}
+    """
+
+    if not request.is_json:
+        raise BadRequest('POST Request must be an application/json')
+
+    ids = request.get_json().get('ids', None)
+
+    if not isinstance(ids, list) or not all(isinstance(id, str) for id in ids):
+        raise BadRequest('`ids` field must be a list of strings')
+
+    if len(ids) > INPE_STAC_BULK_MAX_IDS:
+        raise BadRequest('`ids` field must have up to {} ids'.format(INPE_STAC_BULK_MAX_IDS))
+
+    links = [
+        {'href': f'{BASE_URI}collections/', 'rel': 'self'},
+        {'href': f'{BASE_URI}collections/', 'rel': 'parent'},
+        {'href': f'{BASE_URI}collections/', 'rel': 'collection'},
+        {'href': f'{BASE_URI}stac', 'rel': 'root'}
+    ]
+
+    return Response(make_json_items_by_ids(ids, links), mimetype='application/json')
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    """
+    Metrics of all worker processes in the Prometheus text format (see `inpe_stac.metrics`).
+    """
+
+    if not INPE_STAC_METRICS:
+        abort(404)
+
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
 
 
 ##################################################
@@ -0,0 +1,156 @@
+"""
+Asynchronous variant of the STAC API, as an ASGI application:
+
+    uvicorn inpe_stac.asgi:app
+    gunicorn --config python:inpe_stac.gunicorn_conf --worker-class uvicorn.workers.UvicornWorker inpe_stac.asgi:app
+
+The routes and the serialization are the ones of `inpe_stac.app`, then the responses are the same bytes.
+Each request is executed by the Flask application inside a greenlet (see `inpe_stac.concurrency`), where the
+queries are awaited on a pool of the async MySQL driver (see `DB_ASYNC_POOL_*`). Then a process keeps
+hundreds of requests in flight on one thread, instead of one request by worker thread.
+"""
+
+from io import BytesIO
+from sys import stderr
+
+from inpe_stac.app import app as wsgi_app
+from inpe_stac.concurrency import await_only, greenlet_spawn
+from inpe_stac.data import collection_catalog
+from inpe_stac.database import close_async_pool
+from inpe_stac.log import get_logger
+
+
+logger = get_logger(__name__)
+
+
+def make_environ(scope, body):
+    """
+    Create the WSGI environ of an ASGI HTTP request (https://www.python.org/dev/peps/pep-3333/).
+    """
+
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf8').decode('latin1'),
+        # WSGI strings are the bytes of the request decoded as latin-1
+        'PATH_INFO': scope['path'].encode('utf8').decode('latin1'),
+        'QUERY_STRING': scope['query_string'].decode('latin1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': 'HTTP/{}'.format(scope.get('http_version', '1.1')),
+        'REMOTE_ADDR': client[0],
+        'REMOTE_PORT': str(client[1]),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': BytesIO(body),
+        'wsgi.errors': stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False
+    }
+
+    for name, value in scope['headers']:
+        name = name.decode('latin1').upper().replace('-', '_')
+        value = value.decode('latin1')
+
+        if name == 'CONTENT_TYPE':
+            key = 'CONTENT_TYPE'
+        elif name == 'CONTENT_LENGTH':
+            key = 'CONTENT_LENGTH'
+        else:
+            key = 'HTTP_' + name
+
+        # repeated headers are joined, as a proxy does
+        environ[key] = environ[key] + ',' + value if key in environ else value
+
+    return environ
+
+
+def call_wsgi_app(environ, send):
+    """
+    Execute the Flask application and send its response, chunk by chunk. It runs inside a greenlet,
+    then the queries of the application and the writes of the response do not block the event loop.
+    """
+
+    started = {}
+
+    def start_response(status, headers, exc_info=None):
+        started['status'] = int(status.split(' ', 1)[0])
+        started['headers'] = [(name.lower().encode('latin1'), value.encode('latin1')) for name, value in headers]
+
+    def send_start():
+        await_only(send({
+            'type': 'http.response.start', 'status': started['status'], 'headers': started['headers']
+        }))
+
+    chunks = wsgi_app(environ, start_response)
+
+    try:
+        sent = False
+
+        for chunk in chunks:
+            if not sent:
+                send_start()
+                sent = True
+
+            if chunk:
+                await_only(send({'type': 'http.response.body', 'body': chunk, 'more_body': True}))
+
+        if not sent:
+            send_start()
+
+        await_only(send({'type': 'http.response.body', 'body': b''}))
+    finally:
+        if hasattr(chunks, 'close'):
+            chunks.close()
+
+
+async def read_body(receive):
+    body = []
+
+    while True:
+        message = await receive()
+
+        if message['type'] == 'http.disconnect':
+            break
+
+        body.append(message.get('body', b''))
+
+        if not message.get('more_body', False):
+            break
+
+    return b''.join(body)
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+
+        if message['type'] == 'lifespan.startup':
+            try:
+                # the collections are loaded before the first request
+                await greenlet_spawn(collection_catalog.refresh, force=True)
+            except Exception:
+                # the requests load the collections by their own if the database is not available yet
+                logger.exception('lifespan() - the collections could not be loaded')
+
+            await send({'type': 'lifespan.startup.complete'})
+
+        elif message['type'] == 'lifespan.shutdown':
+            await close_async_pool()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+
+    if scope['type'] != 'http':
+        raise NotImplementedError('Unsupported ASGI scope: {}'.format(scope['type']))
+
+    environ = make_environ(scope, await read_body(receive))
+
+    await greenlet_spawn(call_wsgi_app, environ, send)
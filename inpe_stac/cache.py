@@ -0,0 +1,125 @@
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic
+
+
+class TTLCache:
+    """
+    Thread-safe cache, whose entries expire after `ttl` seconds.
+    When there are more than `max_size` entries, the least recently used one is removed.
+    """
+
+    def __init__(self, ttl, max_size=1024):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+        self.__entries = OrderedDict()
+        self.__lock = Lock()
+
+    def get(self, key, default=None):
+        with self.__lock:
+            entry = self.__entries.get(key)
+
+            if entry is None or entry[0] < monotonic():
+                if entry is not None:
+                    del self.__entries[key]
+
+                self.misses += 1
+                return default
+
+            self.__entries.move_to_end(key)
+            self.hits += 1
+
+            return entry[1]
+
+    def set(self, key, value, ttl=None):
+        expires_at = monotonic() + (self.ttl if ttl is None else ttl)
+
+        with self.__lock:
+            self.__entries[key] = (expires_at, value)
+            self.__entries.move_to_end(key)
+
+            while len(self.__entries) > self.max_size:
+                self.__entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.__lock:
+            self.__entries.pop(key, None)
+
+    def clear(self):
+        with self.__lock:
+            self.__entries.clear()
+
+    def __len__(self):
+        return len(self.__entries)
+
+
+class SizedLRUCache:
+    """
+    Thread-safe LRU cache, limited by the number of entries (`max_size`) and by the sum
+    of their sizes in bytes (`max_bytes`). Values bigger than `max_item_bytes` are not kept.
+    If `max_age` is given, then the entries expire after `max_age` seconds.
+    """
+
+    def __init__(self, max_size=1024, max_bytes=64 * 1024 * 1024, max_item_bytes=1024 * 1024, max_age=None):
+        self.max_size = max_size
+        self.max_bytes = max_bytes
+        self.max_item_bytes = max_item_bytes
+        self.max_age = max_age
+        self.size_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+        self.__entries = OrderedDict()
+        self.__lock = Lock()
+
+    def get(self, key, default=None):
+        with self.__lock:
+            entry = self.__entries.get(key)
+
+            if entry is None or (entry[2] is not None and entry[2] < monotonic()):
+                if entry is not None:
+                    del self.__entries[key]
+                    self.size_bytes -= entry[0]
+
+                self.misses += 1
+                return default
+
+            self.__entries.move_to_end(key)
+            self.hits += 1
+
+            return entry[1]
+
+    def set(self, key, value, size):
+        """
+        Keep `value`, whose size is `size` bytes. Return False if it is too big to be kept.
+        """
+
+        if size > self.max_item_bytes or size > self.max_bytes:
+            return False
+
+        with self.__lock:
+            old = self.__entries.pop(key, None)
+
+            if old is not None:
+                self.size_bytes -= old[0]
+
+            expires_at = monotonic() + self.max_age if self.max_age is not None else None
+
+            self.__entries[key] = (size, value, expires_at)
+            self.size_bytes += size
+
+            while len(self.__entries) > self.max_size or self.size_bytes > self.max_bytes:
+                self.size_bytes -= self.__entries.popitem(last=False)[1][0]
+
+        return True
+
+    def clear(self):
+        with self.__lock:
+            self.__entries.clear()
+            self.size_bytes = 0
+
+    def __len__(self):
+        return len(self.__entries)
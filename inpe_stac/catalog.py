@@ -0,0 +1,98 @@
+from hashlib import sha1
+from time import monotonic
+
+from inpe_stac.log import get_logger
+from inpe_stac.concurrency import Lock
+
+
+logger = get_logger(__name__)
+
+
+class CollectionCatalog:
+    """
+    Process-level cache of the `stac_collection` rows and of the documents rendered from them.
+
+    The rows are loaded by `load` (a function that returns a list of dicts with an `id` key).
+    After `ttl` seconds the rows are loaded again and, if they have changed, the rendered
+    documents are discarded. Otherwise, the documents are kept.
+    """
+
+    def __init__(self, load, ttl):
+        self.load = load
+        self.ttl = ttl
+        # incremented each time the rows change
+        self.version = 0
+        # hash of the rows, that is the same in all processes
+        self.digest = None
+
+        self.__rows = None
+        self.__by_id = {}
+        self.__documents = {}
+        self.__expires_at = 0
+        # it is held while the rows are loaded, then it must not block the event loop of the ASGI application
+        self.__lock = Lock()
+
+    def refresh(self, force=False):
+        if not force and self.__rows is not None and self.__expires_at > monotonic():
+            return
+
+        with self.__lock:
+            # another thread may have refreshed the rows while this one was waiting for the lock
+            if not force and self.__rows is not None and self.__expires_at > monotonic():
+                return
+
+            rows = self.load() or []
+
+            if rows != self.__rows:
+                logger.info('CollectionCatalog.refresh() - %s collections have been loaded', len(rows))
+
+                self.__by_id = {row['id']: row for row in rows}
+                self.__documents = {}
+                self.__rows = rows
+                self.version += 1
+                self.digest = sha1(repr(rows).encode()).hexdigest()
+
+            self.__expires_at = monotonic() + self.ttl
+
+    def invalidate(self):
+        with self.__lock:
+            self.__expires_at = 0
+
+    def get_rows(self, collection_id=None):
+        """
+        Return all rows or the row of `collection_id` inside a list. Return None if there is not any row.
+        """
+
+        self.refresh()
+
+        if collection_id is None:
+            return self.__rows or None
+
+        row = self.__by_id.get(collection_id)
+
+        return [row] if row is not None else None
+
+    def get_digest(self):
+        self.refresh()
+
+        return self.digest
+
+    def exists(self, collection_id):
+        self.refresh()
+
+        return collection_id in self.__by_id
+
+    def memoize(self, key, build):
+        """
+        Return the document `key` built by `build()` from the current rows.
+        It is built again just after the rows have changed.
+        """
+
+        self.refresh()
+
+        documents = self.__documents
+
+        if key not in documents:
+            documents[key] = build()
+
+        return documents[key]
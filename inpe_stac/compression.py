@@ -0,0 +1,231 @@
+"""
+Compression of the responses, negotiated by the `Accept-Encoding` header of the requests.
+
+The encodings of `INPE_STAC_COMPRESSION` are used in this order of preference, when the client accepts them:
+`zstd` (if `zstandard` is installed), `br` (if `brotli` is installed) and `gzip`. The level of each encoding
+can be set by route (see `parse_levels`) and the bodies smaller than `INPE_STAC_COMPRESSION_MIN_SIZE` bytes
+are sent as they are.
+
+A streamed response is compressed chunk by chunk and each compressed chunk is flushed, then the client decodes
+the features while the next ones are read from the database. The compressed bodies of the cached responses are
+kept in the same cache (see `inpe_stac.http_cache`), then a repeated request is not compressed again.
+"""
+
+import zlib
+
+from time import perf_counter
+
+from flask import request
+
+from inpe_stac.timing import add_timing
+from inpe_stac.environment import INPE_STAC_COMPRESSION, INPE_STAC_COMPRESSION_LEVELS, \
+                                  INPE_STAC_COMPRESSION_MIN_SIZE
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+DEFAULT_LEVELS = {'gzip': 6, 'br': 4, 'zstd': 3}
+
+COMPRESSIBLE_MIMETYPES = {
+    'application/json', 'application/geo+json', 'application/x-ndjson', 'application/javascript'
+}
+
+
+class GzipCompressor:
+
+    def __init__(self, level):
+        self.__compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data):
+        # each chunk is flushed, then the client can decode it before the next one arrives
+        return self.__compressor.compress(data) + self.__compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self.__compressor.flush()
+
+
+class BrotliCompressor:
+
+    def __init__(self, level):
+        self.__compressor = brotli.Compressor(quality=level)
+
+    def compress(self, data):
+        return self.__compressor.process(data) + self.__compressor.flush()
+
+    def finish(self):
+        return self.__compressor.finish()
+
+
+class ZstdCompressor:
+
+    def __init__(self, level):
+        self.__compressor = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data):
+        return self.__compressor.compress(data) + self.__compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self):
+        return self.__compressor.flush()
+
+
+COMPRESSORS = {'gzip': GzipCompressor}
+
+if brotli is not None:
+    COMPRESSORS['br'] = BrotliCompressor
+
+if zstandard is not None:
+    COMPRESSORS['zstd'] = ZstdCompressor
+
+
+def parse_levels(levels):
+    """
+    Return the levels of a string like `gzip=6,zstd=3,/stac/export:gzip=1` by `(route, encoding)`,
+    where the route is the rule of the view (e.g. `/collections/<collection_id>/items`) or None for all routes.
+    """
+
+    result = {}
+
+    for level in levels.split(','):
+        if not level.strip():
+            continue
+
+        key, _, value = level.partition('=')
+        route, _, encoding = key.strip().rpartition(':')
+
+        result[(route or None, encoding)] = int(value)
+
+    return result
+
+
+# encodings that can be sent, in order of preference
+ENCODINGS = [encoding.strip() for encoding in INPE_STAC_COMPRESSION.split(',') if encoding.strip() in COMPRESSORS]
+
+LEVELS = parse_levels(INPE_STAC_COMPRESSION_LEVELS)
+
+
+def get_level(encoding, route=None):
+    return LEVELS.get((route, encoding), LEVELS.get((None, encoding), DEFAULT_LEVELS[encoding]))
+
+
+def negotiate(accept_encodings):
+    """
+    Return the encoding with the highest quality inside `accept_encodings` (i.e. `request.accept_encodings`),
+    the ties are broken by the order of `ENCODINGS`. Return None if none of them is accepted.
+    """
+
+    result, result_quality = None, 0
+
+    for encoding in ENCODINGS:
+        quality = accept_encodings.quality(encoding)
+
+        if quality > result_quality:
+            result, result_quality = encoding, quality
+
+    return result
+
+
+def is_compressible(response):
+    return (
+        response.status_code == 200 and
+        'Content-Encoding' not in response.headers and
+        not response.direct_passthrough and
+        (response.mimetype in COMPRESSIBLE_MIMETYPES or response.mimetype.startswith('text/'))
+    )
+
+
+def compress(data, encoding, level):
+    compressor = COMPRESSORS[encoding](level)
+
+    return compressor.compress(data) + compressor.finish()
+
+
+def iter_compressed(chunks, compressor, charset='utf-8'):
+    """
+    Yield the compressed chunks of a streamed body. The time of the compression is added
+    to the `compress` stage when the body has been written.
+    """
+
+    compress_time = 0
+
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode(charset)
+
+            start_time = perf_counter()
+            data = compressor.compress(chunk)
+            compress_time += perf_counter() - start_time
+
+            if data:
+                yield data
+
+        yield compressor.finish()
+    finally:
+        # the body is closed by the response (e.g. the server-side cursor is given back)
+        if hasattr(chunks, 'close'):
+            chunks.close()
+
+        add_timing('compress', compress_time)
+
+
+def compress_response(response, cache=None, cache_key=None):
+    """
+    Compress the body of a successful response by the encoding accepted by the client, then return the response.
+    If `cache` (i.e. a `SizedLRUCache`) is given, then the compressed body is kept by `(cache_key, encoding, level)`.
+
+    A response is negotiated once, then it is not compressed again by the next calls.
+    """
+
+    if not ENCODINGS or 'Accept-Encoding' in response.vary or not is_compressible(response):
+        return response
+
+    # the shared caches keep a representation by encoding
+    response.vary.add('Accept-Encoding')
+
+    encoding = negotiate(request.accept_encodings)
+
+    if encoding is None:
+        return response
+
+    level = get_level(encoding, request.url_rule.rule if request.url_rule is not None else None)
+
+    if response.is_streamed:
+        response.response = iter_compressed(response.response, COMPRESSORS[encoding](level), response.charset)
+        # the length of the compressed body is unknown
+        response.headers.pop('Content-Length', None)
+    else:
+        key = (cache_key, encoding, level)
+        body = cache.get(key) if cache is not None else None
+
+        if body is None:
+            data = response.get_data()
+
+            if len(data) < INPE_STAC_COMPRESSION_MIN_SIZE:
+                return response
+
+            start_time = perf_counter()
+            body = compress(data, encoding, level)
+            add_timing('compress', perf_counter() - start_time)
+
+            if cache is not None:
+                cache.set(key, body, len(body))
+
+        response.set_data(body)
+
+    response.headers['Content-Encoding'] = encoding
+
+    # the compressed bytes are not the ones of the strong ETag, but their content is the same
+    etag, weak = response.get_etag()
+
+    if etag is not None and not weak:
+        response.set_etag(etag, weak=True)
+
+    return response
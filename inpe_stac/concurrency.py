@@ -0,0 +1,150 @@
+"""
+Bridge between the synchronous code of the application and the event loop of the ASGI server (see `inpe_stac.asgi`).
+
+A request of the ASGI application is executed by `greenlet_spawn` inside a greenlet, where the code is the same
+as in the WSGI application. When the code reaches an I/O operation (e.g. a query), it calls `await_only`, that
+switches back to the event loop with the awaitable, then the other requests go on while the database answers.
+"""
+
+from asyncio import ensure_future, sleep as async_sleep
+from sys import exc_info
+from threading import Lock as ThreadLock
+from time import monotonic, sleep as thread_sleep
+
+from greenlet import greenlet, getcurrent
+
+
+# number of seconds between the checks of a lock or event by a greenlet, that can not block the event loop
+POLL_INTERVAL = 0.001
+
+
+class AsyncGreenlet(greenlet):
+    """
+    Greenlet whose code is driven by a coroutine of the event loop (i.e. `driver`).
+    """
+
+    def __init__(self, function, driver):
+        greenlet.__init__(self, function, driver)
+        self.driver = driver
+
+
+def is_async():
+    """
+    Return True if the current code has been called by `greenlet_spawn`, i.e. it can call `await_only`.
+    """
+
+    return isinstance(getcurrent(), AsyncGreenlet)
+
+
+def await_only(awaitable):
+    """
+    Wait for `awaitable` on the event loop and return its result, from the synchronous code of `greenlet_spawn`.
+    """
+
+    current = getcurrent()
+
+    if not isinstance(current, AsyncGreenlet):
+        raise RuntimeError('await_only() has been called outside greenlet_spawn()')
+
+    # the driver awaits it and switches back with its result or exception
+    return current.driver.switch(awaitable)
+
+
+async def greenlet_spawn(function, *args, **kwargs):
+    """
+    Execute the synchronous `function` inside a greenlet and return its result.
+    The awaitables given to `await_only` by the function are awaited here.
+    """
+
+    context = AsyncGreenlet(function, getcurrent())
+
+    result = context.switch(*args, **kwargs)
+
+    while not context.dead:
+        try:
+            value = await result
+        except BaseException:
+            result = context.throw(*exc_info())
+        else:
+            result = context.switch(value)
+
+    return result
+
+
+class Task:
+    """
+    Result of `spawn`, with the same `result()` method as a `concurrent.futures.Future`.
+    """
+
+    def __init__(self, task):
+        self.task = task
+
+    def result(self):
+        return await_only(self.task)
+
+
+def spawn(function, *args, **kwargs):
+    """
+    Execute `function` inside another greenlet, at the same time as the current one, and return its `Task`.
+    """
+
+    return Task(ensure_future(greenlet_spawn(function, *args, **kwargs)))
+
+
+def sleep(seconds):
+    """
+    Sleep without blocking the event loop, if it is called inside a greenlet of the ASGI application.
+    """
+
+    if is_async():
+        await_only(async_sleep(seconds))
+    else:
+        thread_sleep(seconds)
+
+
+def wait_event(event, timeout=None):
+    """
+    Wait for a `threading.Event`, without blocking the event loop. Return True if it has been set.
+    """
+
+    if not is_async():
+        return event.wait(timeout)
+
+    deadline = None if timeout is None else monotonic() + timeout
+
+    while not event.is_set():
+        if deadline is not None and monotonic() > deadline:
+            return False
+
+        await_only(async_sleep(POLL_INTERVAL))
+
+    return True
+
+
+class Lock:
+    """
+    Lock of the threads, that can also be held by a greenlet of the ASGI application while it waits for a query:
+    the other greenlets wait for it without blocking the event loop, instead of blocking the only thread.
+    """
+
+    def __init__(self):
+        self.__lock = ThreadLock()
+
+    def acquire(self):
+        if not is_async():
+            return self.__lock.acquire()
+
+        while not self.__lock.acquire(blocking=False):
+            await_only(async_sleep(POLL_INTERVAL))
+
+        return True
+
+    def release(self):
+        self.__lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *args):
+        self.release()
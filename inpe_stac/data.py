@@ -1,23 +1,70 @@
 
-from os import getenv
-from functools import reduce
-from json import loads
-from pprint import PrettyPrinter
+from functools import lru_cache, reduce
 
 from collections import OrderedDict
 from copy import deepcopy
-from datetime import datetime, timedelta
-import sqlalchemy
-from sqlalchemy.sql import text
-from time import time
-from werkzeug.exceptions import BadRequest, InternalServerError
-
-from inpe_stac.log import logging
+from datetime import timedelta
+from os import register_at_fork
+from sqlalchemy.sql import bindparam, text
+from sqlalchemy.util import LRUCache
+from time import time, perf_counter
+from werkzeug.exceptions import BadRequest
+
+from inpe_stac.log import get_logger, SAMPLED
+from inpe_stac.timing import add_timing, add_rows, timed
+from inpe_stac.cache import TTLCache
+from inpe_stac.catalog import CollectionCatalog
+from inpe_stac.singleflight import SingleFlight
+from inpe_stac.database import get_engine, submit_query, execute_async, execute_async_stream
+from inpe_stac.concurrency import is_async
 from inpe_stac.decorator import log_function_header
-from inpe_stac.environment import API_VERSION, BASE_URI, INPE_STAC_DELETED
-
-
-pp = PrettyPrinter(indent=4)
+from inpe_stac.pagination import KeysetTracker, decode_token, parse_sortby, make_order_by, make_keyset_where, \
+                                 DEFAULT_SORT_KEYS, GLOBAL_SORT_KEYS
+from inpe_stac.spatial import make_bbox_where
+from inpe_stac.geometry import parse_geometry, get_bbox, intersects_footprints
+from inpe_stac.serializer import FeatureSerializer, dumps
+from inpe_stac.query import compile_query, quote_identifier, PreparedStatements
+from inpe_stac.snapshot import SnapshotEngine, SNAPSHOT_COLUMNS
+from inpe_stac.environment import API_VERSION, BASE_URI, INPE_STAC_DELETED, \
+                                  INPE_STAC_STREAM_BATCH_SIZE, INPE_STAC_COUNT_CACHE_TTL, \
+                                  INPE_STAC_COUNT_CACHE_SIZE, INPE_STAC_TOTALS_CACHE_TTL, \
+                                  INPE_STAC_COLLECTION_CACHE_TTL, INPE_STAC_INTERSECTS_MAX_CANDIDATES, \
+                                  INPE_STAC_INTERSECTS_BATCH_SIZE, INPE_STAC_WATERMARK_TTL, INPE_STAC_UPDATED_COLUMN, \
+                                  INPE_STAC_IDS_BATCH_SIZE, INPE_STAC_ITEM_CACHE_TTL, INPE_STAC_ITEM_CACHE_SIZE, \
+                                  INPE_STAC_PREPARED_STATEMENTS, INPE_STAC_PREPARED_STATEMENTS_SIZE, \
+                                  INPE_STAC_SEARCH_BACKEND, INPE_STAC_SNAPSHOT_REFRESH_INTERVAL, INPE_STAC_SPATIAL_INDEX
+
+
+logger = get_logger(__name__)
+
+# the collections change rarely, then they are kept in memory
+collection_catalog = CollectionCatalog(lambda: load_collections(), INPE_STAC_COLLECTION_CACHE_TTL)
+
+# number of matched rows by search signature (see `count_stac_items`)
+count_cache = TTLCache(INPE_STAC_COUNT_CACHE_TTL, max_size=INPE_STAC_COUNT_CACHE_SIZE)
+# number of rows by collection
+totals_cache = TTLCache(INPE_STAC_TOTALS_CACHE_TTL, max_size=1)
+# statements compiled by SQLAlchemy, that are reused by the queries with the same SQL
+compiled_cache = LRUCache(1024)
+# server-side prepared statements of MySQL, if `INPE_STAC_PREPARED_STATEMENTS` is enabled
+prepared_statements = PreparedStatements(max_statements=INPE_STAC_PREPARED_STATEMENTS_SIZE)
+# encoded features of the items searched by id (e.g. by the bulk endpoint), with the watermark of their collection
+item_cache = TTLCache(INPE_STAC_ITEM_CACHE_TTL, max_size=INPE_STAC_ITEM_CACHE_SIZE)
+# state of the items of each collection (by the searched collections, or None for all), that identifies
+# the version of the responses
+watermark_cache = TTLCache(INPE_STAC_WATERMARK_TTL, max_size=256)
+# the expired watermarks are loaded again by just one of the threads that need them
+watermark_flight = SingleFlight()
+# columnar copy of the searchable attributes of the items, if `INPE_STAC_SEARCH_BACKEND` is `snapshot`
+snapshot_engine = SnapshotEngine(
+    lambda: load_snapshot_state(), lambda *args: load_snapshot_rows(*args),
+    updated_column=INPE_STAC_UPDATED_COLUMN or None, deleted_flag=INPE_STAC_DELETED,
+    refresh_interval=INPE_STAC_SNAPSHOT_REFRESH_INTERVAL, max_intersects_candidates=INPE_STAC_INTERSECTS_MAX_CANDIDATES,
+    spatial_index=INPE_STAC_SPATIAL_INDEX
+)
+
+# a forked child (e.g. a gunicorn worker) refreshes the snapshot by its own
+register_at_fork(after_in_child=snapshot_engine.reset_lock)
 
 
 def len_result(result):
@@ -36,94 +83,703 @@ def insert_deleted_flag_to_where(where):
         pass
 
 
+def load_collections():
+    query = 'SELECT * FROM stac_collection ORDER BY id;'
+
+    logger.info('load_collections - query: %s', query)
+
+    result, elapsed_time = do_query(query)
+
+    logger.info('load_collections - elapsed_time - query: %s', timedelta(seconds=elapsed_time))
+
+    logger.info('load_collections - len(result): %s', len_result(result))
+
+    return result
+
+
 @log_function_header
 def get_collections(collection_id=None):
-    logging.info('get_collections - collection_id: {}'.format(collection_id))
+    """
+    Return the collections from the process-level catalog, that is loaded from the database
+    again after `INPE_STAC_COLLECTION_CACHE_TTL` seconds.
+    """
+
+    logger.debug('get_collections - collection_id: %s', collection_id)
+
+    result = collection_catalog.get_rows(collection_id)
+
+    logger.debug('get_collections - len(result): %s', len_result(result))
+
+    return result
+
+
+def split_collections(collections):
+    """
+    Return the collections that exist and the ones that do not. The collections that do not exist
+    are known by the catalog, then they are not searched.
+    """
+
+    known = [c for c in collections if collection_catalog.exists(c)]
+
+    return known, [c for c in collections if c not in known]
+
+
+def make_intersects_where(intersects, where, params, collections=None):
+    """
+    Return the predicate of the `intersects` filter (a GeoJSON Polygon or MultiPolygon), in two phases:
+        1. the candidates are selected by the bbox of the geometry (i.e. through the spatial index)
+           and by the other filters inside `where`;
+        2. the footprints of the candidates are compared to the geometry in batches,
+           then the ids of the scenes that intersect it are searched by primary key.
+    """
+
+    polygons = parse_geometry(intersects)
+
+    candidate_params = dict(params)
+    candidate_where = where + [
+        make_bbox_where(candidate_params, get_bbox(polygons), collections=collections, prefix='i_')
+    ]
+
+    if collections:
+        candidate_where.insert(0, 'collection IN :i_collections')
+        candidate_params['i_collections'] = list(collections)
+
+    insert_deleted_flag_to_where(candidate_where)
+
+    candidate_params['i_max_candidates'] = INPE_STAC_INTERSECTS_MAX_CANDIDATES + 1
+
+    sql = '''
+        SELECT id, tl_longitude, tl_latitude, bl_longitude, bl_latitude,
+               br_longitude, br_latitude, tr_longitude, tr_latitude
+        FROM stac_item
+        WHERE
+            {}
+        LIMIT :i_max_candidates
+    '''.format('\nAND '.join(candidate_where))
+
+    start_time = time()
+
+    ids = []
+    candidates = 0
+    batch = []
+
+    def add_intersecting_ids(batch):
+        mask = intersects_footprints(get_footprints(batch), polygons)
+
+        ids.extend(r['id'] for r, intersects in zip(batch, mask) if intersects)
+
+    for row in do_query_stream(sql, **candidate_params):
+        candidates += 1
+
+        if candidates > INPE_STAC_INTERSECTS_MAX_CANDIDATES:
+            raise BadRequest(
+                '`intersects` selects more than {} scenes, please use a smaller geometry or more filters'.format(
+                    INPE_STAC_INTERSECTS_MAX_CANDIDATES
+                )
+            )
+
+        batch.append(row)
+
+        if len(batch) == INPE_STAC_INTERSECTS_BATCH_SIZE:
+            add_intersecting_ids(batch)
+            batch = []
+
+    if batch:
+        add_intersecting_ids(batch)
+
+    logger.info(
+        'make_intersects_where - candidates: %s, intersecting: %s, elapsed_time: %s',
+        candidates, len(ids), timedelta(seconds=time() - start_time), extra=SAMPLED
+    )
+
+    return make_ids_where(params, ids, name='intersects_ids')
+
+
+def get_footprints(rows):
+    """
+    Return the corners of the scenes of the rows, in the order that is compared by `intersects_footprints`.
+    """
+
+    return [
+        [[r['tl_longitude'], r['tl_latitude']], [r['bl_longitude'], r['bl_latitude']],
+         [r['br_longitude'], r['br_latitude']], [r['tr_longitude'], r['tr_latitude']]]
+        for r in rows
+    ]
+
+
+def parse_bbox(bbox):
+    """
+    Return the values of a `min_x,min_y,max_x,max_y` string as a list of strings.
+    """
+
+    try:
+        for x in bbox.split(','):
+            float(x)
+
+        bbox = bbox.split(',')
+        min_x, min_y, max_x, max_y = bbox
+    except:
+        raise (InvalidBoundingBoxError())
+
+    return bbox
+
+
+def make_time_where(where, params, time):
+    """
+    Append the predicates of `time` (i.e. `start/end` or `start`, a string or a list) to `where`,
+    then return it as a list.
+    """
+
+    if not (isinstance(time, str) or isinstance(time, list)):
+        raise BadRequest('`time` field is not a string or list')
+
+    # if time is a string, then I convert it to list by splitting it
+    if isinstance(time, str):
+        time = time.split("/")
+
+    # if there is time_start and time_end, then get them
+    if len(time) == 2:
+        params['time_start'], params['time_end'] = time
+        where.append("date <= :time_end")
+    # if there is just time_start, then get it
+    elif len(time) == 1:
+        params['time_start'] = time[0]
+
+    where.append("date >= :time_start")
+
+    return time
+
+
+def make_ids_where(params, ids, name='ids'):
+    """
+    Return the predicate that selects the scenes by primary key. The ids are bound as `IN` lists
+    of up to `INPE_STAC_IDS_BATCH_SIZE` values, then a large list does not create a huge statement.
+    The lists are added to `params` by `name`.
+    """
+
+    batches = [ids[i:i + INPE_STAC_IDS_BATCH_SIZE] for i in range(0, len(ids), INPE_STAC_IDS_BATCH_SIZE)]
+
+    # an empty IN list is not valid SQL
+    if not batches:
+        return '1 = 0'
+
+    if len(batches) == 1:
+        params[name] = batches[0]
+
+        return 'id IN :{}'.format(name)
+
+    for index, batch in enumerate(batches):
+        params['{}_{}'.format(name, index)] = batch
+
+    return '({})'.format(' OR '.join('id IN :{}_{}'.format(name, index) for index in range(len(batches))))
+
+
+def get_params_signature(where, params):
+    """
+    Create a key that identifies the rows matched by a search, i.e. the WHERE clause and its
+    values, without the parameters that select the page.
+    """
+
+    values = tuple(sorted(
+        (key, tuple(value) if isinstance(value, list) else value) for key, value in params.items()
+        if key not in ('page', 'limit') and not key.startswith('k_')
+    ))
+
+    return where, values
+
+
+def get_collection_totals():
+    """
+    Return the number of items of each collection, e.g. `{'CBERS4_MUX_L2_DN': 1000}`.
+    """
+
+    totals = totals_cache.get('totals')
+
+    if totals is not None:
+        return totals
+
+    where = []
+    insert_deleted_flag_to_where(where)
+
+    sql_count = '''
+        SELECT collection, COUNT(id) as matched
+        FROM stac_item
+        {}
+        GROUP BY collection;
+    '''.format('WHERE ' + where[0] if where else '')
+
+    result_count, elapsed_time = do_query(sql_count)
+    logger.info('get_collection_totals - elapsed_time - sql_count: %s', timedelta(seconds=elapsed_time))
+
+    totals = {d['collection']: d['matched'] for d in result_count or []}
+
+    totals_cache.set('totals', totals)
+
+    return totals
+
+
+def get_watermarks(collections=None):
+    """
+    Return the state of the items of each collection (or of just `collections`), that changes when items
+    are inserted, deleted or updated, e.g. `{'CBERS4_MUX_L2_DN': (1000, '2020-01-22 13:00:00', None)}`
+    (number of items, last `datetime` and last `INPE_STAC_UPDATED_COLUMN` value).
+
+    The watermarks are loaded again after `INPE_STAC_WATERMARK_TTL` seconds, just once by the concurrent calls.
+    """
+
+    watermarks = watermark_cache.get(None)
+
+    # the watermarks of all collections have the ones of any collection
+    if watermarks is not None and collections is not None:
+        return {c: watermarks[c] for c in collections if c in watermarks}
+
+    key = tuple(sorted(set(collections))) if collections is not None else None
+
+    if key == ():
+        return {}
+
+    if key is not None:
+        watermarks = watermark_cache.get(key)
+
+    if watermarks is not None:
+        return watermarks
+
+    def load():
+        # another thread may have loaded them while this one was waiting
+        watermarks = watermark_cache.get(key)
+
+        if watermarks is None:
+            watermarks = load_watermarks(key)
+            watermark_cache.set(key, watermarks)
+
+            # the totals of the collections are known now, then they do not need to be counted again
+            if key is None:
+                totals_cache.set('totals', {collection: w[0] for collection, w in watermarks.items()})
+
+        return watermarks
+
+    return watermark_flight.do(repr(key), load)
+
+
+def load_watermarks(collections=None):
+    """
+    Return the watermarks of the collections (or of just `collections`) from the database (see `get_watermarks`).
+    """
+
+    params = {}
+    where = []
+    insert_deleted_flag_to_where(where)
+
+    # the items of the searched collections are read through the index of `collection`
+    if collections is not None:
+        where.append('collection IN :collections')
+        params['collections'] = list(collections)
+
+    sql = '''
+        SELECT collection, COUNT(id) as matched, MAX(datetime) as max_datetime, {} as max_updated
+        FROM stac_item
+        {}
+        GROUP BY collection;
+    '''.format(
+        'MAX({})'.format(INPE_STAC_UPDATED_COLUMN) if INPE_STAC_UPDATED_COLUMN else 'NULL',
+        'WHERE ' + ' AND '.join(where) if where else ''
+    )
+
+    result, elapsed_time = do_query(sql, **params)
+    logger.info('load_watermarks - elapsed_time - sql: %s', timedelta(seconds=elapsed_time))
+
+    return {
+        d['collection']: (d['matched'], str(d['max_datetime']), str(d['max_updated']))
+        for d in result or []
+    }
+
+
+def get_watermarks_signature(collections=None):
+    """
+    Return the state of the items of the collections (or of all of them), as a key of the values
+    that must not be reused after these items change (e.g. the cached counts).
+    """
+
+    watermarks = get_watermarks(collections)
+
+    if collections is None:
+        return tuple(sorted(watermarks.items()))
+
+    return tuple((collection, watermarks.get(collection)) for collection in sorted(collections))
+
+
+def load_snapshot_state():
+    """
+    Return the state of the items of each collection, that is compared by the snapshot to the one of its last refresh.
+    """
+
+    sql = '''
+        SELECT collection, COUNT(id) as total, SUM(deleted) as deleted,
+               MAX(datetime) as max_datetime, {} as max_updated
+        FROM stac_item
+        GROUP BY collection;
+    '''.format('MAX({})'.format(INPE_STAC_UPDATED_COLUMN) if INPE_STAC_UPDATED_COLUMN else 'NULL')
+
+    result, elapsed_time = do_query(sql)
+    logger.debug('load_snapshot_state - elapsed_time - sql: %s', timedelta(seconds=elapsed_time))
+
+    return result or []
+
+
+def load_snapshot_rows(collection, column=None, since=None):
+    """
+    Return the columns of the snapshot of the items of a collection, just the ones whose `column`
+    is greater than or equal to `since` if `column` is given.
+    """
+
+    params = {'collection': collection}
+    where = ['collection = :collection']
+
+    if column is not None:
+        where.append('`{}` >= :since'.format(column))
+        params['since'] = since
+
+    sql = 'SELECT {} FROM stac_item WHERE {}'.format(make_select_list(SNAPSHOT_COLUMNS), ' AND '.join(where))
+
+    # the rows are read from a server-side cursor, then the driver does not buffer all of them again
+    return list(do_query_stream(sql, **params))
+
+
+def estimate_stac_items(where, params):
+    """
+    Estimate the number of rows of each collection through the MySQL optimizer (i.e. EXPLAIN),
+    without executing the search. Return None if the database does not support it.
+    If there are not collections inside `params`, then the rows of each collection of the catalog are estimated.
+    """
+
+    # the async pool of the ASGI application is always a MySQL one
+    if not is_async() and get_engine().dialect.name != 'mysql':
+        return None
+
+    if 'collections' in params:
+        collections = params['collections']
+    else:
+        collections = [row['id'] for row in collection_catalog.get_rows() or []]
+
+    result_count = []
+
+    for collection in collections:
+        sql_explain = 'EXPLAIN SELECT id FROM stac_item WHERE collection = :e_collection AND {}'.format(where)
+
+        result, _ = do_query(sql_explain, **params, e_collection=collection)
+
+        # `filtered` is the percentage of the rows read that satisfy the WHERE clause
+        matched = max(
+            [int(r['rows'] * float(r.get('filtered') or 100) / 100) for r in result or [] if r.get('rows')],
+            default=0
+        )
+
+        result_count.append({'collection': collection, 'matched': matched})
+
+    return result_count
+
+
+@timed('db_count')
+def count_stac_items(where, params, count='exact', filtered=True):
+    """
+    Return the number of rows matched by the WHERE clause for each collection.
+
+    `count` can be:
+        - `exact`: the rows are counted, but a count is reused during `INPE_STAC_COUNT_CACHE_TTL` seconds,
+          while the watermarks of the searched collections do not change (see `get_watermarks`), then the
+          cached counts do not need to be invalidated when the items change;
+        - `estimate`: an exact count is used if it is cached, otherwise the rows are estimated;
+        - `none`: the rows are not counted and None is returned.
+
+    If the search is not `filtered`, then the totals of the collections are used instead.
+    """
+
+    if count == 'none':
+        return None
+
+    if not filtered:
+        totals = get_collection_totals()
+
+        if 'collections' in params:
+            collections = params['collections']
+        else:
+            collections = totals.keys()
+
+        return [
+            {'collection': collection, 'matched': totals[collection]}
+            for collection in collections if collection in totals
+        ]
+
+    # a count is reused just while the items of its collections do not change
+    signature = get_params_signature(where, params) + (get_watermarks_signature(params.get('collections')),)
+
+    result_count = count_cache.get(signature)
+
+    if result_count is not None:
+        logger.debug('count_stac_items - cached')
+        return deepcopy(result_count)
+
+    if count == 'estimate':
+        result_count = estimate_stac_items(where, params)
+
+        if result_count is not None:
+            return result_count
+
+    # add just where clause to query, because I want to get the number of total results
+    sql_count = '''
+        SELECT collection, COUNT(id) as matched
+        FROM stac_item
+        WHERE
+            {}
+        GROUP BY collection;
+    '''.format(where)
+
+    logger.debug('count_stac_items - sql_count: %s', sql_count)
+
+    result_count, elapsed_time = do_query(sql_count, **params)
+    logger.debug('count_stac_items - elapsed_time - sql_count: %s', timedelta(seconds=elapsed_time))
+
+    result_count = result_count or []
+
+    count_cache.set(signature, deepcopy(result_count))
+
+    return result_count
+
+
+def make_collection_queries(where, params, keyset=None, sort_keys=DEFAULT_SORT_KEYS, columns=None):
+    """
+    Create a bounded query for each collection inside `params['collections']`, ordered by `sort_keys`,
+    that can be answered by an index range seek (see `inpe_stac.indexes`).
+    Return a list of `(collection, sql)` sorted by collection.
+
+    If `keyset` is None, then each query returns the rows from `page` on, else the rows after the position
+    of its collection inside `keyset` (i.e. the positions decoded from the token, or an empty list for the first page).
+
+    If `columns` is given, then just these columns are selected (see `make_select_list`).
+    """
+
+    collections = params['collections']
+
+    if keyset is None:
+        positions = {}
+        limit = 'LIMIT :page, :limit'
+    else:
+        positions = {p[0]: p for p in keyset}
+        limit = 'LIMIT :limit'
+
+        # if there is a token, then the collections that are not inside it have already been exhausted
+        if keyset:
+            collections = [c for c in collections if c in positions]
+
+    queries = []
+
+    for index, collection in enumerate(sorted(collections)):
+        params['k_collection_{}'.format(index)] = collection
+
+        collection_where = 'collection = :k_collection_{}\nAND {}'.format(index, where)
+
+        if collection in positions:
+            collection_where += '\nAND ' + make_keyset_where(positions[collection][1:], sort_keys, params, index)
+
+        queries.append((collection, '''
+            SELECT {}
+            FROM stac_item
+            WHERE
+                {}
+            ORDER BY {}
+            {}
+        '''.format(make_select_list(columns), collection_where, make_order_by(sort_keys), limit)))
+
+    return queries
+
+
+def make_select_list(columns=None):
+    """
+    Return the select list of the columns of `stac_item`, or all of them if `columns` is None.
+    The columns are quoted, since some of them are keywords (e.g. `row`).
+    """
+
+    if columns is None:
+        return '*'
+
+    return ', '.join(quote_identifier(column) for column in columns)
+
+
+def make_union_sql(queries, sort_keys=DEFAULT_SORT_KEYS):
+    """
+    Combine the queries of the collections in just one query, ordered by `collection` and `sort_keys`.
+    """
+
+    if len(queries) == 1:
+        return queries[0][1]
+
+    subqueries = [
+        'SELECT * FROM ({}) t{}'.format(sql, index) for index, (_, sql) in enumerate(queries)
+    ]
+
+    return 'SELECT * FROM ({}) t ORDER BY collection ASC, {}'.format(
+        '\nUNION ALL\n'.join(subqueries), make_order_by(sort_keys)
+    )
+
+
+def make_keyset_sql(where, params, keyset, sort_keys=GLOBAL_SORT_KEYS, columns=None):
+    """
+    Create the query of a keyset page of the rows of all collections together (i.e. `keyset` is a list
+    of positions decoded from the token, or an empty list for the first page), ordered by `sort_keys`.
+    """
+
+    if keyset:
+        where += '\nAND ' + make_keyset_where(keyset[0], sort_keys, params, 0)
+
+    return '''
+        SELECT {}
+        FROM stac_item
+        WHERE
+            {}
+        ORDER BY {}
+        LIMIT :limit
+    '''.format(make_select_list(columns), where, make_order_by(sort_keys))
 
-    kwargs = {}
-    where = ''
 
-    # if there is a 'collection_id' key to search, then add the WHERE clause and the key to kwargs
-    if collection_id is not None:
-        where = 'WHERE id = :collection_id'
-        kwargs = { 'collection_id': collection_id }
+def do_collection_queries(queries, params):
+    """
+    Execute the queries of the collections at the same time, each one on its own connection,
+    and return their rows in the order of the queries.
+    """
 
-    query = 'SELECT * FROM stac_collection {};'.format(where)
+    futures = [submit_query(do_query, sql, **params) for _, sql in queries]
 
-    logging.info('get_collections - query: {}'.format(query))
+    result = []
 
-    result, elapsed_time = do_query(query, **kwargs)
+    for (collection, _), future in zip(queries, futures):
+        rows, elapsed_time = future.result()
 
-    logging.info('get_collections - elapsed_time - query: {}'.format(timedelta(seconds=elapsed_time)))
+        logger.debug(
+            'do_collection_queries - collection: %s, elapsed_time: %s', collection, timedelta(seconds=elapsed_time)
+        )
 
-    logging.info('get_collections - len(result): {}'.format(len_result(result)))
-    # logging.debug('get_collections - result: {}'.format(result))
+        result += rows or []
 
     return result
 
 
 @log_function_header
-def __search_stac_item_view(where, params):
-    logging.info('__search_stac_item_view')
+def __search_stac_item_view(where, params, stream=False, keyset=None, count='exact', filtered=True,
+                            sort_keys=DEFAULT_SORT_KEYS, columns=None, snapshot_filter=None):
+    """
+    If `keyset` is None, then the rows are paginated by `page` (i.e. OFFSET), else they are
+    paginated by keyset, starting after the positions inside `keyset`.
+
+    The rows are ordered by `sort_keys`. If there are collections inside `params`,
+    then the rows of each collection are ordered by their own.
+
+    If `columns` is given, then just these columns of the rows are read.
+
+    `count` is the way of getting the number of matched rows (see `count_stac_items`).
+    If `filtered` is False, then `where` has just the deleted flag and the collections.
+
+    If `snapshot_filter` is given, then the rows are searched through the snapshot (see `search_snapshot`)
+    instead of `where`.
+    """
+
+    logger.debug('__search_stac_item_view')
+
+    if snapshot_filter is not None:
+        result, result_count = search_snapshot(snapshot_filter, params, stream, keyset, count, sort_keys, columns)
+
+        return complete_result_count(result, result_count, params, count, stream)
 
     insert_deleted_flag_to_where(where)
 
     # create the WHERE clause
     where = '\nAND '.join(where)
 
-    # if the user is looking for more than one collection, then I search by partition
+    queries = None
+    sql = None
+
+    # if the user is looking for collections, then each one is searched by its own bounded query
     if 'collections' in params:
-        sql = '''
-            SELECT *
-            FROM (
-                SELECT *, row_number() over (partition by collection) rn
-                FROM stac_item
-                WHERE
-                    {}
-            ) t
-            WHERE rn >= :page AND rn <= :limit;
-        '''.format(where)
+        queries = make_collection_queries(where, params, keyset, sort_keys, columns)
+
+        # the streamed rows are read from just one cursor
+        if queries and (stream or len(queries) == 1):
+            sql = make_union_sql(queries, sort_keys)
+            queries = None
+    elif keyset is not None:
+        sql = make_keyset_sql(where, params, keyset, sort_keys, columns)
     # else, I search with a normal query
     else:
         sql = '''
-            SELECT *
+            SELECT {}
             FROM stac_item
             WHERE
                 {}
+            ORDER BY {}
             LIMIT :page, :limit
-        '''.format(where)
+        '''.format(make_select_list(columns), where, make_order_by(sort_keys))
 
-    # add just where clause to query, because I want to get the number of total results
-    sql_count = '''
-        SELECT collection, COUNT(id) as matched
-        FROM stac_item
-        WHERE
-            {}
-        GROUP BY collection;
-    '''.format(where)
+    logger.debug('__search_stac_item_view - params: %s', params)
 
-    # logging.info('__search_stac_item_view - where: {}'.format(where))
-    logging.info('__search_stac_item_view - params: {}'.format(params))
+    logger.debug('__search_stac_item_view - sql: %s', sql if queries is None else queries)
 
-    logging.info('__search_stac_item_view - sql_count: {}'.format(sql_count))
-    logging.info('__search_stac_item_view - sql: {}'.format(sql))
+    start_time = time()
 
-    # execute the queries
-    result_count, elapsed_time = do_query(sql_count, **params)
-    logging.info('__search_stac_item_view - elapsed_time - sql_count: {}'.format(timedelta(seconds=elapsed_time)))
+    # execute the queries, the count is executed in another thread at the same time as the page,
+    # each one on its own connection
+    if count != 'none':
+        future_count = submit_query(count_stac_items, where, params, count=count, filtered=filtered)
+
+    if queries:
+        # the collections are searched at the same time
+        result = do_collection_queries(queries, params)
+    elif sql is None:
+        # all collections have been exhausted by the previous pages
+        result = []
+    elif stream:
+        # the rows are read from the server-side cursor while the response is being written
+        result = do_query_stream(sql, **params)
+    else:
+        result, elapsed_time = do_query(sql, **params)
+        logger.debug('__search_stac_item_view - elapsed_time - sql: %s', timedelta(seconds=elapsed_time))
+
+    # the time of the streamed rows is spent while the response is being written
+    if not stream:
+        add_timing('db_page', time() - start_time)
+
+    result_count = future_count.result() if count != 'none' else None
+
+    logger.info(
+        '__search_stac_item_view - elapsed_time - sql_count and sql: %s', timedelta(seconds=time() - start_time),
+        extra=SAMPLED
+    )
+
+    return complete_result_count(result, result_count, params, count, stream)
 
-    result, elapsed_time = do_query(sql, **params)
-    logging.info('__search_stac_item_view - elapsed_time - sql: {}'.format(timedelta(seconds=elapsed_time)))
+
+def complete_result_count(result, result_count, params, count='exact', stream=False):
+    """
+    Add the requested collections without any matched row to `result_count`.
+    """
 
     # if `result` or `result_count` is None, then I return an empty list instead
     if result is None:
         result = []
 
+    # if the items are not counted, then `matched` is unknown
+    if count == 'none':
+        if 'collections' in params:
+            result_count = [
+                {'collection': collection, 'matched': None}
+                for collection in sorted(params['collections'])
+            ]
+
+        return result, result_count
+
     if result_count is None:
         result_count = []
 
     if 'collections' in params:
-        for collection in params['collections'].split(','):
+        for collection in params['collections']:
             if not any(d['collection'] == collection for d in result_count):
                 result_count.append(
                     {'collection': collection, 'matched': 0}
@@ -131,131 +787,223 @@ def __search_stac_item_view(where, params):
 
         result_count = sorted(result_count, key=lambda key: key['collection'])
 
-    # logging.debug('__search_stac_item_view - result: \n{}\n'.format(result))
-    logging.info('__search_stac_item_view - returned: {}'.format(len_result(result)))
-    logging.info('__search_stac_item_view - result_count: \n{}\n'.format(result_count))
+    if not stream:
+        logger.debug('__search_stac_item_view - returned: %s', len_result(result))
+    logger.debug('__search_stac_item_view - result_count: %s', result_count)
 
     return result, result_count
 
 
+def search_snapshot(snapshot_filter, params, stream=False, keyset=None, count='exact', sort_keys=DEFAULT_SORT_KEYS,
+                    columns=None):
+    """
+    Search the ids of the page and the matched rows through the snapshot of the items (see `inpe_stac.snapshot`),
+    then read just the rows of the page by primary key.
+    """
+
+    start_time = perf_counter()
+
+    page, result_count = snapshot_engine.search(
+        snapshot_filter, collections=params.get('collections'), sort_keys=sort_keys,
+        offset=params.get('page', 0), limit=params['limit'], keyset=keyset
+    )
+
+    add_timing('snapshot', perf_counter() - start_time)
+
+    logger.debug('search_snapshot - page: %s, result_count: %s', len(page), result_count)
+
+    if stream:
+        result = iter_rows_in_order(page, columns)
+    else:
+        start_time = perf_counter()
+        result = list(iter_rows_in_order(page, columns))
+        add_timing('db_page', perf_counter() - start_time)
+
+    return result, result_count if count != 'none' else None
+
+
+def iter_rows_in_order(page, columns=None):
+    """
+    Yield the rows of a page of the snapshot (i.e. a list of `(collection, id)`), in its order.
+    The rows that do not exist anymore are ignored.
+    """
+
+    for i in range(0, len(page), INPE_STAC_IDS_BATCH_SIZE):
+        ids = [id for _, id in page[i:i + INPE_STAC_IDS_BATCH_SIZE]]
+
+        rows = {row['id']: row for row in get_items_by_ids(ids, columns)}
+
+        for id in ids:
+            if id in rows:
+                yield rows[id]
+
+
 @log_function_header
 def get_collection_items(collection_id=None, item_id=None, bbox=None, time=None,
-                         intersects=None, page=1, limit=10, ids=None, collections=None,
-                         query=None):
-    logging.info('get_collection_items()')
+                         intersects=None, page=None, limit=10, ids=None, collections=None,
+                         query=None, token=None, count='exact', stream=False, sortby=None, fields=None,
+                         backend=None):
+    """
+    If `stream` is True, then the returned items are a generator that reads the rows
+    from a server-side cursor, instead of a list.
+
+    The items are ordered by `sortby` (see `parse_sortby`), and then by `id`.
+    By default, they are ordered by `collection, datetime, id`.
+
+    If `fields` (i.e. a `FieldSelection`) is given, then just the columns of the selected fields are read.
+
+    If `page` is None or there is a `token`, then the items are paginated by keyset and
+    the returned `KeysetTracker` creates the token of the next page after the items are read.
+    Otherwise, the items are paginated by `page` and the returned tracker is None.
+
+    `count` is the way of getting `matched` (i.e. `exact`, `estimate` or `none`),
+    if it is `none`, then `matched` is None.
+
+    `backend` is the one that searches the items (i.e. `sql` or `snapshot`), by default `INPE_STAC_SEARCH_BACKEND`.
+    The searches that the snapshot can not answer, or that arrive before it has been loaded, are answered by SQL.
+    """
+
+    logger.debug('get_collection_items()')
 
     result = []
     metadata_related_to_collections = []
     matched = 0
+    keyset = None
+    tracker = None
+    snapshot_filter = None
 
     params = {
-        'page': page - 1,
         'limit': limit
     }
 
+    sort_keys = parse_sortby(sortby)
+
+    # the rows of all collections together are sorted by collection first, if there is not `sortby`
+    global_sort_keys = sort_keys or GLOBAL_SORT_KEYS
+    sort_keys = sort_keys or DEFAULT_SORT_KEYS
+
+    # the tracker also reads the columns of the sort keys
+    columns = fields.get_columns(*[column for column, _ in global_sort_keys]) if fields is not None else None
+
+    if token is not None:
+        keyset = decode_token(token)
+        page = None
+    elif page is None:
+        # first page, that is the page 1 of the context as when it is paginated by `page`
+        keyset = []
+        page = 1
+    else:
+        params['page'] = page - 1
+
     default_where = []
 
+    # if there is not a filter besides the collections, then the totals of the collections can be used
+    filtered = any(
+        f is not None for f in (item_id, ids, bbox, time, intersects, query)
+    )
+
+    use_snapshot = (backend or INPE_STAC_SEARCH_BACKEND) == 'snapshot' and snapshot_engine.is_ready()
+
+    # the collection is validated through the catalog, without a database round trip
+    if collection_id is not None and not collection_catalog.exists(collection_id):
+        logger.debug('get_collection_items() - collection does not exist: %s', collection_id)
+
+        tracker = KeysetTracker(
+            limit, per_collection=True, columns=[column for column, _ in sort_keys]
+        ) if keyset is not None else None
+
+        return [], 0, metadata_related_to_collections, tracker
+
     # search for ids
     if item_id is not None or ids is not None:
         if item_id is not None:
             default_where.append('id = :item_id')
             params['item_id'] = item_id
         elif ids is not None:
-            default_where.append('FIND_IN_SET(id, :ids)')
-            params['ids'] = ','.join(ids)
+            if isinstance(ids, str):
+                ids = ids.split(',')
 
-        logging.info('get_collection_items() - default_where: {}'.format(default_where))
+            default_where.append(make_ids_where(params, ids))
 
-        __result, __matched = __search_stac_item_view(default_where, params)
+        logger.debug('get_collection_items() - default_where: %s', default_where)
 
-        result += __result
-        matched += reduce(lambda x, y: x + y['matched'], __matched, 0) if __matched else 0
+        if use_snapshot:
+            snapshot_filter = snapshot_engine.compile({'item_id': item_id, 'ids': ids})
 
-    else:
-        if bbox is not None:
-            try:
-                for x in bbox.split(','):
-                    float(x)
-
-                params['min_x'], params['min_y'], params['max_x'], params['max_y'] = bbox.split(',')
-
-                # replace method removes extra espace caused by multi-line String
-                default_where.append(
-                    '''(
-                    ((:min_x <= tr_longitude and :min_y <= tr_latitude)
-                    or
-                    (:min_x <= br_longitude and :min_y <= tl_latitude))
-                    and
-                    ((:max_x >= bl_longitude and :max_y >= bl_latitude)
-                    or
-                    (:max_x >= tl_longitude and :max_y >= br_latitude))
-                    )'''.replace('                ', '')
-                )
-            except:
-                raise (InvalidBoundingBoxError())
+        __result, __matched = __search_stac_item_view(
+            default_where, params, stream=stream, keyset=check_keyset(keyset, len(global_sort_keys)),
+            count=count, filtered=filtered, sort_keys=global_sort_keys, columns=columns,
+            snapshot_filter=snapshot_filter
+        )
 
-        if time is not None:
-            if not (isinstance(time, str) or isinstance(time, list)):
-                raise BadRequest('`time` field is not a string or list')
+        result = __result
+        matched = sum_matched(__matched)
 
-            # if time is a string, then I convert it to list by splitting it
-            if isinstance(time, str):
-                time = time.split("/")
+        if keyset is not None:
+            tracker = KeysetTracker(
+                limit, per_collection=False, columns=[column for column, _ in global_sort_keys],
+                max_rows=get_max_rows(keyset, count, __matched, len(set(ids)) if item_id is None else 1)
+            )
 
-            # if there is time_start and time_end, then get them
-            if len(time) == 2:
-                params['time_start'], params['time_end'] = time
-                default_where.append("date <= :time_end")
-            # if there is just time_start, then get it
-            elif len(time) == 1:
-                params['time_start'] = time[0]
+    else:
+        if bbox is not None:
+            bbox = parse_bbox(bbox)
 
-            default_where.append("date >= :time_start")
+            default_where.append(make_bbox_where(
+                params, bbox, collections=[collection_id] if collection_id is not None else collections
+            ))
+
+        if time is not None:
+            time = make_time_where(default_where, params, time)
 
-        logging.info('get_collection_items() - default_where: {}'.format(default_where))
+        logger.debug('get_collection_items() - default_where: %s', default_where)
 
-        # if query is a dict, then get all available fields to search
+        # the filter of the query extension is compiled to predicates with bound parameters
         # Specification: https://github.com/radiantearth/stac-spec/blob/v0.7.0/api-spec/extensions/query/README.md
-        if isinstance(query, dict):
-            for field, value in query.items():
-                # eq, neq, lt, lte, gt, gte
-                if 'eq' in value:
-                    default_where.append('{0} = {1}'.format(field, value['eq']))
-                if 'neq' in value:
-                    default_where.append('{0} != {1}'.format(field, value['neq']))
-                if 'lt' in value:
-                    default_where.append('{0} < {1}'.format(field, value['lt']))
-                if 'lte' in value:
-                    default_where.append('{0} <= {1}'.format(field, value['lte']))
-                if 'gt' in value:
-                    default_where.append('{0} > {1}'.format(field, value['gt']))
-                if 'gte' in value:
-                    default_where.append('{0} >= {1}'.format(field, value['gte']))
-                # startsWith, endsWith, contains
-                if 'startsWith' in value:
-                    default_where.append('{0} LIKE \'{1}%\''.format(field, value['startsWith']))
-                if 'endsWith' in value:
-                    default_where.append('{0} LIKE \'%{1}\''.format(field, value['endsWith']))
-                if 'contains' in value:
-                    default_where.append('{0} LIKE \'%{1}%\''.format(field, value['contains']))
+        if query is not None:
+            default_where += compile_query(query, params)
 
         if collection_id is not None and isinstance(collection_id, str):
             collections = [collection_id]
 
+        # the filters are compiled to SQL anyway, then they are validated the same way by both backends
+        if use_snapshot:
+            snapshot_filter = snapshot_engine.compile({
+                'bbox': bbox, 'time': time, 'query': query,
+                'intersects': parse_geometry(intersects) if intersects is not None else None
+            })
+
+        # the snapshot compares the footprints by its own, then the candidates are not read from the database
+        if intersects is not None and snapshot_filter is None:
+            default_where.append(make_intersects_where(intersects, default_where, params, collections))
+
         # search for collections
         if collections is not None:
-            logging.info('get_collection_items() - collections: {}'.format(collections))
+            logger.debug('get_collection_items() - collections: %s', collections)
+
+            collections, unknown_collections = split_collections(collections)
 
-            # append the query at the beginning of the list
-            default_where.insert(0, 'FIND_IN_SET(collection, :collections)')
-            params['collections'] = ','.join(collections)
+            if collections:
+                # append the query at the beginning of the list
+                default_where.insert(0, 'collection IN :collections')
+                params['collections'] = collections
 
-            __result, __matched = __search_stac_item_view(default_where, params)
+                __result, __matched = __search_stac_item_view(
+                    default_where, params, stream=stream, keyset=check_keyset(keyset, 1 + len(sort_keys)),
+                    count=count, filtered=filtered, sort_keys=sort_keys, columns=columns,
+                    snapshot_filter=snapshot_filter
+                )
+            else:
+                __result, __matched = [], []
+
+            if unknown_collections:
+                __matched = sorted(
+                    __matched + [{'collection': c, 'matched': 0} for c in unknown_collections],
+                    key=lambda key: key['collection']
+                )
 
-            result += __result
-            # sum all `matched` keys from the `__matched` list. initialize the first `x` with `0`
-            # source: https://stackoverflow.com/a/42453184
-            matched += reduce(lambda x, y: x + y['matched'], __matched, 0) if __matched else 0
+            result = __result
+            matched = sum_matched(__matched)
 
             metadata_related_to_collections = [
                 {
@@ -265,7 +1013,7 @@ def get_collection_items(collection_id=None, item_id=None, bbox=None, time=None,
                         'limit': limit,
                         'matched': d['matched'],
                         # count just the results related to the selected collection
-                        'returned': len(list(filter(
+                        'returned': 0 if stream else len(list(filter(
                             lambda x: x['collection'] == d['collection'],
                             result
                         )))
@@ -274,18 +1022,94 @@ def get_collection_items(collection_id=None, item_id=None, bbox=None, time=None,
                 } for d in __matched
             ]
 
+            # the streamed rows are unknown yet, then they are counted while they are read
+            if stream:
+                result = count_returned_rows(result, metadata_related_to_collections)
+
+            if keyset is not None:
+                tracker = KeysetTracker(
+                    limit, per_collection=True, columns=[column for column, _ in sort_keys],
+                    max_rows=get_max_rows(keyset, count, __matched, per_collection=True)
+                )
+
         # search for anything else
         else:
-            __result, __matched = __search_stac_item_view(default_where, params)
+            __result, __matched = __search_stac_item_view(
+                default_where, params, stream=stream, keyset=check_keyset(keyset, len(global_sort_keys)),
+                count=count, filtered=filtered, sort_keys=global_sort_keys, columns=columns,
+                snapshot_filter=snapshot_filter
+            )
+
+            result = __result
+            matched = sum_matched(__matched)
+
+            if keyset is not None:
+                tracker = KeysetTracker(
+                    limit, per_collection=False, columns=[column for column, _ in global_sort_keys],
+                    max_rows=get_max_rows(keyset, count, __matched)
+                )
+
+    logger.debug('get_collection_items() - matched: %s', matched)
+    logger.debug('get_collection_items() - metadata: %s', metadata_related_to_collections)
+
+    # the position of each row is kept by the tracker while the rows are read
+    if tracker is not None:
+        result = tracker.track(result) if stream else list(tracker.track(result))
+
+    return result, matched, metadata_related_to_collections, tracker
+
+
+def get_max_rows(keyset, count, result_count, requested=None, per_collection=False):
+    """
+    Return the number of rows of each collection (or of the whole search, by the key None) for the `KeysetTracker`
+    of the first page, that are the exact counts or the number of `requested` rows (e.g. the ids of the search).
+    """
+
+    # the counts of the next pages are the ones of the whole search, not the ones after the token
+    if keyset:
+        return None
+
+    if count == 'exact' and sum_matched(result_count) is not None:
+        if per_collection:
+            return {d['collection']: d['matched'] for d in result_count}
+
+        return {None: sum_matched(result_count)}
+
+    if requested is not None:
+        return {None: requested}
+
+    return None
+
+
+def check_keyset(keyset, size):
+    """
+    Validate the positions of a token, whose lengths depend on the sort keys of the search.
+    """
+
+    if keyset and any(len(position) != size for position in keyset):
+        raise BadRequest('`token` parameter is not valid for this search')
+
+    return keyset
 
-            result += __result
-            matched += reduce(lambda x, y: x + y['matched'], __matched, 0) if __matched else 0
 
-    logging.info('get_collection_items() - matched: {}'.format(matched))
-    # logging.debug('get_collection_items() - result: \n\n{}\n\n'.format(result))
-    logging.debug('get_collection_items() - metadata: {}'.format(metadata_related_to_collections))
+def sum_matched(result_count):
+    # if the items have not been counted, then `matched` is unknown
+    if result_count is None or any(d['matched'] is None for d in result_count):
+        return None
 
-    return result, matched, metadata_related_to_collections
+    # sum all `matched` keys from the list. initialize the first `x` with `0`
+    # source: https://stackoverflow.com/a/42453184
+    return reduce(lambda x, y: x + y['matched'], result_count, 0) if result_count else 0
+
+
+def count_returned_rows(rows, metadata_related_to_collections):
+    contexts = {m['name']: m['context'] for m in metadata_related_to_collections}
+
+    for row in rows:
+        if row['collection'] in contexts:
+            contexts[row['collection']]['returned'] += 1
+
+        yield row
 
 
 def make_json_collection(collection_result):
@@ -339,113 +1163,233 @@ def make_json_items(items, links):
         gjson['features'] = features
         return gjson
 
+    serializer = FeatureSerializer(links)
+
     for i in items:
-        # print('\n\nid: ', i['id'])
-        # print('item: ', end='')
-        # pp.pprint(i)
-        # print('\n\n')
-
-        feature = OrderedDict()
-
-        feature['type'] = 'Feature'
-        feature['id'] = i['id']
-        feature['collection'] = i['collection']
-
-        geometry = dict()
-        geometry['type'] = 'Polygon'
-        geometry['coordinates'] = [
-          [[i['tl_longitude'], i['tl_latitude']],
-           [i['bl_longitude'], i['bl_latitude']],
-           [i['br_longitude'], i['br_latitude']],
-           [i['tr_longitude'], i['tr_latitude']],
-           [i['tl_longitude'], i['tl_latitude']]]
-        ]
-        feature['geometry'] = geometry
-        feature['bbox'] = bbox(feature['geometry']['coordinates'])
-
-        feature['properties'] = {
-            # format the datetime
-            'datetime': datetime.fromisoformat(str(i['datetime'] )).isoformat(),
-            'path': i['path'],
-            'row': i['row'],
-            'satellite': i['satellite'],
-            'sensor': i['sensor'],
-            'cloud_cover': i['cloud_cover'],
-            'sync_loss': i['sync_loss']
-        }
+        features.append(serializer.make_feature(i))
 
-        feature['assets'] = {}
+    gjson['features'] = features
 
-        # convert string json to dict json
-        i['assets'] = loads(i['assets'])
+    # logging.debug('make_geojson - gjson: {}'.format(gjson))
 
-        for asset in i['assets']:
-            feature['assets'][asset['band']] = {
-                'href': getenv('TIF_ROOT') + asset['href'],
-                'type': 'image/vnd.stac.geotiff'
-            }
-            feature['assets'][asset['band'] + '_xml'] = {
-                'href': getenv('TIF_ROOT') + asset['href'].replace('.tif', '.xml'),
-                'type': 'text/xml'
-            }
+    return gjson
 
-        feature['assets']['thumbnail'] = {
-            'href': getenv('PNG_ROOT') + i['thumbnail'],
-            'type': 'image/png'
-        }
 
-        feature['links'] = deepcopy(links)
-        feature['links'][0]['href'] += i['collection'] + "/items/" + i['id']
-        feature['links'][1]['href'] += i['collection']
-        feature['links'][2]['href'] += i['collection']
+def get_items_by_ids(ids, columns=None):
+    """
+    Return the rows of the ids that exist, searched by primary key in batches of `INPE_STAC_IDS_BATCH_SIZE` ids.
+    If `columns` is given, then just these columns are read.
+    """
 
-        features.append(feature)
+    result = []
 
-        # print('\nfeature: ')
-        # pp.pprint(feature)
-        # print('\n')
+    for i in range(0, len(ids), INPE_STAC_IDS_BATCH_SIZE):
+        where = ['id IN :ids']
+        insert_deleted_flag_to_where(where)
 
-    gjson['features'] = features
+        rows, elapsed_time = do_query(
+            'SELECT {} FROM stac_item WHERE {}'.format(make_select_list(columns), ' AND '.join(where)),
+            ids=ids[i:i + INPE_STAC_IDS_BATCH_SIZE]
+        )
+        logger.debug('get_items_by_ids - elapsed_time - sql: %s', timedelta(seconds=elapsed_time))
 
-    # logging.debug('make_geojson - gjson: {}'.format(gjson))
+        result += rows or []
 
-    return gjson
+    return result
 
 
-def do_query(sql, **kwargs):
-    start_time = time()
+def make_json_items_by_ids(ids, links):
+    """
+    Return a FeatureCollection (encoded as bytes) with the items of the ids, in the order of the ids.
+    The ids that do not exist are ignored, as well as the repeated ones. The encoded features are kept by
+    `item_cache` with the watermark of their collection, then just the items that are not cached, or whose
+    collection has changed since then, are searched in the database.
+    """
 
-    connection = 'mysql://{}:{}@{}/{}'.format(
-        getenv('DB_USER'), getenv('DB_PASS'), getenv('DB_HOST'), getenv('DB_NAME')
-    )
-    engine = sqlalchemy.create_engine(connection)
+    ids = list(dict.fromkeys(ids))
+    watermarks = get_watermarks()
+
+    features = {}
+    missing = []
+
+    for id in ids:
+        entry = item_cache.get(id)
+
+        if entry is not None and watermarks.get(entry[0]) == entry[1]:
+            features[id] = entry[2]
+        else:
+            missing.append(id)
 
-    sql = text(sql)
-    engine.execute("SET @@group_concat_max_len = 1000000;")
+    logger.info('make_json_items_by_ids - cached: %s, missing: %s', len(features), len(missing), extra=SAMPLED)
 
-    result = engine.execute(sql, kwargs)
-    result = result.fetchall()
+    if missing:
+        serializer = FeatureSerializer(links)
 
-    engine.dispose()
+        serialise_time = encode_time = 0
 
-    result = [ dict(row) for row in result ]
+        for row in get_items_by_ids(missing):
+            start_time = perf_counter()
+            feature = serializer.make_feature(row)
+            serialise_time += perf_counter() - start_time
+
+            start_time = perf_counter()
+            features[row['id']] = dumps(feature)
+            encode_time += perf_counter() - start_time
+
+            item_cache.set(row['id'], (row['collection'], watermarks.get(row['collection']), features[row['id']]))
+
+        add_timing('serialise', serialise_time)
+        add_timing('encode', encode_time)
+
+    result = [features[id] for id in ids if id in features]
+
+    add_rows(len(result))
+
+    return b'{"type":"FeatureCollection","features":[' + b','.join(result) + b'],' + \
+        dumps({'context': {'requested': len(ids), 'returned': len(result)}})[1:]
+
+
+def iter_json_items(items, links, context, complete=None, fields=None):
+    """
+    Write a FeatureCollection as chunks of bytes, in order to be sent as a chunked HTTP response.
+    The features are encoded in batches of `INPE_STAC_STREAM_BATCH_SIZE`, then the memory
+    does not depend on the number of items. `context['returned']` is filled at the end.
+
+    `complete` is called with the members written after the features (e.g. `context`),
+    when all items have been read, in order to add the members that depend on them.
+
+    If `fields` (i.e. a `FieldSelection`) is given, then the features have just the selected fields.
+    """
+
+    yield b'{"type":"FeatureCollection","features":['
+
+    serializer = FeatureSerializer(links, fields=fields)
+    returned = 0
+    batch = []
+
+    # the time of the stages is measured without the time of reading the rows (e.g. from a server-side cursor)
+    serialise_time = encode_time = 0
+
+    for item in items or []:
+        start_time = perf_counter()
+        batch.append(serializer.make_feature(item))
+        serialise_time += perf_counter() - start_time
+
+        returned += 1
+
+        if len(batch) == INPE_STAC_STREAM_BATCH_SIZE:
+            start_time = perf_counter()
+            # the brackets of the encoded list are removed, then the batches are joined by commas
+            chunk = (b',' if returned > len(batch) else b'') + dumps(batch)[1:-1]
+            encode_time += perf_counter() - start_time
+
+            yield chunk
+            batch = []
+
+    if batch:
+        start_time = perf_counter()
+        chunk = (b',' if returned > len(batch) else b'') + dumps(batch)[1:-1]
+        encode_time += perf_counter() - start_time
+
+        yield chunk
+
+    add_timing('serialise', serialise_time)
+    add_timing('encode', encode_time)
+    add_rows(returned)
+
+    context['returned'] = returned
+
+    members = OrderedDict()
+    members['context'] = context
+
+    if complete is not None:
+        complete(members)
+
+    yield b'],' + dumps(members)[1:]
+
+
+def make_text(sql, kwargs):
+    """
+    Create the statement of `sql`, the list parameters (e.g. `id IN :ids`) are expanded to one
+    bound parameter by value. The statements are reused, then they are compiled just once
+    by SQLAlchemy (see `compiled_cache`).
+    """
+
+    return __make_text(sql, tuple(sorted(key for key, value in kwargs.items() if isinstance(value, (list, tuple)))))
+
+
+@lru_cache(maxsize=1024)
+def __make_text(sql, list_keys):
+    statement = text(sql)
+
+    expanding = [bindparam(key, expanding=True) for key in list_keys if key in statement._bindparams]
+
+    if expanding:
+        statement = statement.bindparams(*expanding)
+
+    return statement
+
+
+def do_query(sql, **kwargs):
+    start_time = time()
+
+    # inside the ASGI application, the query is awaited on the async pool, while the other requests go on
+    if is_async():
+        result = execute_async(sql, kwargs)
+    else:
+        # the connection is borrowed from the process-wide pool and given back at the end of the block
+        with get_engine().connect() as connection:
+            if INPE_STAC_PREPARED_STATEMENTS and connection.dialect.name == 'mysql':
+                result = prepared_statements.execute(connection, sql, kwargs)
+            else:
+                result = connection.execution_options(compiled_cache=compiled_cache).execute(make_text(sql, kwargs), kwargs)
+                result = [ dict(row) for row in result.fetchall() ]
 
     elapsed_time = time() - start_time
 
+    add_timing('db', elapsed_time)
+
     if len(result) > 0:
         return result, elapsed_time
     else:
         return None, elapsed_time
 
 
-def bbox(coord_list):
-    box = []
+def do_query_stream(sql, **kwargs):
+    """
+    Execute the query through an unbuffered server-side cursor and yield the rows one by one,
+    fetching them in batches of `INPE_STAC_STREAM_BATCH_SIZE`. The connection is kept
+    until the generator is exhausted or closed.
+    """
+
+    start_time = time()
+
+    if is_async():
+        yield from execute_async_stream(sql, kwargs, INPE_STAC_STREAM_BATCH_SIZE)
+
+        logger.debug('do_query_stream - elapsed_time: %s', timedelta(seconds=time() - start_time))
+        return
+
+    sql = make_text(sql, kwargs)
+
+    with get_engine().connect() as connection:
+        result = connection.execution_options(
+            stream_results=True, compiled_cache=compiled_cache
+        ).execute(sql, kwargs)
+
+        try:
+            while True:
+                rows = result.fetchmany(INPE_STAC_STREAM_BATCH_SIZE)
+
+                if not rows:
+                    break
 
-    for i in (0, 1):
-        res = sorted(coord_list[0], key=lambda x: x[i])
-        box.append((res[0][i], res[-1][i]))
+                for row in rows:
+                    yield dict(row)
+        finally:
+            result.close()
 
-    return [box[0][0], box[1][0], box[0][1], box[1][1]]
+    logger.debug('do_query_stream - elapsed_time: %s', timedelta(seconds=time() - start_time))
 
 
 class InvalidBoundingBoxError(Exception):
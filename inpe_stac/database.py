@@ -0,0 +1,346 @@
+from asyncio import ensure_future, get_event_loop, wait_for
+from concurrent.futures import ThreadPoolExecutor
+from os import getenv, getpid, register_at_fork
+from threading import Lock
+
+import sqlalchemy
+from sqlalchemy import event
+from sqlalchemy.engine.url import make_url
+
+from inpe_stac.log import get_logger
+from inpe_stac.concurrency import await_only, is_async, spawn
+from inpe_stac.query import make_positional_query
+from inpe_stac.timing import bind
+from inpe_stac.environment import DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_RECYCLE, \
+                                  DB_POOL_TIMEOUT, DB_POOL_PRE_PING, INPE_STAC_QUERY_WORKERS, \
+                                  DB_ASYNC_POOL_MIN_SIZE, DB_ASYNC_POOL_MAX_SIZE
+
+
+logger = get_logger(__name__)
+
+
+# statements executed once when the pool opens a new MySQL connection,
+# instead of once for each query
+MYSQL_SESSION_SETTINGS = [
+    'SET SESSION group_concat_max_len = 1000000'
+]
+
+__engine = None
+# PID of the process that has created `__engine`
+__engine_pid = None
+__engine_lock = Lock()
+# engines inherited from a parent process. They are never closed nor garbage collected
+# inside the child, because closing them would send a `QUIT` through the sockets
+# that are still used by the parent process
+__inherited_engines = []
+
+# threads that execute queries at the same time as the request thread, each one on its own connection
+__executor = None
+__executor_pid = None
+__executor_lock = Lock()
+
+# connection pools of the ASGI application (i.e. tasks that create them), by event loop
+__async_pools = {}
+
+
+def get_database_url():
+    # `DB_URL` allows to use another driver, otherwise the URL is built from the MySQL variables
+    url = getenv('DB_URL')
+
+    if url:
+        return url
+
+    return 'mysql://{}:{}@{}/{}'.format(
+        getenv('DB_USER'), getenv('DB_PASS'), getenv('DB_HOST'), getenv('DB_NAME')
+    )
+
+
+def on_connect(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+
+    try:
+        for statement in MYSQL_SESSION_SETTINGS:
+            cursor.execute(statement)
+    finally:
+        cursor.close()
+
+
+def create_engine():
+    url = get_database_url()
+
+    engine = sqlalchemy.create_engine(
+        url,
+        poolclass=sqlalchemy.pool.QueuePool,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_pre_ping=DB_POOL_PRE_PING
+    )
+
+    # session settings are applied just to MySQL connections
+    if engine.dialect.name == 'mysql':
+        event.listen(engine, 'connect', on_connect)
+
+    logger.info(
+        'create_engine() - pool_size: %s, max_overflow: %s, pool_recycle: %s, pre_ping: %s',
+        DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_RECYCLE, DB_POOL_PRE_PING
+    )
+
+    return engine
+
+
+def get_engine():
+    """
+    Return the process-wide engine, creating it on the first call.
+    If the process has been forked after the engine was created, then the
+    inherited pool is discarded and a new engine is created for this process.
+    """
+
+    global __engine, __engine_pid
+
+    # fast path, without lock
+    if __engine is not None and __engine_pid == getpid():
+        return __engine
+
+    with __engine_lock:
+        if __engine is None or __engine_pid != getpid():
+            __engine = create_engine()
+            __engine_pid = getpid()
+
+    return __engine
+
+
+def reset_engine():
+    """
+    Drop the current engine. It must be called inside a forked worker,
+    because the connections of the parent process can not be shared with the child.
+    """
+
+    global __engine, __engine_pid, __engine_lock
+
+    # the lock may have been held by another thread of the parent process at fork time
+    __engine_lock = Lock()
+
+    if __engine is not None and __engine_pid != getpid():
+        __inherited_engines.append(__engine)
+
+    __engine = None
+    __engine_pid = None
+
+
+def dispose_engine():
+    global __engine, __engine_pid
+
+    with __engine_lock:
+        if __engine is not None:
+            __engine.dispose()
+
+        __engine = None
+        __engine_pid = None
+
+
+def get_executor():
+    global __executor, __executor_pid
+
+    if __executor is not None and __executor_pid == getpid():
+        return __executor
+
+    with __executor_lock:
+        if __executor is None or __executor_pid != getpid():
+            __executor = ThreadPoolExecutor(
+                max_workers=INPE_STAC_QUERY_WORKERS, thread_name_prefix='inpe_stac_query'
+            )
+            __executor_pid = getpid()
+
+    return __executor
+
+
+def submit_query(function, *args, **kwargs):
+    """
+    Execute `function` in the query threads and return its `Future`.
+    Inside the ASGI application, it is executed by another greenlet of the event loop instead.
+    """
+
+    # the timings of the queries are added to the request that has submitted them
+    function = bind(function)
+
+    if is_async():
+        return spawn(function, *args, **kwargs)
+
+    return get_executor().submit(function, *args, **kwargs)
+
+
+def reset_executor():
+    """
+    Drop the current executor. The threads of the parent process do not exist inside a forked child.
+    """
+
+    global __executor, __executor_pid, __executor_lock
+
+    __executor_lock = Lock()
+    __executor = None
+    __executor_pid = None
+
+
+async def create_async_pool():
+    # the async driver is needed just by the ASGI application
+    import aiomysql
+
+    url = make_url(get_database_url())
+
+    pool = await aiomysql.create_pool(
+        host=url.host,
+        port=url.port or 3306,
+        user=url.username,
+        password=url.password or '',
+        db=url.database,
+        charset=url.query.get('charset', ''),
+        minsize=DB_ASYNC_POOL_MIN_SIZE,
+        maxsize=DB_ASYNC_POOL_MAX_SIZE,
+        pool_recycle=DB_POOL_RECYCLE,
+        # each query sees the last committed rows, as the connections of the engine
+        autocommit=True,
+        # the session settings are joined in one statement, e.g. `SET SESSION a = 1, SESSION b = 2`
+        init_command='SET ' + ', '.join(statement[len('SET '):] for statement in MYSQL_SESSION_SETTINGS)
+    )
+
+    logger.info(
+        'create_async_pool() - minsize: %s, maxsize: %s, pool_recycle: %s',
+        DB_ASYNC_POOL_MIN_SIZE, DB_ASYNC_POOL_MAX_SIZE, DB_POOL_RECYCLE
+    )
+
+    return pool
+
+
+def get_async_pool():
+    """
+    Return the connection pool of the running event loop, creating it on the first call.
+    It must be called inside a greenlet of the ASGI application (see `inpe_stac.concurrency`).
+    """
+
+    loop = get_event_loop()
+    task = __async_pools.get(loop)
+
+    if task is None:
+        task = __async_pools[loop] = ensure_future(create_async_pool())
+
+    try:
+        return await_only(task)
+    except Exception:
+        # the next call tries to create the pool again (e.g. the database was not available yet)
+        if __async_pools.get(loop) is task:
+            del __async_pools[loop]
+        raise
+
+
+async def close_async_pool():
+    task = __async_pools.pop(get_event_loop(), None)
+
+    if task is None:
+        return
+
+    pool = await task
+    pool.close()
+    await pool.wait_closed()
+
+
+def reset_async_pools():
+    """
+    Drop the pools of the parent process, whose event loops do not run inside a forked child.
+    """
+
+    __async_pools.clear()
+
+
+def execute_async(sql, params):
+    """
+    Execute `sql` (with named parameters, e.g. `:limit`) on a connection of the async pool
+    and return the rows as dicts. It must be called inside a greenlet of the ASGI application.
+    """
+
+    import aiomysql
+
+    positional_sql, values = make_positional_query(sql, params, placeholder='%s')
+
+    pool = get_async_pool()
+    connection = await_only(wait_for(pool.acquire(), DB_POOL_TIMEOUT))
+
+    try:
+        cursor = await_only(connection.cursor(aiomysql.DictCursor))
+
+        try:
+            await_only(cursor.execute(positional_sql, values))
+
+            return list(await_only(cursor.fetchall()))
+        finally:
+            await_only(cursor.close())
+    finally:
+        await_only(pool.release(connection))
+
+
+def execute_async_stream(sql, params, batch_size):
+    """
+    Execute `sql` through an unbuffered server-side cursor of the async pool and yield the rows as dicts,
+    fetching them in batches of `batch_size`. The connection is kept until the generator is exhausted or closed.
+    """
+
+    import aiomysql
+
+    positional_sql, values = make_positional_query(sql, params, placeholder='%s')
+
+    pool = get_async_pool()
+    connection = await_only(wait_for(pool.acquire(), DB_POOL_TIMEOUT))
+
+    try:
+        cursor = await_only(connection.cursor(aiomysql.SSDictCursor))
+
+        try:
+            await_only(cursor.execute(positional_sql, values))
+
+            while True:
+                rows = await_only(cursor.fetchmany(batch_size))
+
+                if not rows:
+                    break
+
+                yield from rows
+        finally:
+            # the rows that have not been read are discarded by the cursor
+            await_only(cursor.close())
+    finally:
+        await_only(pool.release(connection))
+
+
+def get_pool_status():
+    """
+    Return the number of connections of the pools of this process by pool and state,
+    e.g. `{('sync', 'checked_out'): 2, ('sync', 'checked_in'): 3}`.
+    """
+
+    status = {}
+
+    if __engine is not None and __engine_pid == getpid():
+        pool = __engine.pool
+
+        status[('sync', 'size')] = pool.size()
+        status[('sync', 'checked_in')] = pool.checkedin()
+        status[('sync', 'checked_out')] = pool.checkedout()
+        status[('sync', 'overflow')] = max(pool.overflow(), 0)
+
+    for task in list(__async_pools.values()):
+        if not task.done() or task.cancelled() or task.exception() is not None:
+            continue
+
+        pool = task.result()
+
+        status[('async', 'size')] = status.get(('async', 'size'), 0) + pool.size
+        status[('async', 'free')] = status.get(('async', 'free'), 0) + pool.freesize
+
+    return status
+
+
+# pre-forked servers (e.g. gunicorn with `preload_app`) fork after the application is imported
+register_at_fork(after_in_child=reset_engine)
+register_at_fork(after_in_child=reset_executor)
+register_at_fork(after_in_child=reset_async_pools)
@@ -1,18 +1,22 @@
 
 from functools import wraps
+from logging import DEBUG
 from time import time, strftime, gmtime
 from datetime import timedelta
 from traceback import format_exc, print_stack
-from werkzeug.exceptions import InternalServerError
+from werkzeug.exceptions import HTTPException, InternalServerError
 
-from inpe_stac.log import logging
+from inpe_stac.log import get_logger
+
+
+logger = get_logger(__name__)
 
 
 def log_function_header(function):
 
     @wraps(function)
     def wrapper(*args, **kwargs):
-        logging.info('{0}() - execution'.format(function.__name__))
+        logger.debug('%s() - execution', function.__name__)
 
         return function(*args, **kwargs)
 
@@ -23,16 +27,17 @@ def log_function_footer(function):
 
     @wraps(function)
     def wrapper(*args, **kwargs):
+        # the time of each request is written by the access log, then it is measured here just to debug
+        if not logger.isEnabledFor(DEBUG):
+            return function(*args, **kwargs)
+
         start_time = time()
 
         result = function(*args, **kwargs)
 
         elapsed_time = time() - start_time
 
-        logging.info('{0}() - elapsed time: {1}'.format(
-            function.__name__,
-            timedelta(seconds=elapsed_time)
-        ))
+        logger.debug('%s() - elapsed time: %s', function.__name__, timedelta(seconds=elapsed_time))
 
         return result
 
@@ -47,16 +52,17 @@ def catch_generic_exceptions(function):
             # try to execute the function
             return function(*args, **kwargs)
 
+        # HTTP errors (e.g. BadRequest) are handled by the error endpoints
+        except HTTPException:
+            raise
+
         # generic exception
         except Exception as error:
             error_message = 'An unexpected error ocurred. Please, contact the administrator.' + '\nError: ' + str(error)
 
             print_traceback = 'Error message: {0}\n{1}'.format(error_message, format_exc())
 
-            logging.info('{0}() - {1}'.format(
-                function.__name__,
-                print_traceback
-            ))
+            logger.error('%s() - %s', function.__name__, print_traceback)
 
             raise InternalServerError(error_message + 'Error: ' + str(error))
 
@@ -1,5 +1,5 @@
-
-from os import getenv
+from os import cpu_count, getenv, path
+from tempfile import gettempdir
 from logging import DEBUG, INFO
 
 
@@ -11,6 +11,123 @@ FLASK_ENV = getenv('FLASK_ENV', 'production')
 
 INPE_STAC_DELETED = getenv('INPE_STAC_DELETED', '0')
 
+# database connection pool, it is shared by all requests inside the same process
+DB_POOL_SIZE = int(getenv('DB_POOL_SIZE', '5'))
+DB_MAX_OVERFLOW = int(getenv('DB_MAX_OVERFLOW', '10'))
+# number of seconds after that a connection is recycled, it must be lower than MySQL `wait_timeout`
+DB_POOL_RECYCLE = int(getenv('DB_POOL_RECYCLE', '3600'))
+DB_POOL_TIMEOUT = int(getenv('DB_POOL_TIMEOUT', '30'))
+DB_POOL_PRE_PING = getenv('DB_POOL_PRE_PING', '1') == '1'
+# connection pool of the ASGI application (see `inpe_stac.asgi`), it is shared by all requests of the event loop
+DB_ASYNC_POOL_MIN_SIZE = int(getenv('DB_ASYNC_POOL_MIN_SIZE', '1'))
+DB_ASYNC_POOL_MAX_SIZE = int(getenv('DB_ASYNC_POOL_MAX_SIZE', '50'))
+# max number of queries executed in background threads (e.g. the count of a search), by process
+INPE_STAC_QUERY_WORKERS = int(getenv('INPE_STAC_QUERY_WORKERS', '4'))
+
+# item searches with `limit` greater than or equal to this value are streamed as a chunked response
+INPE_STAC_STREAM_MIN_LIMIT = int(getenv('INPE_STAC_STREAM_MIN_LIMIT', '1000'))
+# number of rows read from the server-side cursor and encoded at once by the streamed responses
+INPE_STAC_STREAM_BATCH_SIZE = int(getenv('INPE_STAC_STREAM_BATCH_SIZE', '500'))
+
+# how the `bbox` filter is answered: `none`, `mysql` or `rtree` (see `inpe_stac.spatial`)
+INPE_STAC_SPATIAL_INDEX = getenv('INPE_STAC_SPATIAL_INDEX', 'none')
+INPE_STAC_RTREE_PATH = getenv('INPE_STAC_RTREE_PATH', 'inpe_stac_rtree.sqlite')
+# max number of ids selected by the R-tree that are searched by primary key
+INPE_STAC_RTREE_MAX_IDS = int(getenv('INPE_STAC_RTREE_MAX_IDS', '5000'))
+
+# max number of scenes selected by the bbox of an `intersects` geometry, that are compared to the geometry
+INPE_STAC_INTERSECTS_MAX_CANDIDATES = int(getenv('INPE_STAC_INTERSECTS_MAX_CANDIDATES', '100000'))
+# number of footprints compared to the `intersects` geometry at once
+INPE_STAC_INTERSECTS_BATCH_SIZE = int(getenv('INPE_STAC_INTERSECTS_BATCH_SIZE', '10000'))
+
+# number of seconds that the collections are kept in memory before checking if they have changed
+INPE_STAC_COLLECTION_CACHE_TTL = int(getenv('INPE_STAC_COLLECTION_CACHE_TTL', '60'))
+
+# number of seconds that the number of matched items of a search is reused
+INPE_STAC_COUNT_CACHE_TTL = int(getenv('INPE_STAC_COUNT_CACHE_TTL', '60'))
+# max number of searches whose number of matched items is kept
+INPE_STAC_COUNT_CACHE_SIZE = int(getenv('INPE_STAC_COUNT_CACHE_SIZE', '1024'))
+# number of seconds that the number of items of each collection is reused
+INPE_STAC_TOTALS_CACHE_TTL = int(getenv('INPE_STAC_TOTALS_CACHE_TTL', '300'))
+# number of seconds that the state of the items of each collection is reused before checking if they have changed
+INPE_STAC_WATERMARK_TTL = int(getenv('INPE_STAC_WATERMARK_TTL', '30'))
+# optional column of `stac_item` with the last time that each item has been updated
+INPE_STAC_UPDATED_COLUMN = getenv('INPE_STAC_UPDATED_COLUMN', '')
+
+# if it is `1`, then the queries are executed through server-side prepared statements (MySQL only),
+# each connection keeps up to `INPE_STAC_PREPARED_STATEMENTS_SIZE` statements
+INPE_STAC_PREPARED_STATEMENTS = getenv('INPE_STAC_PREPARED_STATEMENTS', '0') == '1'
+INPE_STAC_PREPARED_STATEMENTS_SIZE = int(getenv('INPE_STAC_PREPARED_STATEMENTS_SIZE', '100'))
+
+# max number of ids bound inside each `IN` list of the searches by id
+INPE_STAC_IDS_BATCH_SIZE = int(getenv('INPE_STAC_IDS_BATCH_SIZE', '1000'))
+# max number of ids of a request of the bulk endpoint (i.e. `POST /stac/items`)
+INPE_STAC_BULK_MAX_IDS = int(getenv('INPE_STAC_BULK_MAX_IDS', '5000'))
+# encoded items that are kept in memory by the bulk endpoint
+INPE_STAC_ITEM_CACHE_TTL = int(getenv('INPE_STAC_ITEM_CACHE_TTL', '300'))
+INPE_STAC_ITEM_CACHE_SIZE = int(getenv('INPE_STAC_ITEM_CACHE_SIZE', '100000'))
+
+# shared cache of the responses, its entries are identified by the request and the state of the items
+INPE_STAC_RESPONSE_CACHE_SIZE = int(getenv('INPE_STAC_RESPONSE_CACHE_SIZE', '1024'))
+INPE_STAC_RESPONSE_CACHE_BYTES = int(getenv('INPE_STAC_RESPONSE_CACHE_BYTES', str(64 * 1024 * 1024)))
+# bigger responses are not cached, but they have an ETag anyway
+INPE_STAC_RESPONSE_CACHE_MAX_ITEM_BYTES = int(getenv('INPE_STAC_RESPONSE_CACHE_MAX_ITEM_BYTES', str(1024 * 1024)))
+# max number of seconds that a response is cached. Without `INPE_STAC_UPDATED_COLUMN`, the changes of the existing
+# items are not seen by the watermarks, then the ETags also change by their own after this number of seconds
+INPE_STAC_RESPONSE_CACHE_TTL = int(getenv('INPE_STAC_RESPONSE_CACHE_TTL', '300'))
+# `max-age` of the `Cache-Control` header of the cached endpoints
+INPE_STAC_HTTP_MAX_AGE = int(getenv('INPE_STAC_HTTP_MAX_AGE', '30'))
+
+# coalescing of the identical requests that arrive at the same time: `thread` (between the threads of
+# a process), `file` (also between processes, through lock files inside `INPE_STAC_SINGLE_FLIGHT_DIR`) or `none`
+INPE_STAC_SINGLE_FLIGHT_MODE = getenv('INPE_STAC_SINGLE_FLIGHT_MODE', 'thread')
+INPE_STAC_SINGLE_FLIGHT_DIR = getenv('INPE_STAC_SINGLE_FLIGHT_DIR', path.join(gettempdir(), 'inpe_stac_single_flight'))
+# max number of seconds that a process waits for the response of another one
+INPE_STAC_SINGLE_FLIGHT_TIMEOUT = int(getenv('INPE_STAC_SINGLE_FLIGHT_TIMEOUT', '30'))
+
+# if it is `1`, then the time of the stages of each request is sent by the `Server-Timing` header
+INPE_STAC_SERVER_TIMING = getenv('INPE_STAC_SERVER_TIMING', '1') == '1'
+# if it is `1`, then the metrics of the requests are exposed by `/metrics` (see `inpe_stac.metrics`)
+INPE_STAC_METRICS = getenv('INPE_STAC_METRICS', '1') == '1'
+# directory where each worker process writes its metrics, that are summed by `/metrics` (empty for one process)
+INPE_STAC_METRICS_DIR = getenv('INPE_STAC_METRICS_DIR', path.join(gettempdir(), 'inpe_stac_metrics'))
+# min number of seconds between the writes of the metrics of a process
+INPE_STAC_METRICS_WRITE_INTERVAL = float(getenv('INPE_STAC_METRICS_WRITE_INTERVAL', '1'))
+
+# encodings of the compressed responses, in order of preference (`zstd` and `br` are used if their packages are
+# installed), empty disables the compression
+INPE_STAC_COMPRESSION = getenv('INPE_STAC_COMPRESSION', 'zstd,br,gzip')
+# levels by encoding, optionally by route, e.g. `gzip=6,/stac/export:gzip=1` (see `inpe_stac.compression`)
+INPE_STAC_COMPRESSION_LEVELS = getenv(
+    'INPE_STAC_COMPRESSION_LEVELS', 'gzip=6,br=4,zstd=3,/collections/<collection_id>/export:gzip=1,/stac/export:gzip=1'
+)
+# smaller bodies are not compressed (the streamed ones are always compressed)
+INPE_STAC_COMPRESSION_MIN_SIZE = int(getenv('INPE_STAC_COMPRESSION_MIN_SIZE', '1024'))
+
+# backend of the item searches: `sql` or `snapshot` (an in-memory columnar copy, see `inpe_stac.snapshot`)
+INPE_STAC_SEARCH_BACKEND = getenv('INPE_STAC_SEARCH_BACKEND', 'sql')
+# number of seconds between the refreshes of the snapshot of the items
+INPE_STAC_SNAPSHOT_REFRESH_INTERVAL = int(getenv('INPE_STAC_SNAPSHOT_REFRESH_INTERVAL', '60'))
+
+# production server (see `inpe_stac.gunicorn_conf`)
+GUNICORN_BIND = getenv('GUNICORN_BIND', '0.0.0.0:5000')
+# number of worker processes, by default one by CPU core
+GUNICORN_WORKERS = int(getenv('GUNICORN_WORKERS', str(cpu_count())))
+# number of threads by worker, each one answers a request at once
+GUNICORN_THREADS = int(getenv('GUNICORN_THREADS', '4'))
+GUNICORN_KEEPALIVE = int(getenv('GUNICORN_KEEPALIVE', '5'))
+GUNICORN_TIMEOUT = int(getenv('GUNICORN_TIMEOUT', '120'))
+# a worker is restarted after this number of requests (0 disables it), the jitter avoids restarting all at once
+GUNICORN_MAX_REQUESTS = int(getenv('GUNICORN_MAX_REQUESTS', '10000'))
+GUNICORN_MAX_REQUESTS_JITTER = int(getenv('GUNICORN_MAX_REQUESTS_JITTER', '1000'))
+
+# levels of the loggers, e.g. `inpe_stac.data=DEBUG,inpe_stac.access=WARNING` (see `inpe_stac.log`)
+INPE_STAC_LOG_LEVELS = getenv('INPE_STAC_LOG_LEVELS', '')
+# the high-volume messages are written once by this number of calls (1 writes all of them)
+INPE_STAC_LOG_SAMPLE_EVERY = int(getenv('INPE_STAC_LOG_SAMPLE_EVERY', '100'))
+# if it is `1`, then a JSON line is written by request to the `inpe_stac.access` logger
+INPE_STAC_ACCESS_LOG = getenv('INPE_STAC_ACCESS_LOG', '1') == '1'
+
 # default logging level in production server
 LOGGING_LEVEL = INFO
 
@@ -0,0 +1,377 @@
+#!/usr/bin/env python3
+
+"""
+Export of the items as newline-delimited GeoJSON Features (NDJSON), in order to mirror whole collections.
+
+The items are read from one server-side cursor in primary key order, without COUNT nor OFFSET, then exporting
+a collection is a single sequential scan and the memory does not depend on the number of items. The id of the
+last exported item is the token that resumes an interrupted export (i.e. the items after it are exported).
+
+The items are exported by the `/collections/<collection_id>/export` and `/stac/export` endpoints, or by:
+
+    python -m inpe_stac.export CBERS4A_MUX_L2_DN --output CBERS4A_MUX_L2_DN.ndjson
+    python -m inpe_stac.export CBERS4A_MUX_L2_DN --output CBERS4A_MUX_L2_DN.ndjson --url http://localhost:8089/
+
+An export to a file that already exists goes on from its last complete line.
+"""
+
+import zlib
+
+from argparse import ArgumentParser
+from http.client import HTTPException, IncompleteRead
+from json import loads, JSONDecodeError
+from os import path
+from sys import stdout
+from time import perf_counter, sleep
+from urllib.error import HTTPError, URLError
+from urllib.parse import quote, urlencode
+from urllib.request import Request, urlopen
+
+from werkzeug.exceptions import BadRequest
+
+from inpe_stac.log import get_logger
+from inpe_stac.timing import add_timing, add_rows
+from inpe_stac.concurrency import is_async
+from inpe_stac.database import get_engine
+from inpe_stac.data import insert_deleted_flag_to_where, make_select_list, make_time_where, parse_bbox, \
+                           get_footprints, do_query_stream, split_collections
+from inpe_stac.spatial import make_bbox_where
+from inpe_stac.geometry import parse_geometry, get_bbox, intersects_footprints
+from inpe_stac.query import compile_query
+from inpe_stac.serializer import FeatureSerializer, dumps
+from inpe_stac.environment import BASE_URI, INPE_STAC_STREAM_BATCH_SIZE, INPE_STAC_INTERSECTS_BATCH_SIZE
+
+
+logger = get_logger(__name__)
+
+
+NDJSON_MIMETYPE = 'application/x-ndjson'
+
+LINKS = [
+    {'href': f'{BASE_URI}collections/', 'rel': 'self'},
+    {'href': f'{BASE_URI}collections/', 'rel': 'parent'},
+    {'href': f'{BASE_URI}collections/', 'rel': 'collection'},
+    {'href': f'{BASE_URI}stac', 'rel': 'root'}
+]
+
+
+class ExportQuery:
+    """
+    SQL of an export and the geometry of its `intersects` filter, that is compared to the read rows.
+    """
+
+    def __init__(self, sql, params, polygons=None):
+        self.sql = sql
+        self.params = params
+        self.polygons = polygons
+
+    def is_empty(self):
+        return self.sql is None
+
+
+def make_export_query(collections=None, bbox=None, time=None, query=None, intersects=None, after=None):
+    """
+    Return the `ExportQuery` of the items that match the filters, ordered by primary key.
+    If `after` (i.e. the id of the last exported item) is given, then just the items after it are read.
+
+    The filters are validated here, then the errors are raised before the response starts.
+    """
+
+    where = []
+    params = {}
+    polygons = None
+
+    if collections is not None:
+        if isinstance(collections, str):
+            collections = collections.split(',')
+
+        collections, _ = split_collections(collections)
+
+        if not collections:
+            return ExportQuery(None, params)
+
+        where.append('collection IN :collections')
+        params['collections'] = collections
+
+    if bbox is not None:
+        where.append(make_bbox_where(params, parse_bbox(bbox), collections=collections))
+
+    if time is not None:
+        make_time_where(where, params, time)
+
+    if query is not None:
+        if isinstance(query, str):
+            try:
+                query = loads(query)
+            except JSONDecodeError:
+                raise BadRequest('`query` parameter is not a valid JSON')
+
+        where += compile_query(query, params)
+
+    # the footprints are compared while the rows are read, then there is not a max number of candidates
+    if intersects is not None:
+        polygons = parse_geometry(intersects)
+        where.append(make_bbox_where(params, get_bbox(polygons), collections=collections, prefix='i_'))
+
+    if after is not None:
+        where.append('id > :after')
+        params['after'] = after
+
+    insert_deleted_flag_to_where(where)
+
+    # MySQL would rather read the index of a filter and sort all of its rows,
+    # instead of scanning the primary key, that is already in order
+    is_mysql = is_async() or get_engine().dialect.name == 'mysql'
+
+    sql = '''
+        SELECT {}
+        FROM stac_item {}
+        WHERE
+            {}
+        ORDER BY id
+    '''.format(
+        make_select_list(), 'FORCE INDEX (PRIMARY)' if is_mysql else '', '\nAND '.join(where) or '1 = 1'
+    )
+
+    return ExportQuery(sql, params, polygons)
+
+
+def iter_export_rows(export_query):
+    """
+    Yield the rows of an `ExportQuery` in primary key order. If there is an `intersects` filter, then
+    the footprints are compared to it in batches of `INPE_STAC_INTERSECTS_BATCH_SIZE` rows.
+    """
+
+    if export_query.is_empty():
+        return
+
+    rows = do_query_stream(export_query.sql, **export_query.params)
+
+    if export_query.polygons is None:
+        yield from rows
+        return
+
+    batch = []
+
+    for row in rows:
+        batch.append(row)
+
+        if len(batch) == INPE_STAC_INTERSECTS_BATCH_SIZE:
+            yield from filter_intersecting_rows(batch, export_query.polygons)
+            batch = []
+
+    if batch:
+        yield from filter_intersecting_rows(batch, export_query.polygons)
+
+
+def filter_intersecting_rows(rows, polygons):
+    mask = intersects_footprints(get_footprints(rows), polygons)
+
+    return [row for row, intersects in zip(rows, mask) if intersects]
+
+
+def iter_ndjson_items(rows, links=LINKS):
+    """
+    Write the rows as newline-delimited GeoJSON Features, in chunks of `INPE_STAC_STREAM_BATCH_SIZE` features.
+    """
+
+    serializer = FeatureSerializer(links)
+    exported = 0
+    batch = []
+
+    serialise_time = encode_time = 0
+
+    def encode(batch):
+        nonlocal encode_time
+
+        start_time = perf_counter()
+        chunk = b''.join(dumps(feature) + b'\n' for feature in batch)
+        encode_time += perf_counter() - start_time
+
+        return chunk
+
+    for row in rows:
+        start_time = perf_counter()
+        batch.append(serializer.make_feature(row))
+        serialise_time += perf_counter() - start_time
+
+        exported += 1
+
+        if len(batch) == INPE_STAC_STREAM_BATCH_SIZE:
+            yield encode(batch)
+            batch = []
+
+    if batch:
+        yield encode(batch)
+
+    add_timing('serialise', serialise_time)
+    add_timing('encode', encode_time)
+    add_rows(exported)
+
+    logger.info('iter_ndjson_items - exported: %s', exported)
+
+
+def get_last_id(file_path):
+    """
+    Return the id of the last complete line of an NDJSON file, or None if there is not one.
+    An incomplete line at the end (i.e. of an interrupted export) is removed from the file.
+    """
+
+    if not path.exists(file_path):
+        return None
+
+    with open(file_path, 'rb+') as output_file:
+        position = output_file.seek(0, 2)
+        tail = b''
+
+        # the file is read backwards until the last complete line and the line end before it
+        while position > 0 and tail.count(b'\n') < 2:
+            size = min(65536, position)
+            position -= size
+
+            output_file.seek(position)
+            tail = output_file.read(size) + tail
+
+        complete_end = tail.rfind(b'\n') + 1
+        output_file.truncate(position + complete_end)
+
+    lines = tail[:complete_end].splitlines()
+
+    if not lines or not lines[-1]:
+        return None
+
+    return loads(lines[-1])['id']
+
+
+def make_export_url(url, collections, filters, after=None):
+    """
+    Return the URL of the export endpoint of a server.
+    """
+
+    params = {key: value for key, value in filters.items() if value is not None}
+
+    if after is not None:
+        params['after'] = after
+
+    if collections and len(collections) == 1:
+        url = '{}/collections/{}/export'.format(url.rstrip('/'), quote(collections[0]))
+    else:
+        url = '{}/stac/export'.format(url.rstrip('/'))
+
+        if collections:
+            params['collections'] = ','.join(collections)
+
+    return url + ('?' + urlencode(params) if params else '')
+
+
+def iter_response_lines(response):
+    """
+    Yield the lines of an HTTP response, that is decompressed while it is read if it is a gzip one.
+    """
+
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS) \
+        if response.headers.get('Content-Encoding') == 'gzip' else None
+
+    rest = b''
+
+    for data in iter(lambda: response.read(65536), b''):
+        if decompressor is not None:
+            data = decompressor.decompress(data)
+
+        lines = (rest + data).split(b'\n')
+        rest = lines.pop()
+
+        for line in lines:
+            yield line + b'\n'
+
+    # a line without its end has been interrupted
+    if rest or (decompressor is not None and not decompressor.eof):
+        raise IncompleteRead(rest)
+
+
+def iter_remote_lines(url, collections, filters, after=None, retries=5, timeout=60):
+    """
+    Yield the lines of the export endpoint of a server. If the connection fails, then the export
+    is requested again after the last received line, up to `retries` times in a row.
+    """
+
+    failures = 0
+    last_line = None
+
+    while True:
+        if last_line is not None:
+            after = loads(last_line)['id']
+
+        request = Request(make_export_url(url, collections, filters, after), headers={'Accept-Encoding': 'gzip'})
+
+        try:
+            with urlopen(request, timeout=timeout) as response:
+                for line in iter_response_lines(response):
+                    last_line = line
+                    failures = 0
+
+                    yield line
+
+            return
+        except (URLError, HTTPException, ConnectionError, TimeoutError) as error:
+            # just the server being unavailable is solved by requesting it again, not the errors of the request
+            if isinstance(error, HTTPError) and error.code not in (502, 503, 504):
+                raise
+
+            failures += 1
+
+            if failures > retries:
+                raise
+
+            logger.warning('iter_remote_lines - %s, resuming after the last received line', error)
+            sleep(min(2 ** failures, 60))
+
+
+def export(collections, filters, output=None, url=None, retries=5):
+    """
+    Write the items to `output` (a file path or the standard output), from the database or, if `url` is given,
+    from the export endpoint of a server. An export to a file that already exists goes on from its last line.
+    """
+
+    after = get_last_id(output) if output else None
+
+    if after is not None:
+        logger.info('export - resuming after: %s', after)
+
+    if url:
+        chunks = iter_remote_lines(url, collections, filters, after=after, retries=retries)
+    else:
+        chunks = iter_ndjson_items(iter_export_rows(make_export_query(collections, after=after, **filters)))
+
+    output_file = open(output, 'ab') if output else stdout.buffer
+
+    try:
+        for chunk in chunks:
+            output_file.write(chunk)
+    finally:
+        if output:
+            output_file.close()
+        else:
+            output_file.flush()
+
+
+def main():
+    parser = ArgumentParser(description='Export the items as newline-delimited GeoJSON Features')
+    parser.add_argument('collections', nargs='*', help='collections of the items, by default all collections')
+    parser.add_argument('--bbox', help='`min_x,min_y,max_x,max_y`')
+    parser.add_argument('--time', help='`start/end` or `start`')
+    parser.add_argument('--query', help='filter of the query extension, as JSON')
+    parser.add_argument('--intersects', help='GeoJSON Polygon or MultiPolygon')
+    parser.add_argument('--output', help='NDJSON file, if it exists then the export goes on from its last line')
+    parser.add_argument('--url', help='base URL of a server, instead of reading the database')
+    parser.add_argument('--retries', type=int, default=5, help='max number of resumes in a row of a remote export')
+
+    args = parser.parse_args()
+
+    filters = {'bbox': args.bbox, 'time': args.time, 'query': args.query, 'intersects': args.intersects}
+
+    export(args.collections or None, filters, output=args.output, url=args.url, retries=args.retries)
+
+
+if __name__ == '__main__':
+    main()
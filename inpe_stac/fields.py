@@ -0,0 +1,141 @@
+"""
+Fields extension: selection of the members of the features returned by the item searches.
+
+Specification: https://github.com/radiantearth/stac-spec/blob/v0.8.0/api-spec/extensions/fields/README.md
+
+The selected members are translated to the columns of `stac_item` that they need, then the
+columns of the members that are not returned (e.g. `assets`) are never read, parsed or encoded.
+"""
+
+from collections import OrderedDict
+
+from werkzeug.exceptions import BadRequest
+
+
+CORNER_COLUMNS = (
+    'tl_longitude', 'tl_latitude', 'bl_longitude', 'bl_latitude',
+    'br_longitude', 'br_latitude', 'tr_longitude', 'tr_latitude'
+)
+
+# member of the feature: columns of `stac_item` that create it, in the order of the feature
+FEATURE_COLUMNS = OrderedDict([
+    ('type', ()),
+    ('id', ('id',)),
+    ('collection', ('collection',)),
+    ('geometry', CORNER_COLUMNS),
+    ('bbox', CORNER_COLUMNS),
+    ('properties', ()),
+    ('assets', ('assets', 'thumbnail')),
+    ('links', ('collection', 'id'))
+])
+
+# each property is created from the column with its name
+PROPERTIES = ('datetime', 'path', 'row', 'satellite', 'sensor', 'cloud_cover', 'sync_loss')
+
+# members that are always returned, then a feature is still valid GeoJSON with an id
+REQUIRED_FIELDS = ('type', 'id')
+
+
+class FieldSelection:
+    """
+    Members of the features that are returned: `fields` is a tuple of members and `properties`
+    is a tuple of the returned properties. `columns` is a tuple of the columns that they need.
+    """
+
+    def __init__(self, include=None, exclude=None):
+        include = self.__split(include or [])
+        exclude = self.__split(exclude or [])
+
+        # a member inside both lists is returned, without `include` all members are returned but the excluded ones
+        if include:
+            exclude = {field: props for field, props in exclude.items() if field not in include or props is not None}
+        else:
+            include = OrderedDict.fromkeys(FEATURE_COLUMNS)
+
+        for field in REQUIRED_FIELDS:
+            include[field] = None
+            exclude.pop(field, None)
+
+        self.fields = tuple(
+            field for field in FEATURE_COLUMNS
+            if field in include and not (field in exclude and exclude[field] is None)
+        )
+
+        # the properties that are included by name are returned, else all of them but the excluded ones
+        if 'properties' not in self.fields:
+            self.properties = ()
+        elif include.get('properties') is not None:
+            self.properties = tuple(p for p in PROPERTIES if p in include['properties'])
+        else:
+            self.properties = tuple(p for p in PROPERTIES if p not in (exclude.get('properties') or ()))
+
+        columns = [column for field in self.fields for column in FEATURE_COLUMNS[field]]
+        columns += self.properties
+
+        self.columns = tuple(OrderedDict.fromkeys(columns))
+
+    def __repr__(self):
+        return 'FieldSelection(fields={}, properties={})'.format(self.fields, self.properties)
+
+    @staticmethod
+    def __split(paths):
+        """
+        Return the members of `paths` (e.g. `['id', 'properties.cloud_cover']`) as a dict, where the
+        value of a member is None if the whole member is selected, else the selected properties.
+        """
+
+        if not isinstance(paths, list) or not all(isinstance(p, str) for p in paths):
+            raise BadRequest('`fields` parameter must have lists of strings')
+
+        members = {}
+
+        for p in paths:
+            field, _, prop = p.partition('.')
+
+            if field not in FEATURE_COLUMNS or (prop and (field != 'properties' or prop not in PROPERTIES)):
+                raise BadRequest('`fields` parameter can not select `{}`, the fields are: {}'.format(
+                    p, ', '.join(list(FEATURE_COLUMNS) + ['properties.' + p for p in PROPERTIES])
+                ))
+
+            if not prop:
+                members[field] = None
+            elif members.get(field, ()) is not None:
+                members[field] = members.get(field, ()) + (prop,)
+
+        return members
+
+    def get_columns(self, *columns):
+        """
+        Return the columns of the selection and `columns` (e.g. the sort keys), with `id` and `collection`,
+        that are used by the pagination.
+        """
+
+        return tuple(OrderedDict.fromkeys(('id', 'collection') + self.columns + columns))
+
+
+def parse_fields(fields):
+    """
+    Return the `FieldSelection` of the `fields` parameter, that is an object with `include` and `exclude`
+    lists (POST) or a string of members separated by commas, where the excluded ones start by `-` (GET).
+    Return None if there is not a selection, then the whole features are returned.
+    """
+
+    if fields is None:
+        return None
+
+    if isinstance(fields, str):
+        # a `+` of an URL is decoded as a space
+        paths = [p.strip() for p in fields.split(',') if p.strip()]
+
+        fields = {
+            'include': [p.lstrip('+') for p in paths if not p.startswith('-')],
+            'exclude': [p[1:] for p in paths if p.startswith('-')]
+        }
+
+    if not isinstance(fields, dict):
+        raise BadRequest('`fields` parameter must be an object with `include` and `exclude` lists')
+
+    if not fields.get('include') and not fields.get('exclude'):
+        return None
+
+    return FieldSelection(include=fields.get('include'), exclude=fields.get('exclude'))
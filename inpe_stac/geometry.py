@@ -0,0 +1,164 @@
+"""
+Exact intersection between the scene footprints and a GeoJSON geometry, used by the `intersects` filter.
+
+The footprints are tested in batches through NumPy arrays, instead of one by one.
+"""
+
+from json import loads
+
+import numpy as np
+from werkzeug.exceptions import BadRequest
+
+
+# max number of elements of the arrays created when a batch is compared to the edges of the geometry
+MAX_ARRAY_SIZE = 1000000
+
+
+def parse_geometry(geometry):
+    """
+    Return the polygons of a GeoJSON Polygon or MultiPolygon (a string or a dict) as lists of rings,
+    where each ring is an array of `(x, y)` points whose first and last points are the same.
+    """
+
+    try:
+        if isinstance(geometry, str):
+            geometry = loads(geometry)
+
+        # a Feature is accepted instead of its geometry
+        if geometry.get('type') == 'Feature':
+            geometry = geometry['geometry']
+
+        if geometry['type'] == 'Polygon':
+            polygons = [geometry['coordinates']]
+        elif geometry['type'] == 'MultiPolygon':
+            polygons = geometry['coordinates']
+        else:
+            raise BadRequest('`intersects` must be a Polygon or a MultiPolygon')
+
+        result = []
+
+        for polygon in polygons:
+            rings = []
+
+            for ring in polygon:
+                ring = np.array(ring, dtype=float)[:, :2]
+
+                if len(ring) < 3:
+                    raise ValueError()
+
+                # close the ring if it is not closed
+                if not np.array_equal(ring[0], ring[-1]):
+                    ring = np.vstack([ring, ring[:1]])
+
+                rings.append(ring)
+
+            if not rings:
+                raise ValueError()
+
+            result.append(rings)
+
+    except BadRequest:
+        raise
+    except (AttributeError, IndexError, KeyError, TypeError, ValueError):
+        raise BadRequest('`intersects` is not a valid GeoJSON geometry')
+
+    if not result:
+        raise BadRequest('`intersects` is not a valid GeoJSON geometry')
+
+    return result
+
+
+def get_bbox(polygons):
+    """
+    Return the `min_x, min_y, max_x, max_y` of the polygons.
+    """
+
+    points = np.vstack([polygon[0] for polygon in polygons])
+
+    return (
+        float(points[:, 0].min()), float(points[:, 1].min()),
+        float(points[:, 0].max()), float(points[:, 1].max())
+    )
+
+
+def cross(o, a, b):
+    return (a[..., 0] - o[..., 0]) * (b[..., 1] - o[..., 1]) - (a[..., 1] - o[..., 1]) * (b[..., 0] - o[..., 0])
+
+
+def segments_intersect(a1, a2, b1, b2):
+    """
+    Return if the segments `a1 a2` intersect the segments `b1 b2`, including the ones that touch each other.
+    The arrays are broadcasted, their last dimension is `(x, y)`.
+    """
+
+    # the bounding boxes of the segments must overlap, it also solves the collinear segments
+    overlap = (
+        (np.minimum(a1[..., 0], a2[..., 0]) <= np.maximum(b1[..., 0], b2[..., 0])) &
+        (np.maximum(a1[..., 0], a2[..., 0]) >= np.minimum(b1[..., 0], b2[..., 0])) &
+        (np.minimum(a1[..., 1], a2[..., 1]) <= np.maximum(b1[..., 1], b2[..., 1])) &
+        (np.maximum(a1[..., 1], a2[..., 1]) >= np.minimum(b1[..., 1], b2[..., 1]))
+    )
+
+    # the ends of each segment must be on different sides of the other one
+    return overlap & (cross(b1, b2, a1) * cross(b1, b2, a2) <= 0) & (cross(a1, a2, b1) * cross(a1, a2, b2) <= 0)
+
+
+def points_inside(points, starts, ends):
+    """
+    Return if the points are inside the polygon whose edges are `starts -> ends` (even-odd rule),
+    where `points` has the shape `(..., 1, 2)` and the edges `(..., M, 2)`.
+    """
+
+    x, y = points[..., 0], points[..., 1]
+    x1, y1, x2, y2 = starts[..., 0], starts[..., 1], ends[..., 0], ends[..., 1]
+
+    crosses = (y1 > y) != (y2 > y)
+
+    # the horizontal edges do not cross the ray, then their division is ignored
+    with np.errstate(divide='ignore', invalid='ignore'):
+        x_intersection = x1 + (y - y1) * (x2 - x1) / (y2 - y1)
+
+    return ((crosses & (x < x_intersection)).sum(axis=-1) % 2) == 1
+
+
+def intersects_footprints(footprints, polygons):
+    """
+    Return a boolean mask of the footprints (an array `(N, 4, 2)` with the corners of each scene)
+    that intersect any of the polygons.
+
+    Two polygons intersect if their edges cross each other or if one of them is inside the other one.
+    """
+
+    footprints = np.asarray(footprints, dtype=float)
+    mask = np.zeros(len(footprints), dtype=bool)
+
+    # edges of the footprints: `(N, 4, 1, 2)`
+    footprint_starts = footprints[:, :, np.newaxis, :]
+    footprint_ends = np.roll(footprints, -1, axis=1)[:, :, np.newaxis, :]
+
+    for polygon in polygons:
+        # edges of all rings of the polygon: `(M, 2)`
+        starts = np.vstack([ring[:-1] for ring in polygon])
+        ends = np.vstack([ring[1:] for ring in polygon])
+
+        batch_size = max(1, MAX_ARRAY_SIZE // (4 * len(starts)))
+
+        for i in range(0, len(footprints), batch_size):
+            batch = slice(i, i + batch_size)
+
+            # the edges of the footprints cross the edges of the polygon
+            crossing = segments_intersect(
+                footprint_starts[batch], footprint_ends[batch], starts, ends
+            ).any(axis=(1, 2))
+
+            # a corner of the footprint is inside the polygon (outside its holes)
+            footprint_inside = points_inside(footprints[batch, 0:1, :], starts, ends)
+
+            # a point of the polygon is inside the footprint
+            polygon_inside = points_inside(
+                polygon[0][0][np.newaxis, np.newaxis, :], footprints[batch], np.roll(footprints[batch], -1, axis=1)
+            )
+
+            mask[batch] |= crossing | footprint_inside | polygon_inside
+
+    return mask
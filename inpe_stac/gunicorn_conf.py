@@ -0,0 +1,67 @@
+"""
+Configuration of the production server:
+
+    gunicorn --config python:inpe_stac.gunicorn_conf inpe_stac.app:app
+
+The application is imported once by the master process (`preload_app`), in order to parse `STAC.yaml`
+and to load the collections before forking the workers, which share these pages of memory.
+Each worker creates its own database connections and query threads after the fork.
+"""
+
+from inpe_stac.environment import GUNICORN_BIND, GUNICORN_WORKERS, GUNICORN_THREADS, \
+                                  GUNICORN_KEEPALIVE, GUNICORN_TIMEOUT, GUNICORN_MAX_REQUESTS, \
+                                  GUNICORN_MAX_REQUESTS_JITTER, INPE_STAC_SEARCH_BACKEND
+
+
+bind = GUNICORN_BIND
+workers = GUNICORN_WORKERS
+threads = GUNICORN_THREADS
+worker_class = 'gthread'
+keepalive = GUNICORN_KEEPALIVE
+timeout = GUNICORN_TIMEOUT
+max_requests = GUNICORN_MAX_REQUESTS
+max_requests_jitter = GUNICORN_MAX_REQUESTS_JITTER
+
+preload_app = True
+
+
+def when_ready(server):
+    """
+    Warm the application inside the master process, before the workers are forked.
+    """
+
+    from inpe_stac.app import app, swagger
+    from inpe_stac.data import collection_catalog, snapshot_engine
+    from inpe_stac.database import dispose_engine
+    from inpe_stac.metrics import clear_metrics_files
+
+    # the metrics of the workers of a previous execution are not summed with the new ones
+    clear_metrics_files()
+
+    try:
+        collection_catalog.refresh(force=True)
+
+        # the workers share the pages of the snapshot, until they refresh it
+        if INPE_STAC_SEARCH_BACKEND == 'snapshot':
+            snapshot_engine.refresh()
+
+        # the documents of the collections and the OpenAPI specification are built once for all workers
+        with app.test_client() as client:
+            for url in ('/collections', '/stac', '/{}'.format(swagger.config['specs'][0]['route'].lstrip('/'))):
+                client.get(url)
+
+        server.log.info('The application has been warmed: %s collections', len(collection_catalog.get_rows() or []))
+    except Exception:
+        # the workers load the collections by their own if the database is not available yet
+        server.log.exception('The application could not be warmed')
+    finally:
+        # the connections of the master process must not be shared with the workers
+        dispose_engine()
+
+
+def post_fork(server, worker):
+    from inpe_stac.database import reset_engine, reset_executor, reset_async_pools
+
+    reset_engine()
+    reset_executor()
+    reset_async_pools()
@@ -0,0 +1,170 @@
+"""
+HTTP conditional requests and shared cache of the responses.
+
+The ETag of a response is a hash of the normalized request and of the state of the items
+(see `get_watermarks`), then it changes just when the data that may be inside the response change.
+The state of the caches that may be older than the watermarks (i.e. the snapshot and the R-tree file) is also inside
+the ETag, then a response created from them is never kept under a newer watermark. Without
+`INPE_STAC_UPDATED_COLUMN`, the ETags change each `INPE_STAC_RESPONSE_CACHE_TTL` seconds, since the changes
+of the existing items do not change the watermarks.
+A request with a matching `If-None-Match` gets a `304 Not Modified` and a repeated request gets
+the cached bytes, both without querying the database while the state of the items is cached.
+The compressed bodies are cached by ETag and encoding, next to the bytes of the response (see `inpe_stac.compression`).
+"""
+
+from functools import wraps
+from hashlib import sha1
+from json import dumps
+from time import time
+
+from flask import Response, make_response, request
+
+from inpe_stac.log import get_logger
+from inpe_stac.cache import SizedLRUCache
+from inpe_stac.compression import compress_response
+from inpe_stac.data import collection_catalog, get_watermarks, snapshot_engine
+from inpe_stac.singleflight import SingleFlight
+from inpe_stac.spatial import rtree_index
+from inpe_stac.environment import API_VERSION, BASE_URI, INPE_STAC_RESPONSE_CACHE_SIZE, \
+                                  INPE_STAC_RESPONSE_CACHE_BYTES, INPE_STAC_RESPONSE_CACHE_MAX_ITEM_BYTES, \
+                                  INPE_STAC_HTTP_MAX_AGE, INPE_STAC_SINGLE_FLIGHT_MODE, INPE_STAC_SINGLE_FLIGHT_DIR, \
+                                  INPE_STAC_SINGLE_FLIGHT_TIMEOUT, INPE_STAC_RESPONSE_CACHE_TTL, \
+                                  INPE_STAC_UPDATED_COLUMN, INPE_STAC_SEARCH_BACKEND, INPE_STAC_SPATIAL_INDEX
+
+
+logger = get_logger(__name__)
+
+
+single_flight = SingleFlight(
+    directory=INPE_STAC_SINGLE_FLIGHT_DIR if INPE_STAC_SINGLE_FLIGHT_MODE == 'file' else None,
+    timeout=INPE_STAC_SINGLE_FLIGHT_TIMEOUT,
+    # the responses that are too large to be cached are not written to be shared either
+    max_result_bytes=INPE_STAC_RESPONSE_CACHE_MAX_ITEM_BYTES
+) if INPE_STAC_SINGLE_FLIGHT_MODE != 'none' else None
+
+response_cache = SizedLRUCache(
+    max_size=INPE_STAC_RESPONSE_CACHE_SIZE,
+    max_bytes=INPE_STAC_RESPONSE_CACHE_BYTES,
+    max_item_bytes=INPE_STAC_RESPONSE_CACHE_MAX_ITEM_BYTES,
+    max_age=INPE_STAC_RESPONSE_CACHE_TTL
+)
+
+
+def get_request_key():
+    """
+    Return the request as a string, where the order of the arguments and of the JSON keys does not matter.
+    """
+
+    # HEAD has the same representation as GET
+    method = 'GET' if request.method == 'HEAD' else request.method
+
+    args = sorted(request.args.items(multi=True))
+
+    body = request.get_json(silent=True)
+
+    if body is None:
+        body = request.get_data(as_text=True)
+
+    return dumps([method, request.path, args, body], sort_keys=True, separators=(',', ':'), default=str)
+
+
+def get_watermark(collection_id=None):
+    """
+    Return the state of the data of a collection (or of all of them), that changes when the data change.
+    """
+
+    if collection_id is not None:
+        items = get_watermarks([collection_id]).get(collection_id)
+    else:
+        items = sorted(get_watermarks().items())
+
+    # the searches answered by the snapshot are as old as its last refresh
+    snapshot = snapshot_engine.get_state(collection_id) if INPE_STAC_SEARCH_BACKEND == 'snapshot' else None
+
+    # the bbox searches change when the R-tree file is built again
+    rtree = rtree_index.get_version() if INPE_STAC_SPATIAL_INDEX == 'rtree' else None
+
+    # the changes of the existing items are not seen by the watermarks without an updated column
+    epoch = int(time() // INPE_STAC_RESPONSE_CACHE_TTL) \
+        if not INPE_STAC_UPDATED_COLUMN and INPE_STAC_RESPONSE_CACHE_TTL > 0 else None
+
+    return '{}|{}|{}|{}|{}|{}|{}'.format(
+        API_VERSION, BASE_URI, collection_catalog.get_digest(), items, snapshot, rtree, epoch
+    )
+
+
+def make_etag(collection_id=None):
+    return sha1((get_watermark(collection_id) + '|' + get_request_key()).encode()).hexdigest()
+
+
+def add_cache_headers(response, etag, weak=False):
+    response.set_etag(etag, weak=weak)
+    response.headers['Cache-Control'] = 'public, max-age={}'.format(INPE_STAC_HTTP_MAX_AGE)
+
+    return response
+
+
+def cached_response(function):
+    """
+    Answer the requests of the view by its cached response or by `304 Not Modified`, when it is possible.
+    Just the successful responses are cached. If the view has a `collection_id` argument, then the
+    ETag depends just on the items of this collection.
+    """
+
+    @wraps(function)
+    def wrapper(*args, **kwargs):
+        etag = make_etag(kwargs.get('collection_id'))
+
+        # a POST request is not a conditional request, but its response is cached anyway.
+        # The ETag of a compressed response is a weak one, that is compared as the strong one
+        if request.method in ('GET', 'HEAD') and request.if_none_match.contains_weak(etag):
+            logger.debug('%s() - not modified: %s', function.__name__, etag)
+
+            response = add_cache_headers(Response(status=304), etag, weak=not request.if_none_match.contains(etag))
+            response.vary.add('Accept-Encoding')
+
+            return response
+
+        cached = response_cache.get(etag)
+
+        if cached is not None:
+            logger.debug('%s() - cached response: %s', function.__name__, etag)
+
+            body, content_type = cached
+
+            response = add_cache_headers(Response(body, content_type=content_type), etag)
+
+            return compress_response(response, cache=response_cache, cache_key=etag)
+
+        leader = {}
+
+        def execute():
+            response = leader['response'] = make_response(function(*args, **kwargs))
+
+            # just the successful responses that are not streamed can be shared
+            if response.status_code != 200 or response.is_streamed:
+                return None
+
+            body = response.get_data()
+
+            response_cache.set(etag, (body, response.content_type), len(body))
+
+            return body, response.content_type
+
+        # the identical requests that arrive while the response is created wait for it
+        shared = single_flight.do(etag, execute) if single_flight is not None else execute()
+
+        if 'response' in leader:
+            response = leader['response']
+        elif shared is not None:
+            body, content_type = shared
+            response = Response(body, content_type=content_type)
+        else:
+            response = make_response(function(*args, **kwargs))
+
+        if response.status_code != 200:
+            return response
+
+        return compress_response(add_cache_headers(response, etag), cache=response_cache, cache_key=etag)
+
+    return wrapper
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+
+"""
+Composite indexes of `stac_item` that answer the ordered searches (see `make_collection_queries`).
+
+Each collection is searched by `collection = ? AND deleted = ?`, ordered by the sort keys and `id`,
+then an index that starts by these columns returns the rows of a page by a range seek,
+without sorting the rows of the whole collection.
+
+The missing indexes are listed and created by the commands of this module:
+
+    python -m inpe_stac.indexes advise
+    python -m inpe_stac.indexes migrate
+"""
+
+from argparse import ArgumentParser
+from collections import OrderedDict
+
+from inpe_stac.log import get_logger
+from inpe_stac.database import get_engine
+from inpe_stac.query import quote_identifier
+
+
+logger = get_logger(__name__)
+
+
+# name: columns
+INDEXES = OrderedDict([
+    # default order of each collection (i.e. `datetime, id`)
+    ('stac_item_collection_datetime_idx', ('collection', 'deleted', 'datetime', 'id')),
+    # `time` filter, that compares the `date` column
+    ('stac_item_collection_date_idx', ('collection', 'deleted', 'date', 'id')),
+    # default order of all collections together (i.e. `collection, datetime, id`) and `sortby` without collections
+    ('stac_item_deleted_collection_datetime_idx', ('deleted', 'collection', 'datetime', 'id')),
+    ('stac_item_deleted_datetime_idx', ('deleted', 'datetime', 'id')),
+    # `sortby` of the sort extension
+    ('stac_item_collection_cloud_cover_idx', ('collection', 'deleted', 'cloud_cover', 'id')),
+    ('stac_item_collection_path_row_idx', ('collection', 'deleted', 'path', 'row', 'id'))
+])
+
+
+def get_existing_indexes(connection):
+    """
+    Return the columns of the indexes of `stac_item`, e.g. `{'PRIMARY': ('id',)}`.
+    """
+
+    indexes = {}
+
+    for row in connection.execute('SHOW INDEX FROM stac_item'):
+        indexes.setdefault(row['Key_name'], []).append((row['Seq_in_index'], row['Column_name']))
+
+    return {name: tuple(column for _, column in sorted(columns)) for name, columns in indexes.items()}
+
+
+def get_missing_indexes(connection):
+    """
+    Return the indexes of `INDEXES` that are not covered by an existing index,
+    i.e. there is not an index that starts by the same columns.
+    """
+
+    existing = get_existing_indexes(connection).values()
+
+    return OrderedDict(
+        (name, columns) for name, columns in INDEXES.items()
+        if not any(index[:len(columns)] == columns for index in existing)
+    )
+
+
+def make_index_sql(name, columns):
+    # the index is built while the table can still be read and written
+    return 'ALTER TABLE stac_item ADD INDEX {} ({}), ALGORITHM=INPLACE, LOCK=NONE'.format(
+        quote_identifier(name), ', '.join(quote_identifier(column) for column in columns)
+    )
+
+
+def advise():
+    """
+    Print the SQL of the missing indexes.
+    """
+
+    with get_engine().connect() as connection:
+        missing = get_missing_indexes(connection)
+
+    if not missing:
+        print('-- all indexes exist')
+
+    for name, columns in missing.items():
+        print(make_index_sql(name, columns) + ';')
+
+
+def migrate():
+    """
+    Create the missing indexes. The indexes that have already been created are skipped,
+    then it can be executed again after a failure.
+    """
+
+    with get_engine().connect() as connection:
+        for name, columns in get_missing_indexes(connection).items():
+            sql = make_index_sql(name, columns)
+
+            logger.info('migrate() - %s', sql)
+            connection.execute(sql)
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Create the composite indexes of the ordered item searches.')
+    parser.add_argument(
+        'command', choices=['advise', 'migrate'],
+        help='`advise` prints the SQL of the missing indexes, `migrate` creates them'
+    )
+
+    args = parser.parse_args()
+
+    if args.command == 'advise':
+        advise()
+    else:
+        migrate()
@@ -1,7 +1,182 @@
+"""
+Logging of the application.
+
+The records are put into a queue by the request threads and written by a background thread (i.e. `QueueListener`),
+then the I/O does not add latency to the requests. The messages are formatted by the background thread too,
+then they must use the lazy %-style arguments (e.g. `logger.debug('sql: %s', sql)`), instead of `str.format`.
+
+Each module has its own logger (e.g. `inpe_stac.data`), whose level can be set by `INPE_STAC_LOG_LEVELS`.
+The high-volume messages are logged with `extra=SAMPLED`, then just one by `INPE_STAC_LOG_SAMPLE_EVERY` is written.
+Each request is written as a JSON line to the `inpe_stac.access` logger (see `log_access`).
+"""
 
 import logging
 
-from inpe_stac.environment import LOGGING_LEVEL
+from atexit import register as register_at_exit
+from datetime import datetime, timezone
+from itertools import count
+from json import dumps
+from logging.handlers import QueueHandler, QueueListener
+from os import register_at_fork
+from queue import SimpleQueue
+
+from inpe_stac.environment import LOGGING_LEVEL, INPE_STAC_LOG_LEVELS, INPE_STAC_LOG_SAMPLE_EVERY
+
+
+FORMAT = '[%(asctime)s] %(levelname)s in %(module)s: %(message)s'
+
+ACCESS_LOGGER = 'inpe_stac.access'
+
+# `extra` argument of the high-volume messages, that are sampled
+SAMPLED = {'sampled': True}
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Let pass one by `every` records of each sampled message (i.e. records with `extra=SAMPLED`).
+    """
+
+    def __init__(self, every):
+        super().__init__()
+        self.every = every
+        self.__counters = {}
+
+    def filter(self, record):
+        if self.every <= 1 or not getattr(record, 'sampled', False):
+            return True
+
+        counter = self.__counters.get(record.msg)
+
+        if counter is None:
+            counter = self.__counters.setdefault(record.msg, count())
+
+        # `next` of a `count` is atomic, then the counter does not need a lock
+        return next(counter) % self.every == 0
+
+
+class LazyQueueHandler(QueueHandler):
+    """
+    Put the records into the queue without formatting their messages, that are formatted by the listener.
+    """
+
+    def prepare(self, record):
+        # the traceback refers to the frames of the request thread, then it is formatted now
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+
+        return record
+
+
+class AccessFormatter(logging.Formatter):
+    """
+    Format the fields of an access record (i.e. `record.args`) as a JSON line.
+    """
+
+    def format(self, record):
+        fields = {'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat()}
+        fields.update(record.args)
+
+        return dumps(fields, separators=(',', ':'), default=str)
+
+
+class LoggerFilter(logging.Filter):
+    """
+    Let pass the records of the logger `name` or, if `exclude` is True, the records of the other loggers.
+    """
+
+    def __init__(self, name, exclude=False):
+        super().__init__()
+        self.logger_name = name
+        self.exclude = exclude
+
+    def filter(self, record):
+        return (record.name == self.logger_name) != self.exclude
+
+
+def parse_levels(levels):
+    """
+    Return the levels of the loggers of a string like `inpe_stac.data=DEBUG,inpe_stac.access=WARNING`.
+    """
+
+    result = {}
+
+    for level in levels.split(','):
+        if not level.strip():
+            continue
+
+        name, _, value = level.partition('=')
+        result[name.strip()] = value.strip().upper()
+
+    return result
+
+
+def make_listener(queue):
+    console_handler = logging.StreamHandler()
+    console_handler.setFormatter(logging.Formatter(FORMAT))
+    console_handler.addFilter(LoggerFilter(ACCESS_LOGGER, exclude=True))
+
+    access_handler = logging.StreamHandler()
+    access_handler.setFormatter(AccessFormatter())
+    access_handler.addFilter(LoggerFilter(ACCESS_LOGGER))
+
+    return QueueListener(queue, console_handler, access_handler)
+
+
+__queue_handler = LazyQueueHandler(SimpleQueue())
+__queue_handler.addFilter(SamplingFilter(INPE_STAC_LOG_SAMPLE_EVERY))
+
+__listener = make_listener(__queue_handler.queue)
+
+
+def configure_logging():
+    root = logging.getLogger()
+    root.setLevel(LOGGING_LEVEL)
+    root.addHandler(__queue_handler)
+
+    for name, level in parse_levels(INPE_STAC_LOG_LEVELS).items():
+        logging.getLogger(name).setLevel(level)
+
+    __listener.start()
+
+
+def stop_logging():
+    """
+    Write the records that are inside the queue and stop the background thread.
+    """
+
+    __listener.stop()
+
+
+def restart_logging():
+    """
+    Start a new background thread inside a forked child (e.g. a gunicorn worker), whose parent thread does not exist.
+    """
+
+    global __listener
+
+    __queue_handler.queue = SimpleQueue()
+    __listener = make_listener(__queue_handler.queue)
+    __listener.start()
+
+
+def get_logger(name):
+    return logging.getLogger(name)
+
+
+access_logger = get_logger(ACCESS_LOGGER)
+
+
+def log_access(fields):
+    """
+    Write a request as a JSON line, that is encoded by the background thread.
+    """
+
+    # the dict is the only argument, then it becomes `record.args` (see `AccessFormatter`)
+    access_logger.info('access', fields)
+
 
+configure_logging()
 
-logging.basicConfig(format='[%(asctime)s] %(levelname)s in %(module)s: %(message)s', level=LOGGING_LEVEL)
+register_at_exit(stop_logging)
+register_at_fork(after_in_child=restart_logging)
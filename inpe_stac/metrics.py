@@ -0,0 +1,302 @@
+"""
+Metrics of the application in the Prometheus text format (https://prometheus.io/docs/instrumenting/exposition_formats/),
+that are exposed by `/metrics`.
+
+Each process keeps its metrics in memory and, after sending a response, writes them to `INPE_STAC_METRICS_DIR`
+at most once by `INPE_STAC_METRICS_WRITE_INTERVAL` seconds. `/metrics` sums the files of all processes (e.g. the
+gunicorn workers), then it answers the same whichever process gets the request. The gauges of the processes that
+do not exist anymore are discarded, but their counters are kept, then the counters do not go backwards.
+"""
+
+from atexit import register as register_at_exit
+from math import inf
+from os import getpid, kill, makedirs, path, register_at_fork, remove, rename, scandir
+from pickle import dumps, loads, HIGHEST_PROTOCOL
+from threading import Lock
+from time import monotonic
+
+from inpe_stac.log import get_logger
+from inpe_stac.data import count_cache, totals_cache, item_cache, watermark_cache
+from inpe_stac.database import get_pool_status
+from inpe_stac.http_cache import response_cache
+from inpe_stac.environment import INPE_STAC_METRICS_DIR, INPE_STAC_METRICS_WRITE_INTERVAL
+
+
+logger = get_logger(__name__)
+
+
+# upper bounds (in seconds) of the buckets of the histograms
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, inf)
+
+# name: (type, help)
+METRICS = {
+    'inpe_stac_requests_total': ('counter', 'Number of requests by route, method and status.'),
+    'inpe_stac_request_duration_seconds': ('histogram', 'Time of the requests by route and method.'),
+    'inpe_stac_stage_duration_seconds': ('histogram', 'Time of the stages of the requests by route and stage.'),
+    'inpe_stac_rows_returned_total': ('counter', 'Number of features returned by route.'),
+    'inpe_stac_cache_hits_total': ('counter', 'Number of hits by cache.'),
+    'inpe_stac_cache_misses_total': ('counter', 'Number of misses by cache.'),
+    'inpe_stac_cache_hit_ratio': ('gauge', 'Ratio of hits to lookups by cache.'),
+    'inpe_stac_cache_entries': ('gauge', 'Number of entries by cache.'),
+    'inpe_stac_db_pool_connections': ('gauge', 'Number of connections of the database pools by pool and state.')
+}
+
+# caches whose hits and misses are exposed
+CACHES = {
+    'count': count_cache,
+    'totals': totals_cache,
+    'item': item_cache,
+    'watermark': watermark_cache,
+    'response': response_cache
+}
+
+
+class Metrics:
+    """
+    Counters and histograms of a process, identified by `(name, labels)`, where `labels` is a tuple of `(key, value)`.
+    """
+
+    def __init__(self):
+        self.counters = {}
+        # `(name, labels)`: the counts of the buckets, followed by the sum and the count of the values
+        self.histograms = {}
+
+        self.__lock = Lock()
+
+    def inc(self, name, labels, value=1):
+        key = (name, labels)
+
+        with self.__lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, labels, value):
+        key = (name, labels)
+
+        with self.__lock:
+            histogram = self.histograms.get(key)
+
+            if histogram is None:
+                histogram = self.histograms[key] = [0] * (len(BUCKETS) + 2)
+
+            for index, bound in enumerate(BUCKETS):
+                if value <= bound:
+                    histogram[index] += 1
+                    break
+
+            histogram[-2] += value
+            histogram[-1] += 1
+
+    def snapshot(self):
+        with self.__lock:
+            return dict(self.counters), {key: list(value) for key, value in self.histograms.items()}
+
+    def clear(self):
+        with self.__lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+
+metrics = Metrics()
+
+__last_write = 0
+
+
+def record_request(route, method, status, timings):
+    """
+    Add a request, whose stages are inside `timings` (i.e. a `RequestTimings`), to the metrics.
+    """
+
+    route = route or 'unknown'
+
+    metrics.inc('inpe_stac_requests_total', (('route', route), ('method', method), ('status', str(status))))
+    metrics.observe('inpe_stac_request_duration_seconds', (('route', route), ('method', method)), timings.get_elapsed())
+
+    for stage, seconds in list(timings.stages.items()):
+        metrics.observe('inpe_stac_stage_duration_seconds', (('route', route), ('stage', stage)), seconds)
+
+    if timings.rows:
+        metrics.inc('inpe_stac_rows_returned_total', (('route', route),), timings.rows)
+
+    if INPE_STAC_METRICS_DIR:
+        write_metrics()
+
+
+def make_snapshot():
+    """
+    Return the metrics of this process, with its caches and pools.
+    """
+
+    counters, histograms = metrics.snapshot()
+    gauges = {}
+
+    for name, cache in CACHES.items():
+        counters[('inpe_stac_cache_hits_total', (('cache', name),))] = cache.hits
+        counters[('inpe_stac_cache_misses_total', (('cache', name),))] = cache.misses
+        gauges[('inpe_stac_cache_entries', (('cache', name),))] = len(cache)
+
+    for (pool, state), connections in get_pool_status().items():
+        gauges[('inpe_stac_db_pool_connections', (('pool', pool), ('state', state)))] = connections
+
+    return {'counters': counters, 'histograms': histograms, 'gauges': gauges}
+
+
+def write_metrics(force=False):
+    """
+    Write the metrics of this process to its file, if they have not been written recently.
+    """
+
+    global __last_write
+
+    if not force and monotonic() - __last_write < INPE_STAC_METRICS_WRITE_INTERVAL:
+        return
+
+    __last_write = monotonic()
+
+    file_path = path.join(INPE_STAC_METRICS_DIR, '{}.metrics'.format(getpid()))
+
+    try:
+        makedirs(INPE_STAC_METRICS_DIR, exist_ok=True)
+
+        # the metrics are written aside and renamed, then they are never read partially
+        with open(file_path + '.tmp', 'wb') as metrics_file:
+            metrics_file.write(dumps(make_snapshot(), protocol=HIGHEST_PROTOCOL))
+
+        rename(file_path + '.tmp', file_path)
+    except OSError:
+        logger.exception('write_metrics() - the metrics could not be written: %s', file_path)
+
+
+def is_alive(pid):
+    try:
+        kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+
+    return True
+
+
+def read_snapshots():
+    """
+    Return the metrics of the other processes, without the gauges of the processes that do not exist anymore.
+    """
+
+    snapshots = []
+
+    if not INPE_STAC_METRICS_DIR or not path.isdir(INPE_STAC_METRICS_DIR):
+        return snapshots
+
+    for entry in scandir(INPE_STAC_METRICS_DIR):
+        name, extension = path.splitext(entry.name)
+
+        if extension != '.metrics' or not name.isdigit() or int(name) == getpid():
+            continue
+
+        try:
+            with open(entry.path, 'rb') as metrics_file:
+                snapshot = loads(metrics_file.read())
+        except (OSError, EOFError):
+            continue
+
+        if not is_alive(int(name)):
+            snapshot['gauges'] = {}
+
+        snapshots.append(snapshot)
+
+    return snapshots
+
+
+def merge_snapshots(snapshots):
+    merged = {'counters': {}, 'histograms': {}, 'gauges': {}}
+
+    for snapshot in snapshots:
+        for kind in ('counters', 'gauges'):
+            for key, value in snapshot[kind].items():
+                merged[kind][key] = merged[kind].get(key, 0) + value
+
+        for key, value in snapshot['histograms'].items():
+            histogram = merged['histograms'].get(key)
+
+            if histogram is None:
+                merged['histograms'][key] = list(value)
+            else:
+                merged['histograms'][key] = [a + b for a, b in zip(histogram, value)]
+
+    # the hit ratio is computed from the hits and misses of all processes
+    for (name, labels), hits in list(merged['counters'].items()):
+        if name == 'inpe_stac_cache_hits_total':
+            lookups = hits + merged['counters'].get(('inpe_stac_cache_misses_total', labels), 0)
+            merged['gauges'][('inpe_stac_cache_hit_ratio', labels)] = hits / lookups if lookups else 0
+
+    return merged
+
+
+def format_labels(labels):
+    return '{' + ','.join('{}="{}"'.format(key, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                          for key, value in labels) + '}' if labels else ''
+
+
+def format_bound(bound):
+    return '+Inf' if bound == inf else repr(float(bound))
+
+
+def render_metrics():
+    """
+    Return the metrics of all processes in the Prometheus text format.
+    """
+
+    merged = merge_snapshots([make_snapshot()] + read_snapshots())
+
+    samples = {name: [] for name in METRICS}
+
+    for kind in ('counters', 'gauges'):
+        for (name, labels), value in sorted(merged[kind].items()):
+            samples[name].append('{}{} {}'.format(name, format_labels(labels), value))
+
+    for (name, labels), histogram in sorted(merged['histograms'].items()):
+        cumulative = 0
+
+        for bound, count in zip(BUCKETS, histogram):
+            cumulative += count
+            samples[name].append('{}_bucket{} {}'.format(
+                name, format_labels(labels + (('le', format_bound(bound)),)), cumulative
+            ))
+
+        samples[name].append('{}_sum{} {}'.format(name, format_labels(labels), histogram[-2]))
+        samples[name].append('{}_count{} {}'.format(name, format_labels(labels), histogram[-1]))
+
+    lines = []
+
+    for name, (kind, description) in METRICS.items():
+        lines.append('# HELP {} {}'.format(name, description))
+        lines.append('# TYPE {} {}'.format(name, kind))
+        lines += samples[name]
+
+    return '\n'.join(lines) + '\n'
+
+
+def clear_metrics_files():
+    """
+    Remove the metrics written by a previous execution of the server, e.g. before starting the workers.
+    """
+
+    if not INPE_STAC_METRICS_DIR or not path.isdir(INPE_STAC_METRICS_DIR):
+        return
+
+    for entry in scandir(INPE_STAC_METRICS_DIR):
+        if entry.name.endswith('.metrics') or entry.name.endswith('.tmp'):
+            try:
+                remove(entry.path)
+            except FileNotFoundError:
+                pass
+
+
+def write_metrics_at_exit():
+    if INPE_STAC_METRICS_DIR and metrics.counters:
+        write_metrics(force=True)
+
+
+register_at_exit(write_metrics_at_exit)
+# a forked child (e.g. a gunicorn worker) does not inherit the requests of its parent
+register_at_fork(after_in_child=metrics.clear)
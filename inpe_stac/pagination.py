@@ -0,0 +1,199 @@
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from binascii import Error as BinasciiError
+from datetime import date
+from decimal import Decimal
+from json import dumps, loads
+
+from werkzeug.exceptions import BadRequest
+
+from inpe_stac.query import quote_identifier
+
+
+# fields that can sort the items and their columns of `stac_item`
+SORTABLE_COLUMNS = {
+    'id': 'id',
+    'datetime': 'datetime',
+    'properties.datetime': 'datetime',
+    'cloud_cover': 'cloud_cover',
+    'properties.cloud_cover': 'cloud_cover',
+    'eo:cloud_cover': 'cloud_cover',
+    'properties.eo:cloud_cover': 'cloud_cover',
+    'path': 'path',
+    'properties.path': 'path',
+    'row': 'row',
+    'properties.row': 'row'
+}
+
+# default order of the items of each collection, that is deterministic because `id` is unique
+DEFAULT_SORT_KEYS = (('datetime', False), ('id', False))
+# default order of the items of all collections together
+GLOBAL_SORT_KEYS = (('collection', False),) + DEFAULT_SORT_KEYS
+
+
+def parse_sortby(sortby):
+    """
+    Return the sort keys (i.e. a tuple of `(column, descending)`) of the `sortby` parameter of the
+    sort extension, that is a list of `{"field": ..., "direction": "asc" or "desc"}` or a string
+    of fields separated by commas, where each field can start by `+` (asc) or `-` (desc).
+    `id` is added at the end, if it is not there, in order to make the order deterministic.
+
+    Specification: https://github.com/radiantearth/stac-spec/blob/v0.7.0/api-spec/extensions/sort/README.md
+    """
+
+    if sortby is None:
+        return None
+
+    if isinstance(sortby, str):
+        sortby = [
+            {'field': field.lstrip('+-'), 'direction': 'desc' if field.startswith('-') else 'asc'}
+            for field in sortby.split(',') if field
+        ]
+
+    if not isinstance(sortby, list) or not sortby:
+        raise BadRequest('`sortby` parameter must be a non-empty list of fields')
+
+    keys = []
+
+    for sort in sortby:
+        if not isinstance(sort, dict) or sort.get('field') not in SORTABLE_COLUMNS:
+            raise BadRequest('`sortby` parameter can sort just by: {}'.format(', '.join(sorted(SORTABLE_COLUMNS))))
+
+        if sort.get('direction', 'asc') not in ('asc', 'desc'):
+            raise BadRequest('`sortby` direction must be `asc` or `desc`')
+
+        column = SORTABLE_COLUMNS[sort['field']]
+
+        if column not in [key[0] for key in keys]:
+            keys.append((column, sort.get('direction', 'asc') == 'desc'))
+
+    if 'id' not in [key[0] for key in keys]:
+        keys.append(('id', False))
+
+    return tuple(keys)
+
+
+def make_order_by(sort_keys):
+    return ', '.join(
+        '{} {}'.format(quote_identifier(column), 'DESC' if descending else 'ASC') for column, descending in sort_keys
+    )
+
+
+def make_keyset_where(values, sort_keys, params, index):
+    """
+    Create the predicate that selects the rows after the row whose values of the sort keys are `values`,
+    adding the values to `params`. NULL values come before the other ones in ascending order
+    and after them in descending order, like MySQL does.
+    """
+
+    predicate = None
+
+    # the predicate is built from the last key (i.e. the unique one) to the first one
+    for key, ((column, descending), value) in reversed(list(enumerate(zip(sort_keys, values)))):
+        param = 'k_{}_{}'.format(key, index)
+        column = quote_identifier(column)
+
+        if value is None:
+            equal = '{} IS NULL'.format(column)
+            after = None if descending else '{} IS NOT NULL'.format(column)
+        else:
+            params[param] = value
+            equal = '{} = :{}'.format(column, param)
+            after = '({0} < :{1} OR {0} IS NULL)'.format(column, param) if descending \
+                else '{} > :{}'.format(column, param)
+
+        if predicate is None:
+            predicate = after or '1 = 0'
+        elif after is None:
+            predicate = '({} AND {})'.format(equal, predicate)
+        else:
+            predicate = '({} OR ({} AND {}))'.format(after, equal, predicate)
+
+    return predicate
+
+
+def encode_token(positions):
+    """
+    Encode a list of positions (i.e. the collection and the values of the sort keys of a row)
+    as an opaque URL safe string.
+    """
+
+    data = dumps([list(p) for p in positions], separators=(',', ':')).encode()
+
+    return urlsafe_b64encode(data).decode().rstrip('=')
+
+
+def decode_token(token, size=None):
+    """
+    Decode the positions of a token, whose lengths must be `size`.
+    """
+
+    try:
+        # add the padding removed by `encode_token`
+        positions = loads(urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+
+        if not isinstance(positions, list) or not positions:
+            raise ValueError()
+
+        for position in positions:
+            if not isinstance(position, list) or not position or (size is not None and len(position) != size) \
+                    or not all(v is None or isinstance(v, (str, int, float)) for v in position):
+                raise ValueError()
+
+    except (BinasciiError, ValueError, TypeError):
+        raise BadRequest('`token` parameter is not valid')
+
+    return [tuple(p) for p in positions]
+
+
+def get_position_value(value):
+    # the values of the positions are encoded as JSON
+    if isinstance(value, date):
+        return str(value)
+    if isinstance(value, Decimal):
+        return float(value)
+
+    return value
+
+
+class KeysetTracker:
+    """
+    Keep the position of the last row of each collection while the rows are read,
+    in order to create the token of the next page.
+
+    If `per_collection` is True, then each collection is paginated by its own (i.e. `limit` items
+    by collection) and a position is the collection and the values of `columns` (i.e. the sort keys)
+    of a row, else the rows of all collections are paginated together and a position is just the values.
+    """
+
+    def __init__(self, limit, per_collection, columns=('datetime', 'id'), max_rows=None):
+        self.limit = limit
+        self.per_collection = per_collection
+        self.columns = columns
+        # number of rows of each collection (or of the whole search, by the key None), if it is known
+        self.max_rows = max_rows or {}
+        self.positions = {}
+        self.returned = {}
+
+    def track(self, rows):
+        for row in rows:
+            key = row['collection'] if self.per_collection else None
+
+            position = tuple(get_position_value(row[column]) for column in self.columns)
+
+            self.positions[key] = (row['collection'],) + position if self.per_collection else position
+            self.returned[key] = self.returned.get(key, 0) + 1
+
+            yield row
+
+    def next_token(self):
+        # a collection (or the whole search) that returned less than `limit` rows, or all of its rows,
+        # has been exhausted
+        positions = [
+            position for key, position in self.positions.items()
+            if self.limit <= self.returned[key] < self.max_rows.get(key, float('inf'))
+        ]
+
+        if not positions:
+            return None
+
+        return encode_token(sorted(positions, key=lambda position: position[0]))
@@ -0,0 +1,246 @@
+"""
+Compiler of the STAC query extension and execution of the queries through prepared statements.
+
+Specification: https://github.com/radiantearth/stac-spec/blob/v0.7.0/api-spec/extensions/query/README.md
+
+A filter (e.g. `{"cloud_cover": {"lt": 50}}`) is compiled to SQL with bound parameters only.
+The SQL depends just on the shape of the filter (i.e. its properties and operators), then it is compiled
+once by shape and the same statement is reused for any values.
+"""
+
+from collections import OrderedDict
+from functools import lru_cache
+from hashlib import sha1
+from re import compile as compile_regex
+
+from werkzeug.exceptions import BadRequest
+
+from inpe_stac.log import get_logger
+
+
+logger = get_logger(__name__)
+
+
+# properties that can be filtered and their columns of `stac_item`, the other ones are refused.
+# The columns are quoted when they are compiled (see `compile_query_shape`), since `row` is a keyword
+QUERYABLE_COLUMNS = {
+    'id': 'id',
+    'collection': 'collection',
+    'datetime': 'datetime',
+    'path': 'path',
+    'row': 'row',
+    'satellite': 'satellite',
+    'sensor': 'sensor',
+    'cloud_cover': 'cloud_cover',
+    'eo:cloud_cover': 'cloud_cover',
+    'sync_loss': 'sync_loss'
+}
+
+# operator: (SQL template, LIKE pattern of the value)
+OPERATORS = OrderedDict([
+    ('eq', ('{column} = :{param}', None)),
+    ('neq', ('{column} != :{param}', None)),
+    ('lt', ('{column} < :{param}', None)),
+    ('lte', ('{column} <= :{param}', None)),
+    ('gt', ('{column} > :{param}', None)),
+    ('gte', ('{column} >= :{param}', None)),
+    ('in', ('{column} IN :{param}', None)),
+    ('startsWith', ("{column} LIKE :{param} ESCAPE '!'", '{}%')),
+    ('endsWith', ("{column} LIKE :{param} ESCAPE '!'", '%{}')),
+    ('contains', ("{column} LIKE :{param} ESCAPE '!'", '%{}%'))
+])
+
+
+def quote_identifier(name):
+    """
+    Return the quoted name of a column or of an index, since some columns are keywords (e.g. `row` on MySQL 8).
+    The backticks are accepted by SQLite too.
+    """
+
+    return '`{}`'.format(name.replace('`', '``'))
+
+
+# named parameters of a SQL text (e.g. `:limit`), but not casts (e.g. `::text`)
+PARAMETER_REGEX = compile_regex(r'(?<![:\w]):(\w+)')
+
+
+def get_query_shape(query):
+    """
+    Return the properties and operators of a filter, sorted, and validate them.
+    """
+
+    if not isinstance(query, dict):
+        raise BadRequest('`query` field must be an object')
+
+    shape = []
+
+    for field, operations in sorted(query.items()):
+        if field not in QUERYABLE_COLUMNS:
+            raise BadRequest('`query` field can not filter `{}`, the queryable fields are: {}'.format(
+                field, ', '.join(sorted(QUERYABLE_COLUMNS))
+            ))
+
+        if not isinstance(operations, dict) or not operations:
+            raise BadRequest('`query` field `{}` must be an object with at least one operator'.format(field))
+
+        for operator in operations:
+            if operator not in OPERATORS:
+                raise BadRequest('`query` field `{}` has an invalid operator `{}`, the operators are: {}'.format(
+                    field, operator, ', '.join(OPERATORS)
+                ))
+
+        shape.append((field, tuple(operator for operator in OPERATORS if operator in operations)))
+
+    return tuple(shape)
+
+
+@lru_cache(maxsize=1024)
+def compile_query_shape(shape):
+    """
+    Return the SQL predicates of a shape, as a list of `(predicate, param, field, operator)`.
+    """
+
+    compiled = []
+
+    for field, operators in shape:
+        for operator in operators:
+            param = 'q_{}'.format(len(compiled))
+            template, _ = OPERATORS[operator]
+
+            column = quote_identifier(QUERYABLE_COLUMNS[field])
+
+            compiled.append((template.format(column=column, param=param), param, field, operator))
+
+    return tuple(compiled)
+
+
+def escape_like(value):
+    return value.replace('!', '!!').replace('%', '!%').replace('_', '!_')
+
+
+def compile_query(query, params):
+    """
+    Return the SQL predicates of a filter, adding their values to `params`.
+    """
+
+    where = []
+
+    for predicate, param, field, operator in compile_query_shape(get_query_shape(query)):
+        value = query[field][operator]
+        _, pattern = OPERATORS[operator]
+
+        if operator == 'in':
+            if not isinstance(value, list) or not value:
+                raise BadRequest('`query` operator `in` of `{}` must be a non-empty list'.format(field))
+            if not all(isinstance(v, (str, int, float)) for v in value):
+                raise BadRequest('`query` operator `in` of `{}` must be a list of strings or numbers'.format(field))
+        elif pattern is not None:
+            if not isinstance(value, str):
+                raise BadRequest('`query` operator `{}` of `{}` must be a string'.format(operator, field))
+
+            value = pattern.format(escape_like(value))
+        elif not isinstance(value, (str, int, float)) or isinstance(value, bool):
+            raise BadRequest('`query` operator `{}` of `{}` must be a string or a number'.format(operator, field))
+
+        where.append(predicate)
+        params[param] = value
+
+    return where
+
+
+@lru_cache(maxsize=1024)
+def get_positional_sql(sql, list_lengths, placeholder='?'):
+    """
+    Replace the named parameters by `placeholder`, where a list parameter is replaced by one placeholder by value.
+    `list_lengths` is a tuple of `(name, length)` of the list parameters. Return the SQL and the names of its parameters.
+    """
+
+    lengths = dict(list_lengths)
+    names = []
+
+    def replace(match):
+        name = match.group(1)
+        names.append(name)
+
+        if name in lengths:
+            return '({})'.format(', '.join([placeholder] * lengths[name]))
+
+        return placeholder
+
+    # the `format` style of the DB-API (e.g. PyMySQL) needs the literal `%` to be escaped
+    if placeholder == '%s':
+        sql = sql.replace('%', '%%')
+
+    return PARAMETER_REGEX.sub(replace, sql), tuple(names)
+
+
+def make_positional_query(sql, params, placeholder='?'):
+    """
+    Return the positional SQL of `sql` (see `get_positional_sql`) and the list of its values.
+    """
+
+    list_lengths = tuple(sorted(
+        (name, len(value)) for name, value in params.items() if isinstance(value, (list, tuple))
+    ))
+
+    positional_sql, names = get_positional_sql(sql, list_lengths, placeholder)
+
+    values = []
+
+    for name in names:
+        value = params[name]
+        values += list(value) if isinstance(value, (list, tuple)) else [value]
+
+    return positional_sql, values
+
+
+class PreparedStatements:
+    """
+    Execute the queries through server-side prepared statements of MySQL (i.e. `PREPARE` and `EXECUTE`),
+    since the driver interpolates the values on the client. Each connection keeps up to `max_statements`
+    statements, the least recently used one is deallocated.
+    """
+
+    def __init__(self, max_statements=100):
+        self.max_statements = max_statements
+
+    def execute(self, connection, sql, params):
+        """
+        Execute `sql` on a SQLAlchemy connection and return the rows as dicts.
+        """
+
+        positional_sql, values = make_positional_query(sql, params)
+        statement = 'inpe_stac_' + sha1(positional_sql.encode()).hexdigest()[:16]
+
+        # the prepared statements belong to the DBAPI connection, then they are kept inside its `info`
+        prepared = connection.info.setdefault('prepared_statements', OrderedDict())
+
+        cursor = connection.connection.cursor()
+
+        try:
+            if statement in prepared:
+                prepared.move_to_end(statement)
+            else:
+                logger.debug('PreparedStatements.execute() - prepare: %s', statement)
+
+                cursor.execute('PREPARE {} FROM %s'.format(statement), (positional_sql,))
+                prepared[statement] = True
+
+                while len(prepared) > self.max_statements:
+                    old, _ = prepared.popitem(last=False)
+                    cursor.execute('DEALLOCATE PREPARE {}'.format(old))
+
+            if values:
+                variables = ['@inpe_stac_{}'.format(i) for i in range(len(values))]
+
+                cursor.execute('SET {}'.format(', '.join('{} = %s'.format(v) for v in variables)), values)
+                cursor.execute('EXECUTE {} USING {}'.format(statement, ', '.join(variables)))
+            else:
+                cursor.execute('EXECUTE {}'.format(statement))
+
+            columns = [column[0] for column in cursor.description or []]
+
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+        finally:
+            cursor.close()
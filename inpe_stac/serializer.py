@@ -0,0 +1,158 @@
+"""
+Serialization of the `stac_item` rows as GeoJSON features.
+
+Everything that does not depend on the row (e.g. the URL roots and the links) is resolved
+once by `FeatureSerializer`, then each feature is just a few dicts built from the row.
+The features are encoded to bytes by orjson when it is installed, else by the json module.
+"""
+
+from datetime import datetime
+from decimal import Decimal
+from json import dumps as json_dumps, loads as json_loads
+from os import getenv
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def __default(value):
+    if isinstance(value, Decimal):
+        return float(value)
+
+    raise TypeError('Object of type {} is not JSON serializable'.format(type(value).__name__))
+
+
+if orjson is not None:
+    def dumps(value):
+        return orjson.dumps(value, default=__default)
+
+    loads = orjson.loads
+else:
+    def dumps(value):
+        return json_dumps(value, separators=(',', ':'), default=__default).encode()
+
+    loads = json_loads
+
+
+class FeatureSerializer:
+    """
+    Create the features of the rows, where `links` is the list of links of the views:
+    the `href` of the first link is completed with `<collection>/items/<id>`, the next two ones
+    with `<collection>` and the other ones are the same for all features.
+
+    If `fields` (i.e. a `FieldSelection`) is given, then the features have just the selected members,
+    which are created just from their columns.
+    """
+
+    def __init__(self, links, tif_root=None, png_root=None, fields=None):
+        self.tif_root = getenv('TIF_ROOT') if tif_root is None else tif_root
+        self.png_root = getenv('PNG_ROOT') if png_root is None else png_root
+
+        self.item_link, self.parent_link, self.collection_link = links[:3]
+        self.static_links = links[3:]
+
+        self.fields = fields
+
+        if fields is not None:
+            self.make_feature = self.make_selected_feature
+
+    def make_feature(self, row):
+        collection = row['collection']
+
+        tl = [row['tl_longitude'], row['tl_latitude']]
+        bl = [row['bl_longitude'], row['bl_latitude']]
+        br = [row['br_longitude'], row['br_latitude']]
+        tr = [row['tr_longitude'], row['tr_latitude']]
+
+        longitudes = (tl[0], bl[0], br[0], tr[0])
+        latitudes = (tl[1], bl[1], br[1], tr[1])
+
+        return {
+            'type': 'Feature',
+            'id': row['id'],
+            'collection': collection,
+            'geometry': {
+                'type': 'Polygon',
+                'coordinates': [[tl, bl, br, tr, tl]]
+            },
+            'bbox': [min(longitudes), min(latitudes), max(longitudes), max(latitudes)],
+            'properties': {
+                'datetime': self.make_datetime(row),
+                'path': row['path'],
+                'row': row['row'],
+                'satellite': row['satellite'],
+                'sensor': row['sensor'],
+                'cloud_cover': row['cloud_cover'],
+                'sync_loss': row['sync_loss']
+            },
+            'assets': self.make_assets(row),
+            'links': self.make_links(row)
+        }
+
+    def make_selected_feature(self, row):
+        feature = {}
+
+        for field in self.fields.fields:
+            if field == 'type':
+                feature[field] = 'Feature'
+            elif field in ('id', 'collection'):
+                feature[field] = row[field]
+            elif field == 'geometry':
+                tl = [row['tl_longitude'], row['tl_latitude']]
+                feature[field] = {
+                    'type': 'Polygon',
+                    'coordinates': [[
+                        tl, [row['bl_longitude'], row['bl_latitude']], [row['br_longitude'], row['br_latitude']],
+                        [row['tr_longitude'], row['tr_latitude']], tl
+                    ]]
+                }
+            elif field == 'bbox':
+                longitudes = (row['tl_longitude'], row['bl_longitude'], row['br_longitude'], row['tr_longitude'])
+                latitudes = (row['tl_latitude'], row['bl_latitude'], row['br_latitude'], row['tr_latitude'])
+
+                feature[field] = [min(longitudes), min(latitudes), max(longitudes), max(latitudes)]
+            elif field == 'properties':
+                feature[field] = {
+                    p: self.make_datetime(row) if p == 'datetime' else row[p] for p in self.fields.properties
+                }
+            elif field == 'assets':
+                feature[field] = self.make_assets(row)
+            elif field == 'links':
+                feature[field] = self.make_links(row)
+
+        return feature
+
+    @staticmethod
+    def make_datetime(row):
+        date = row['datetime']
+
+        if not isinstance(date, datetime):
+            date = datetime.fromisoformat(str(date))
+
+        return date.isoformat()
+
+    def make_assets(self, row):
+        tif_root = self.tif_root
+        assets = {}
+
+        for asset in loads(row['assets']):
+            href = asset['href']
+
+            assets[asset['band']] = {'href': tif_root + href, 'type': 'image/vnd.stac.geotiff'}
+            assets[asset['band'] + '_xml'] = {'href': tif_root + href.replace('.tif', '.xml'), 'type': 'text/xml'}
+
+        assets['thumbnail'] = {'href': self.png_root + row['thumbnail'], 'type': 'image/png'}
+
+        return assets
+
+    def make_links(self, row):
+        collection = row['collection']
+
+        return [
+            dict(self.item_link, href=self.item_link['href'] + collection + '/items/' + row['id']),
+            dict(self.parent_link, href=self.parent_link['href'] + collection),
+            dict(self.collection_link, href=self.collection_link['href'] + collection),
+            *self.static_links
+        ]
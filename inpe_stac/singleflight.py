@@ -0,0 +1,216 @@
+"""
+Coalescing of identical concurrent calls (i.e. single-flight): while a call with some key is running,
+the calls with the same key wait for it and get its result (or its exception), instead of running again.
+"""
+
+from fcntl import flock, LOCK_EX, LOCK_NB, LOCK_UN
+from os import makedirs, path, remove, rename, scandir, stat
+from pickle import dumps, loads, HIGHEST_PROTOCOL
+from threading import Event, Lock
+from time import time
+
+from inpe_stac.log import get_logger
+from inpe_stac.concurrency import sleep, wait_event
+
+
+logger = get_logger(__name__)
+
+
+# the old files are removed once by this number of calls
+CLEAN_INTERVAL = 1000
+
+
+class Flight:
+    def __init__(self):
+        self.done = Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Coalesce the calls of the threads of a process.
+
+    If `directory` is given, then the calls are also coalesced between processes (e.g. gunicorn workers)
+    through lock files inside it: the process that gets the lock of a key runs the call and, if another
+    process has been waiting for the lock, writes its result to a file, that is read by the waiting processes.
+    A call that fails does not write a result, then a process that was waiting runs it again. A result larger
+    than `max_result_bytes` is not written, then each waiting process runs the call by its own. A process waits
+    for the lock up to `timeout` seconds, then it runs the call by its own.
+    """
+
+    def __init__(self, directory=None, timeout=30, max_result_bytes=None):
+        self.directory = directory
+        self.timeout = timeout
+        self.max_result_bytes = max_result_bytes
+
+        self.__flights = {}
+        self.__lock = Lock()
+        self.__calls = 0
+
+        if directory is not None:
+            makedirs(directory, exist_ok=True)
+
+    def do(self, key, function):
+        """
+        Return the result of `function()`, that is shared by the concurrent calls with the same `key`.
+        `key` must be a string that can be used as a file name (e.g. a hash).
+        """
+
+        with self.__lock:
+            flight = self.__flights.get(key)
+
+            if flight is None:
+                flight = self.__flights[key] = Flight()
+                leader = True
+            else:
+                flight.waiters += 1
+                leader = False
+
+        if not leader:
+            # the leader may be another greenlet of the ASGI application, then the event loop must not block
+            wait_event(flight.done)
+
+            if flight.error is not None:
+                raise flight.error
+
+            return flight.result
+
+        try:
+            if self.directory is None:
+                flight.result = function()
+            else:
+                flight.result = self.__do_between_processes(key, function)
+
+            return flight.result
+
+        except BaseException as error:
+            flight.error = error
+            raise
+
+        finally:
+            with self.__lock:
+                del self.__flights[key]
+
+            if flight.waiters:
+                logger.debug('SingleFlight.do() - %s calls have been coalesced: %s', flight.waiters, key)
+
+            flight.done.set()
+
+    def clean(self):
+        """
+        Remove the files of the calls that have finished a long time ago.
+        """
+
+        min_mtime = time() - 2 * self.timeout
+
+        for entry in scandir(self.directory):
+            try:
+                if entry.stat().st_mtime < min_mtime:
+                    remove(entry.path)
+            except FileNotFoundError:
+                pass
+
+    def __do_between_processes(self, key, function):
+        file_path = path.join(self.directory, key)
+        start_time = time()
+
+        self.__calls += 1
+
+        if self.__calls % CLEAN_INTERVAL == 0:
+            self.clean()
+
+        with open(file_path + '.lock', 'a') as lock_file:
+            acquired = self.__acquire(lock_file, file_path, start_time)
+
+            # the lock has not been acquired in time, then the call is not shared
+            if acquired is None:
+                return function()
+
+            waited = not acquired
+
+            try:
+                if waited:
+                    result = self.__read_result(file_path, start_time)
+
+                    if result is not None:
+                        shared, value = result
+
+                        if shared:
+                            return value
+
+                        # the result is too large to be shared, then the waiting processes do not run it in turn
+                        flock(lock_file, LOCK_UN)
+
+                        return function()
+
+                result = function()
+
+                # the result is written just for the processes that are waiting for it
+                if self.__pop_waiting(file_path):
+                    self.__write_result(file_path, result)
+
+                return result
+
+            finally:
+                flock(lock_file, LOCK_UN)
+
+    def __acquire(self, lock_file, file_path, start_time):
+        """
+        Return True if the lock has been acquired at once, False if it has been acquired after
+        another process has released it or None if it has not been acquired before the timeout.
+        """
+
+        try:
+            flock(lock_file, LOCK_EX | LOCK_NB)
+            return True
+        except BlockingIOError:
+            pass
+
+        # the process that holds the lock writes its result for the waiting ones
+        open(file_path + '.waiting', 'a').close()
+
+        while time() - start_time < self.timeout:
+            sleep(0.01)
+
+            try:
+                flock(lock_file, LOCK_EX | LOCK_NB)
+                return False
+            except BlockingIOError:
+                pass
+
+        return None
+
+    def __read_result(self, file_path, start_time):
+        # just a result written while this process was waiting is valid,
+        # but the time of the files is less precise than the clock
+        try:
+            if stat(file_path).st_mtime < start_time - 1:
+                return None
+
+            with open(file_path, 'rb') as result_file:
+                return loads(result_file.read())
+
+        except FileNotFoundError:
+            return None
+
+    def __pop_waiting(self, file_path):
+        try:
+            remove(file_path + '.waiting')
+            return True
+        except FileNotFoundError:
+            return False
+
+    def __write_result(self, file_path, result):
+        data = dumps((True, result), protocol=HIGHEST_PROTOCOL)
+
+        if self.max_result_bytes is not None and len(data) > self.max_result_bytes:
+            logger.debug('SingleFlight.__write_result() - the result is too large to be shared: %s bytes', len(data))
+            data = dumps((False, None), protocol=HIGHEST_PROTOCOL)
+
+        # the result is written aside and renamed, then it is never read partially
+        with open(file_path + '.tmp', 'wb') as result_file:
+            result_file.write(data)
+
+        rename(file_path + '.tmp', file_path)
@@ -0,0 +1,861 @@
+#!/usr/bin/env python3
+
+"""
+In-process columnar snapshot of the searchable attributes of `stac_item`, that answers the item searches
+instead of MySQL if `INPE_STAC_SEARCH_BACKEND` is `snapshot`.
+
+The attributes of the scenes of each collection (i.e. the corners, `date`, `datetime`, `cloud_cover`, `sync_loss`,
+`path`, `row`, `satellite`, `sensor` and `deleted`) are kept as NumPy arrays, sorted by `datetime, id`. The filters
+of a search are evaluated as vectorised masks, which give `matched` and the ids of the page, then just the rows
+of the page are read from the database by primary key.
+
+The snapshot is loaded in background by the first search and refreshed each `INPE_STAC_SNAPSHOT_REFRESH_INTERVAL`
+seconds: just the collections whose state has changed are read again, from the rows updated
+(`INPE_STAC_UPDATED_COLUMN`) or inserted (`datetime`) since the last refresh. The searches that the snapshot
+can not answer like MySQL (e.g. a `query` that compares a number to a string) are answered by SQL.
+
+The strings are compared in upper case, like the case-insensitive collations of MySQL.
+
+The results of the snapshot are compared to the ones of SQL by:
+
+    python -m inpe_stac.snapshot check
+    python -m inpe_stac.snapshot check --searches searches.json
+"""
+
+from argparse import ArgumentParser
+from datetime import date, datetime
+from functools import reduce
+from json import load as load_json
+from sys import exit
+from threading import Lock, Thread
+from time import monotonic, perf_counter
+
+import numpy as np
+from werkzeug.exceptions import BadRequest
+
+from inpe_stac.log import get_logger
+from inpe_stac.geometry import get_bbox, intersects_footprints
+from inpe_stac.pagination import DEFAULT_SORT_KEYS
+from inpe_stac.query import QUERYABLE_COLUMNS, get_query_shape
+
+
+logger = get_logger(__name__)
+
+
+CORNER_COLUMNS = (
+    'tl_longitude', 'tl_latitude', 'bl_longitude', 'bl_latitude',
+    'br_longitude', 'br_latitude', 'tr_longitude', 'tr_latitude'
+)
+NUMBER_COLUMNS = ('cloud_cover', 'sync_loss', 'path', 'row')
+# columns with few distinct values, that are kept as codes of a vocabulary
+CATEGORY_COLUMNS = ('satellite', 'sensor')
+DATETIME_COLUMNS = ('datetime', 'date')
+
+# columns of `stac_item` that are read into the snapshot
+SNAPSHOT_COLUMNS = ('id', 'collection', 'deleted') + DATETIME_COLUMNS + NUMBER_COLUMNS + CATEGORY_COLUMNS + \
+                   CORNER_COLUMNS
+
+# number of scenes whose footprints are compared to the `intersects` geometry at once
+INTERSECTS_BATCH_SIZE = 10000
+
+
+class UnsupportedSearch(Exception):
+    """
+    The search can not be answered by the snapshot like MySQL, then it must be answered by SQL.
+    """
+
+
+def fold(value):
+    # the case-insensitive collations of MySQL compare the strings in upper case
+    return value.upper()
+
+
+def parse_datetime(value):
+    """
+    Return the `datetime64[us]` of a date, a datetime or a string, as MySQL compares them to a DATETIME column.
+    """
+
+    if isinstance(value, (date, datetime)):
+        return np.datetime64(value, 'us')
+
+    if not isinstance(value, str):
+        raise UnsupportedSearch('not a date: {!r}'.format(value))
+
+    value = value.strip()
+
+    if not value:
+        raise UnsupportedSearch('empty date')
+
+    # MySQL ignores the UTC designator
+    if value.endswith('Z'):
+        value = value[:-1]
+
+    try:
+        return np.datetime64(value, 'us')
+    except ValueError:
+        raise UnsupportedSearch('not a date: {!r}'.format(value))
+
+
+def parse_number(value):
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise UnsupportedSearch('not a number: {!r}'.format(value))
+
+    return float(value)
+
+
+def parse_string(value):
+    if not isinstance(value, str):
+        raise UnsupportedSearch('not a string: {!r}'.format(value))
+
+    return fold(value)
+
+
+class Vocabulary:
+    """
+    Codes of the distinct values of a column, that are shared by all collections. NULL is `-1`.
+    """
+
+    def __init__(self):
+        self.values = []
+        self.codes = {}
+
+    def encode(self, values):
+        codes = np.empty(len(values), dtype=np.int32)
+
+        for index, value in enumerate(values):
+            if value is None:
+                codes[index] = -1
+                continue
+
+            value = fold(str(value))
+            code = self.codes.get(value)
+
+            if code is None:
+                code = self.codes[value] = len(self.values)
+                self.values.append(value)
+
+            codes[index] = code
+
+        return codes
+
+    def match(self, predicate):
+        """
+        Return the codes of the values that satisfy `predicate`.
+        """
+
+        return np.array([code for code, value in enumerate(list(self.values)) if predicate(value)], dtype=np.int32)
+
+
+class CollectionColumns:
+    """
+    Arrays of the attributes of the scenes of a collection, sorted by `datetime, id`.
+    """
+
+    def __init__(self, name, arrays, vocabularies):
+        self.name = name
+        self.key = fold(name)
+        # the vocabularies of `CATEGORY_COLUMNS`, that are shared by all collections
+        self.vocabularies = vocabularies
+
+        # rank of each scene by `id`, that replaces the strings when the scenes are sorted or compared by `id`
+        id_order = np.argsort(arrays['id_key'], kind='stable')
+        id_rank = np.empty(len(id_order), dtype=np.int64)
+        id_rank[id_order] = np.arange(len(id_order))
+
+        # NULL (i.e. NaT) is the lowest value, as in MySQL
+        order = np.lexsort((id_rank, arrays['datetime'].view(np.int64)))
+
+        self.arrays = {column: array[order] for column, array in arrays.items()}
+        self.id_rank = id_rank[order]
+        self.sorted_id_keys = arrays['id_key'][id_order]
+        self.size = len(order)
+
+    @classmethod
+    def from_rows(cls, name, rows, vocabularies):
+        return cls(name, make_arrays(rows, vocabularies), vocabularies)
+
+    def merge(self, rows, vocabularies):
+        """
+        Return the columns with the rows that have been inserted or updated (i.e. the old version of a row is replaced).
+        """
+
+        new_arrays = make_arrays(rows, vocabularies)
+
+        keep = ~np.isin(self.arrays['id'], new_arrays['id'])
+
+        return CollectionColumns(self.name, {
+            column: np.concatenate([array[keep], new_arrays[column]]) for column, array in self.arrays.items()
+        }, vocabularies)
+
+    def get_null(self, column, indices):
+        if column in DATETIME_COLUMNS:
+            return np.isnat(self.arrays[column][indices])
+        if column in NUMBER_COLUMNS:
+            return np.isnan(self.arrays[column][indices])
+
+        return np.zeros(len(self.id_rank[indices]), dtype=bool)
+
+    def get_sort_values(self, column, indices):
+        """
+        Return numbers in the order of the values of `column` (the NULL values are replaced by 0) and the NULL mask.
+        """
+
+        if column == 'id':
+            return self.id_rank[indices], np.zeros(len(indices), dtype=bool)
+
+        null = self.get_null(column, indices)
+
+        if column in DATETIME_COLUMNS:
+            values = self.arrays[column][indices].view(np.int64)
+        else:
+            values = self.arrays[column][indices]
+
+        return np.where(null, 0, values), null
+
+    def compare(self, column, indices, value):
+        """
+        Return the masks of the scenes whose `column` is equal to, greater than and less than the not NULL `value`.
+        """
+
+        if column == 'collection':
+            value = fold(str(value))
+            return self.key == value, self.key > value, self.key < value
+
+        if column == 'id':
+            value = fold(str(value))
+            left = np.searchsorted(self.sorted_id_keys, value, side='left')
+            right = np.searchsorted(self.sorted_id_keys, value, side='right')
+            rank = self.id_rank[indices]
+
+            return (rank >= left) & (rank < right), rank >= right, rank < left
+
+        values = self.arrays[column][indices]
+
+        value = parse_datetime(value) if column in DATETIME_COLUMNS else float(value)
+
+        # NULL is not equal, greater or less than any value
+        return values == value, values > value, values < value
+
+    def get_sort_key(self, column, index):
+        """
+        Return the value of a scene for a Python sort, where NULL comes first.
+        """
+
+        if column == 'collection':
+            return 1, self.key
+        if column == 'id':
+            return 1, self.arrays['id_key'][index]
+
+        value = self.arrays[column][index]
+
+        if (column in DATETIME_COLUMNS and np.isnat(value)) or (column in NUMBER_COLUMNS and np.isnan(value)):
+            return 0, 0
+
+        return 1, value.view(np.int64) if column in DATETIME_COLUMNS else value
+
+
+def make_arrays(rows, vocabularies):
+    # the ids are fixed-width strings, that are compared and sorted without a Python object by scene
+    arrays = {
+        'id': np.array([row['id'] for row in rows], dtype=np.str_),
+        'id_key': np.array([fold(row['id']) for row in rows], dtype=np.str_),
+        'deleted': np.array([row['deleted'] or 0 for row in rows], dtype=np.int8)
+    }
+
+    for column in DATETIME_COLUMNS:
+        arrays[column] = np.array(
+            [np.datetime64(row[column], 'us') if row[column] is not None else np.datetime64('NaT') for row in rows],
+            dtype='datetime64[us]'
+        )
+
+    for column in NUMBER_COLUMNS + CORNER_COLUMNS:
+        arrays[column] = np.array([row[column] for row in rows], dtype=np.float64)
+
+    for column in CATEGORY_COLUMNS:
+        arrays[column] = vocabularies[column].encode([row[column] for row in rows])
+
+    return arrays
+
+
+def make_string_predicate(operator, value):
+    """
+    Return the function that compares a folded string to `value` by `operator`.
+    """
+
+    if operator == 'in':
+        if not isinstance(value, list):
+            raise UnsupportedSearch('`in` is not a list')
+
+        values = {parse_string(v) for v in value}
+        return lambda s: s in values
+
+    value = parse_string(value)
+
+    return {
+        'eq': lambda s: s == value,
+        'neq': lambda s: s != value,
+        'lt': lambda s: s < value,
+        'lte': lambda s: s <= value,
+        'gt': lambda s: s > value,
+        'gte': lambda s: s >= value,
+        'startsWith': lambda s: s.startswith(value),
+        'endsWith': lambda s: s.endswith(value),
+        'contains': lambda s: value in s
+    }[operator]
+
+
+def make_query_predicate(column, operator, value):
+    """
+    Return the function that returns the mask of the scenes of a `CollectionColumns` that satisfy
+    the operator of the query extension.
+    """
+
+    if column == 'collection':
+        predicate = make_string_predicate(operator, value)
+        return lambda columns: predicate(columns.key)
+
+    if column in CATEGORY_COLUMNS:
+        predicate = make_string_predicate(operator, value)
+        return lambda columns: np.isin(columns.arrays[column], columns.vocabularies[column].match(predicate))
+
+    if column == 'id':
+        if operator == 'in':
+            if not isinstance(value, list):
+                raise UnsupportedSearch('`in` is not a list')
+
+            values = [parse_string(v) for v in value]
+            return lambda columns: np.isin(columns.arrays['id_key'], values)
+
+        predicate = np.frompyfunc(make_string_predicate(operator, value), 1, 1)
+
+        return lambda columns: predicate(columns.arrays['id_key']).astype(bool)
+
+    if operator in ('startsWith', 'endsWith', 'contains'):
+        raise UnsupportedSearch('`{}` of `{}`'.format(operator, column))
+
+    parse = parse_datetime if column in DATETIME_COLUMNS else parse_number
+
+    if operator == 'in':
+        if not isinstance(value, list):
+            raise UnsupportedSearch('`in` is not a list')
+
+        values = np.array([parse(v) for v in value])
+        return lambda columns: np.isin(columns.arrays[column], values)
+
+    value = parse(value)
+
+    if operator == 'neq':
+        # NULL is not different from any value
+        return lambda columns: (columns.arrays[column] != value) & ~columns.get_null(column, slice(None))
+
+    compare = {
+        'eq': np.equal, 'lt': np.less, 'lte': np.less_equal, 'gt': np.greater, 'gte': np.greater_equal
+    }[operator]
+
+    return lambda columns: compare(columns.arrays[column], value)
+
+
+class SnapshotFilter:
+    """
+    Filter of a search, compiled to functions that return the mask of the scenes of a `CollectionColumns`.
+
+    `search_filter` is a dict with the filters of `get_collection_items`: `item_id`, `ids` (a list),
+    `bbox` (`min_x, min_y, max_x, max_y`), `time` (a list with the start and the optional end), `query`
+    and `intersects` (the polygons of `parse_geometry`). The filters that are not given are not applied.
+
+    The scenes of `bbox` are selected as by SQL with the `spatial_index` (i.e. `INPE_STAC_SPATIAL_INDEX`):
+    by their corners if it is `none`, otherwise by the MBR of their footprints (SQL compares the corners of the
+    collections changed after the R-tree file has been built, until it is built again).
+    """
+
+    def __init__(self, search_filter, deleted_flag, spatial_index='none'):
+        self.predicates = []
+        self.polygons = search_filter.get('intersects')
+
+        if deleted_flag in ('0', '1'):
+            deleted = int(deleted_flag)
+            self.predicates.append(lambda columns: columns.arrays['deleted'] == deleted)
+
+        if search_filter.get('item_id') is not None:
+            self.predicates.append(make_query_predicate('id', 'eq', search_filter['item_id']))
+        elif search_filter.get('ids') is not None:
+            self.predicates.append(make_query_predicate('id', 'in', list(search_filter['ids'])))
+
+        make_predicate = make_bbox_predicate if spatial_index == 'none' else make_mbr_predicate
+
+        if search_filter.get('bbox') is not None:
+            self.predicates.append(make_predicate(*[float(value) for value in search_filter['bbox']]))
+
+        if self.polygons is not None:
+            # the candidates are selected by the bbox of the geometry, as in SQL
+            self.predicates.append(make_predicate(*get_bbox(self.polygons)))
+
+        if search_filter.get('time') is not None:
+            time = search_filter['time']
+
+            if len(time) not in (1, 2):
+                raise UnsupportedSearch('`time` has {} values'.format(len(time)))
+
+            start = parse_datetime(time[0])
+            self.predicates.append(lambda columns: columns.arrays['date'] >= start)
+
+            if len(time) == 2:
+                end = parse_datetime(time[1])
+                self.predicates.append(lambda columns: columns.arrays['date'] <= end)
+
+        if search_filter.get('query') is not None:
+            query = search_filter['query']
+
+            for field, operators in get_query_shape(query):
+                for operator in operators:
+                    self.predicates.append(
+                        make_query_predicate(QUERYABLE_COLUMNS[field], operator, query[field][operator])
+                    )
+
+    def get_mask(self, columns):
+        mask = np.ones(columns.size, dtype=bool)
+
+        for predicate in self.predicates:
+            mask &= predicate(columns)
+
+        return mask
+
+
+def make_bbox_predicate(min_x, min_y, max_x, max_y):
+    """
+    The same comparison of the corners as `CORNERS_WHERE` of `inpe_stac.spatial`.
+    """
+
+    def predicate(columns):
+        a = columns.arrays
+
+        return (
+            ((min_x <= a['tr_longitude']) & (min_y <= a['tr_latitude'])) |
+            ((min_x <= a['br_longitude']) & (min_y <= a['tl_latitude']))
+        ) & (
+            ((max_x >= a['bl_longitude']) & (max_y >= a['bl_latitude'])) |
+            ((max_x >= a['tl_longitude']) & (max_y >= a['br_latitude']))
+        )
+
+    return predicate
+
+
+def make_mbr_predicate(min_x, min_y, max_x, max_y):
+    """
+    The same comparison of the MBR of the footprints as the spatial indexes of `inpe_stac.spatial`
+    (i.e. `MBRIntersects` of MySQL and the R-tree file).
+    """
+
+    def predicate(columns):
+        a = columns.arrays
+
+        longitudes = (a['tl_longitude'], a['bl_longitude'], a['br_longitude'], a['tr_longitude'])
+        latitudes = (a['tl_latitude'], a['bl_latitude'], a['br_latitude'], a['tr_latitude'])
+
+        return (
+            (reduce(np.maximum, longitudes) >= min_x) & (reduce(np.minimum, longitudes) <= max_x) &
+            (reduce(np.maximum, latitudes) >= min_y) & (reduce(np.minimum, latitudes) <= max_y)
+        )
+
+    return predicate
+
+
+def make_keyset_mask(columns, indices, values, sort_keys):
+    """
+    Return the mask of the scenes of `indices` that come after the position `values` of the sort keys,
+    as `make_keyset_where` of `inpe_stac.pagination` does.
+    """
+
+    predicate = None
+
+    try:
+        # the mask is built from the last key (i.e. the unique one) to the first one
+        for (column, descending), value in reversed(list(zip(sort_keys, values))):
+            null = columns.get_null(column, indices)
+
+            if value is None:
+                equal = null
+                after = None if descending else ~null
+            else:
+                equal, greater, less = columns.compare(column, indices, value)
+                after = (less | null) if descending else greater
+
+            if predicate is None:
+                predicate = after if after is not None else False
+            elif after is None:
+                predicate = equal & predicate
+            else:
+                predicate = after | (equal & predicate)
+    except (UnsupportedSearch, TypeError, ValueError):
+        raise BadRequest('`token` parameter is not valid for this search')
+
+    return np.broadcast_to(predicate, indices.shape)
+
+
+def sort_indices(columns, indices, sort_keys):
+    """
+    Return the indices sorted by `sort_keys`, where NULL comes first in ascending order and last in descending order.
+    """
+
+    # the scenes are already sorted by `datetime, id`
+    if tuple(sort_keys) == DEFAULT_SORT_KEYS:
+        return indices
+
+    keys = []
+
+    # the last key of `lexsort` is the primary one
+    for column, descending in reversed(sort_keys):
+        if column == 'collection':
+            continue
+
+        values, null = columns.get_sort_values(column, indices)
+
+        keys.append(-values if descending else values)
+        keys.append(null if descending else ~null)
+
+    return indices[np.lexsort(keys)] if keys else indices
+
+
+class SnapshotEngine:
+    """
+    Snapshot of the searchable attributes of all collections.
+
+    `load_state()` returns a list of dicts with `collection`, `total`, `deleted`, `max_datetime` and `max_updated`,
+    that identifies the state of each collection. `load_rows(collection, column=None, since=None)` returns the rows
+    (i.e. `SNAPSHOT_COLUMNS`) of a collection, just the ones whose `column` is greater than or equal to `since`
+    if it is given.
+    """
+
+    def __init__(self, load_state, load_rows, updated_column=None, deleted_flag='0', refresh_interval=60,
+                 max_intersects_candidates=100000, spatial_index='none'):
+        self.load_state = load_state
+        self.load_rows = load_rows
+        self.updated_column = updated_column
+        self.deleted_flag = deleted_flag
+        self.spatial_index = spatial_index
+        self.refresh_interval = refresh_interval
+        self.max_intersects_candidates = max_intersects_candidates
+
+        self.vocabularies = {column: Vocabulary() for column in CATEGORY_COLUMNS}
+        # name: CollectionColumns, it is replaced (never changed) by each refresh
+        self.collections = None
+        self.states = {}
+
+        self.__expires_at = 0
+        self.__lock = Lock()
+
+    def is_ready(self):
+        """
+        Return True if the snapshot has been loaded. If it has expired, then it is refreshed in background.
+        """
+
+        if self.__expires_at < monotonic() and self.__lock.acquire(blocking=False):
+            self.__expires_at = monotonic() + self.refresh_interval
+
+            Thread(target=self.__refresh_in_background, name='inpe_stac_snapshot', daemon=True).start()
+
+        return self.collections is not None
+
+    def __refresh_in_background(self):
+        try:
+            self.refresh()
+        except Exception:
+            logger.exception('SnapshotEngine.refresh() - the snapshot could not be refreshed')
+        finally:
+            self.__lock.release()
+
+    def get_state(self, collection=None):
+        """
+        Return the state of the items of a collection (or of all of them) at the last refresh of the snapshot.
+        """
+
+        states = self.states
+
+        if collection is not None:
+            return states.get(collection)
+
+        return sorted(states.items())
+
+    def reset_lock(self):
+        # the thread that was refreshing the snapshot does not exist inside a forked child
+        self.__lock = Lock()
+
+    def refresh(self):
+        start_time = perf_counter()
+
+        states = {
+            row['collection']: (
+                int(row['total']), int(row['deleted'] or 0), str(row['max_datetime']), str(row['max_updated'])
+            )
+            for row in self.load_state() or []
+        }
+
+        collections = {name: columns for name, columns in (self.collections or {}).items() if name in states}
+        loaded = 0
+
+        for name, state in states.items():
+            if name in collections and self.states.get(name) == state:
+                continue
+
+            columns = None
+            old = collections.get(name)
+
+            # just the rows changed since the last refresh are read, if they can be found
+            if old is not None:
+                old_state = self.states[name]
+
+                if self.updated_column and old_state[3] != 'None':
+                    rows = self.load_rows(name, self.updated_column, old_state[3])
+                elif old_state[2] != 'None':
+                    rows = self.load_rows(name, 'datetime', old_state[2])
+                else:
+                    rows = None
+
+                if rows is not None:
+                    columns = old.merge(rows, self.vocabularies)
+                    loaded += len(rows)
+
+                    # e.g. rows have been deleted or changed without changing `INPE_STAC_UPDATED_COLUMN`
+                    if columns.size != state[0] or int(columns.arrays['deleted'].sum()) != state[1]:
+                        columns = None
+
+            if columns is None:
+                rows = self.load_rows(name)
+                columns = CollectionColumns.from_rows(name, rows, self.vocabularies)
+                loaded += len(rows)
+
+            collections[name] = columns
+
+        self.states = states
+        self.collections = collections
+        self.__expires_at = monotonic() + self.refresh_interval
+
+        logger.info(
+            'SnapshotEngine.refresh() - collections: %s, scenes: %s, loaded rows: %s, elapsed_time: %.3f',
+            len(collections), sum(c.size for c in collections.values()), loaded, perf_counter() - start_time
+        )
+
+    def compile(self, search_filter):
+        """
+        Return the `SnapshotFilter` of a search, or None if the snapshot can not answer it.
+        """
+
+        try:
+            return SnapshotFilter(search_filter, self.deleted_flag, self.spatial_index)
+        except UnsupportedSearch as error:
+            logger.debug('SnapshotEngine.compile() - unsupported search: %s', error)
+            return None
+
+    def get_masks(self, snapshot_filter, collections):
+        masks = {name: snapshot_filter.get_mask(columns) for name, columns in collections.items()}
+
+        if snapshot_filter.polygons is None:
+            return masks
+
+        candidates = sum(int(mask.sum()) for mask in masks.values())
+
+        if candidates > self.max_intersects_candidates:
+            raise BadRequest(
+                '`intersects` selects more than {} scenes, please use a smaller geometry or more filters'.format(
+                    self.max_intersects_candidates
+                )
+            )
+
+        for name, mask in masks.items():
+            columns = collections[name]
+            indices = np.flatnonzero(mask)
+
+            for i in range(0, len(indices), INTERSECTS_BATCH_SIZE):
+                batch = indices[i:i + INTERSECTS_BATCH_SIZE]
+
+                footprints = np.stack([
+                    np.stack([columns.arrays[x][batch], columns.arrays[y][batch]], axis=-1)
+                    for x, y in zip(CORNER_COLUMNS[0::2], CORNER_COLUMNS[1::2])
+                ], axis=1)
+
+                mask[batch] = intersects_footprints(footprints, snapshot_filter.polygons)
+
+        return masks
+
+    def search(self, snapshot_filter, collections=None, sort_keys=DEFAULT_SORT_KEYS, offset=0, limit=10,
+               keyset=None):
+        """
+        Return the ids of the page (i.e. a list of `(collection, id)`) and the number of matched scenes of each
+        collection with any (i.e. a list of `{'collection': ..., 'matched': ...}`).
+
+        If `collections` is given, then the scenes of each collection are paginated by their own and ordered
+        by `sort_keys`, else the scenes of all collections are paginated together.
+
+        If `keyset` is None, then the page starts at `offset`, else after the positions inside `keyset`
+        (see `inpe_stac.pagination`).
+        """
+
+        snapshot = self.collections
+        per_collection = collections is not None
+
+        if per_collection:
+            names = sorted(c for c in collections if c in snapshot)
+        else:
+            names = sorted(snapshot)
+
+        positions = {}
+
+        if keyset:
+            if per_collection:
+                positions = {position[0]: position[1:] for position in keyset}
+            else:
+                positions = {name: keyset[0] for name in names}
+
+        masks = self.get_masks(snapshot_filter, {name: snapshot[name] for name in names})
+
+        result_count = []
+        pages = []
+
+        for name in names:
+            columns = snapshot[name]
+            indices = np.flatnonzero(masks[name])
+
+            if len(indices):
+                result_count.append({'collection': name, 'matched': len(indices)})
+
+            # if there is a token, then the collections that are not inside it have already been exhausted
+            if keyset and per_collection and name not in positions:
+                continue
+
+            if name in positions:
+                indices = indices[make_keyset_mask(columns, indices, positions[name], sort_keys)]
+
+            indices = sort_indices(columns, indices, sort_keys)
+
+            if keyset is not None:
+                indices = indices[:limit]
+            elif per_collection:
+                indices = indices[offset:offset + limit]
+            else:
+                indices = indices[:offset + limit]
+
+            pages.append((columns, indices))
+
+        if per_collection:
+            page = [(columns.name, str(columns.arrays['id'][i])) for columns, indices in pages for i in indices]
+        else:
+            page = self.merge_pages(pages, sort_keys)[0 if keyset is not None else offset:][:limit]
+
+        return page, result_count
+
+    @staticmethod
+    def merge_pages(pages, sort_keys):
+        """
+        Sort the first scenes of each collection together by `sort_keys`.
+        """
+
+        candidates = [(columns, i) for columns, indices in pages for i in indices]
+
+        # a stable sort by each key, from the last one to the first one
+        for column, descending in reversed(sort_keys):
+            candidates.sort(key=lambda candidate: candidate[0].get_sort_key(column, candidate[1]), reverse=descending)
+
+        return [(columns.name, str(columns.arrays['id'][i])) for columns, i in candidates]
+
+
+def get_sample_searches(collections):
+    """
+    Return searches that cover the filters, orders and paginations of the snapshot, over the given collections.
+    """
+
+    searches = [{}, {'limit': 50, 'page': 2}, {'sortby': '-cloud_cover', 'limit': 20}]
+
+    for collection in collections:
+        min_x, min_y, max_x, max_y = collection['min_x'], collection['min_y'], collection['max_x'], collection['max_y']
+        center_x, center_y = (min_x + max_x) / 2, (min_y + max_y) / 2
+        bbox = '{},{},{},{}'.format(min_x, min_y, center_x, center_y)
+
+        searches += [
+            {'collections': [collection['id']]},
+            {'collection_id': collection['id'], 'bbox': bbox, 'limit': 100},
+            {'collection_id': collection['id'], 'time': '{}/{}'.format(
+                collection['start_date'].isoformat(), collection['start_date'].isoformat()
+            )},
+            {'collections': [collection['id']], 'query': {'cloud_cover': {'lt': 50}}, 'sortby': '-datetime'},
+            {'collections': [collection['id']], 'query': {'path': {'gte': 100}, 'sensor': {'neq': 'MUX'}}},
+            {'collections': [collection['id']], 'sortby': 'path,-row', 'limit': 30, 'page': 3},
+            {'collection_id': collection['id'], 'intersects': {'type': 'Polygon', 'coordinates': [[
+                [min_x, min_y], [center_x, min_y], [center_x, center_y], [min_x, center_y], [min_x, min_y]
+            ]]}}
+        ]
+
+    return searches
+
+
+def check(searches, pages=2):
+    """
+    Compare the results of the searches by the snapshot and by SQL, following `pages` tokens.
+    Return the number of searches with different results.
+    """
+
+    from inpe_stac.data import get_collection_items, snapshot_engine
+
+    snapshot_engine.refresh()
+
+    differences = 0
+
+    for search in searches:
+        search = dict(search, count='exact')
+        token = {}
+
+        for _ in range(pages):
+            results = {}
+
+            for backend in ('sql', 'snapshot'):
+                items, matched, metadata, tracker = get_collection_items(**search, **token, backend=backend)
+
+                results[backend] = (
+                    [item['id'] for item in items], matched, metadata,
+                    tracker.next_token() if tracker is not None else None
+                )
+
+            if results['sql'] != results['snapshot']:
+                differences += 1
+                logger.error('check() - different results: %s\nsql: %s\nsnapshot: %s',
+                             search, results['sql'], results['snapshot'])
+                break
+
+            if results['sql'][3] is None:
+                break
+
+            token = {'token': results['sql'][3]}
+
+    logger.info('check() - searches: %s, different: %s', len(searches), differences)
+
+    return differences
+
+
+def main():
+    parser = ArgumentParser(description='Columnar snapshot of the searchable attributes of the items')
+    subparsers = parser.add_subparsers(dest='command')
+
+    check_parser = subparsers.add_parser('check', help='compare the results of the snapshot to the ones of SQL')
+    check_parser.add_argument(
+        '--searches', help='JSON file with a list of searches (i.e. arguments of get_collection_items)'
+    )
+    check_parser.add_argument('--pages', type=int, default=2, help='number of pages followed by token')
+
+    args = parser.parse_args()
+
+    if args.command != 'check':
+        parser.print_help()
+        return
+
+    if args.searches:
+        with open(args.searches) as searches_file:
+            searches = load_json(searches_file)
+    else:
+        from inpe_stac.data import get_collections
+
+        searches = get_sample_searches(get_collections() or [])
+
+    exit(1 if check(searches, pages=args.pages) else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,371 @@
+#!/usr/bin/env python3
+
+"""
+Spatial index of the scene footprints, used by the `bbox` filter of the item searches.
+
+`INPE_STAC_SPATIAL_INDEX` selects how the `bbox` filter is answered:
+    - `none`: the corners of the scenes are compared to the bbox (i.e. it can not use an index);
+    - `mysql`: the `footprint` column of `stac_item` is compared through its spatial index;
+    - `rtree`: the ids of the scenes are selected from a local SQLite R-tree, then they are
+      searched by primary key. If there are more than `INPE_STAC_RTREE_MAX_IDS` scenes,
+      then the corners are compared instead. The collections that have changed since the file
+      was built are searched by their corners, until the file is built again.
+
+The `footprint` column and the R-tree file are created by the commands of this module:
+
+    python -m inpe_stac.spatial migrate
+    python -m inpe_stac.spatial rtree
+"""
+
+from argparse import ArgumentParser
+from os import getpid, path, remove, rename, stat
+from sqlite3 import connect, OperationalError
+from threading import local
+from time import time
+
+from sqlalchemy.sql import text
+
+from inpe_stac.log import get_logger
+from inpe_stac.database import get_engine
+from inpe_stac.environment import INPE_STAC_SPATIAL_INDEX, INPE_STAC_RTREE_PATH, \
+                                  INPE_STAC_RTREE_MAX_IDS
+
+# the watermarks are imported from `inpe_stac.data` by the functions that use them, since it imports this module
+
+
+logger = get_logger(__name__)
+
+
+# polygon of the scene (closed ring), from the corner columns
+FOOTPRINT_WKT = '''CONCAT(
+    'POLYGON((',
+    {0}tl_longitude, ' ', {0}tl_latitude, ',',
+    {0}bl_longitude, ' ', {0}bl_latitude, ',',
+    {0}br_longitude, ' ', {0}br_latitude, ',',
+    {0}tr_longitude, ' ', {0}tr_latitude, ',',
+    {0}tl_longitude, ' ', {0}tl_latitude,
+    '))'
+)'''
+
+# the footprints are stored without SRID (i.e. cartesian longitude/latitude), because just their MBRs are compared
+MIGRATION_SQL = [
+    'ALTER TABLE stac_item ADD COLUMN footprint POLYGON NULL',
+    '''CREATE TRIGGER stac_item_footprint_insert BEFORE INSERT ON stac_item FOR EACH ROW
+       SET NEW.footprint = ST_GeomFromText({}, 0)'''.format(FOOTPRINT_WKT.format('NEW.')),
+    '''CREATE TRIGGER stac_item_footprint_update BEFORE UPDATE ON stac_item FOR EACH ROW
+       SET NEW.footprint = ST_GeomFromText({}, 0)'''.format(FOOTPRINT_WKT.format('NEW.'))
+]
+
+BACKFILL_SQL = '''
+    UPDATE stac_item
+    SET footprint = ST_GeomFromText({}, 0)
+    WHERE footprint IS NULL
+    LIMIT :batch_size
+'''.format(FOOTPRINT_WKT.format(''))
+
+# a spatial index requires a NOT NULL column with a SRID attribute (MySQL 8)
+INDEX_SQL = [
+    'ALTER TABLE stac_item MODIFY footprint POLYGON NOT NULL SRID 0',
+    'CREATE SPATIAL INDEX stac_item_footprint_idx ON stac_item (footprint)'
+]
+
+RTREE_SCHEMA = [
+    'CREATE VIRTUAL TABLE item_rtree USING rtree(rid, min_x, max_x, min_y, max_y)',
+    'CREATE TABLE item (rid INTEGER PRIMARY KEY, id TEXT NOT NULL UNIQUE, collection TEXT NOT NULL)',
+    'CREATE INDEX item_collection_idx ON item (collection)',
+    'CREATE TABLE item_state (collection TEXT PRIMARY KEY, matched INTEGER, max_datetime TEXT, max_updated TEXT)'
+]
+
+# the same comparison that has always been used by the `bbox` filter,
+# replace method removes extra espace caused by multi-line String
+CORNERS_WHERE = '''(
+    ((:{0}min_x <= tr_longitude and :{0}min_y <= tr_latitude)
+    or
+    (:{0}min_x <= br_longitude and :{0}min_y <= tl_latitude))
+    and
+    ((:{0}max_x >= bl_longitude and :{0}max_y >= bl_latitude)
+    or
+    (:{0}max_x >= tl_longitude and :{0}max_y >= br_latitude))
+    )'''.replace('    ', '')
+
+
+def make_bbox_where(params, bbox, collections=None, prefix=''):
+    """
+    Return the predicate that selects the scenes that intersect `bbox` (i.e. `min_x, min_y, max_x, max_y`).
+    The values of the predicate are added to `params`, with their names starting by `prefix`.
+    """
+
+    params[prefix + 'min_x'], params[prefix + 'min_y'], params[prefix + 'max_x'], params[prefix + 'max_y'] = bbox
+
+    if INPE_STAC_SPATIAL_INDEX == 'mysql':
+        params[prefix + 'bbox_wkt'] = 'POLYGON(({0} {1},{2} {1},{2} {3},{0} {3},{0} {1}))'.format(*bbox)
+
+        return 'MBRIntersects(footprint, ST_GeomFromText(:{}bbox_wkt, 0))'.format(prefix)
+
+    if INPE_STAC_SPATIAL_INDEX == 'rtree':
+        return make_rtree_where(params, bbox, collections=collections, prefix=prefix)
+
+    return CORNERS_WHERE.format(prefix)
+
+
+def make_rtree_where(params, bbox, collections=None, prefix=''):
+    """
+    Return the predicate of the scenes selected by the R-tree. The collections whose items have changed since
+    the file was built (i.e. whose watermarks are not the ones recorded by `build_rtree`) are searched
+    by their corners, as well as all collections if the file does not exist.
+    """
+
+    from inpe_stac.data import get_watermarks
+
+    try:
+        state = rtree_index.get_state()
+    except FileNotFoundError:
+        logger.warning('make_rtree_where - the R-tree file does not exist: %s', rtree_index.file_path)
+        return CORNERS_WHERE.format(prefix)
+
+    watermarks = get_watermarks(collections)
+    searched = collections if collections is not None else sorted(watermarks)
+
+    indexed = [c for c in searched if state.get(c) == watermarks.get(c)]
+    changed = [c for c in searched if state.get(c) != watermarks.get(c)]
+
+    if not indexed:
+        return CORNERS_WHERE.format(prefix)
+
+    ids = rtree_index.search(
+        *[float(value) for value in bbox], collections=indexed if changed else collections,
+        max_ids=INPE_STAC_RTREE_MAX_IDS
+    )
+
+    # there are too many scenes in order to search them by primary key
+    if ids is None:
+        return CORNERS_WHERE.format(prefix)
+
+    predicates = []
+
+    if ids:
+        params[prefix + 'rtree_ids'] = ids
+        predicates.append('id IN :{}rtree_ids'.format(prefix))
+
+    if changed:
+        params[prefix + 'rtree_changed'] = changed
+        predicates.append('(collection IN :{}rtree_changed AND {})'.format(prefix, CORNERS_WHERE.format(prefix)))
+
+    # neither the R-tree nor the changed collections have a scene inside the bbox
+    if not predicates:
+        return '1 = 0'
+
+    if len(predicates) == 1:
+        return predicates[0]
+
+    return '({})'.format(' OR '.join(predicates))
+
+
+class RTreeIndex:
+    """
+    Read-only access to the R-tree file created by `build_rtree`.
+    Each thread has its own SQLite connection, that is opened again when the file is replaced.
+    """
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.__local = local()
+
+    def __get_connection(self):
+        """
+        Return the connection of this thread. Raise `FileNotFoundError` if the file does not exist.
+        """
+
+        mtime = stat(self.file_path).st_mtime
+
+        if getattr(self.__local, 'pid', None) != getpid() or self.__local.mtime != mtime:
+            self.__local.connection = connect('file:{}?mode=ro'.format(self.file_path), uri=True)
+            self.__local.state = load_rtree_state(self.__local.connection)
+            self.__local.mtime = mtime
+            self.__local.pid = getpid()
+
+        return self.__local.connection
+
+    def get_version(self):
+        """
+        Return the modification time of the file, or None if it does not exist.
+        """
+
+        try:
+            return stat(self.file_path).st_mtime
+        except FileNotFoundError:
+            return None
+
+    def get_state(self):
+        """
+        Return the watermarks of the collections (see `inpe_stac.data.get_watermarks`) when the file was built.
+        """
+
+        self.__get_connection()
+
+        return self.__local.state
+
+    def search(self, min_x, min_y, max_x, max_y, collections=None, max_ids=None):
+        """
+        Return the ids of the scenes whose MBR intersects the bbox,
+        or None if there are more than `max_ids` scenes.
+        """
+
+        sql = '''
+            SELECT item.id
+            FROM item_rtree
+            JOIN item ON item.rid = item_rtree.rid
+            WHERE item_rtree.max_x >= ? AND item_rtree.min_x <= ?
+            AND item_rtree.max_y >= ? AND item_rtree.min_y <= ?
+        '''
+        args = [min_x, max_x, min_y, max_y]
+
+        if collections:
+            sql += ' AND item.collection IN ({})'.format(','.join('?' * len(collections)))
+            args += collections
+
+        if max_ids is not None:
+            sql += ' LIMIT ?'
+            args.append(max_ids + 1)
+
+        ids = [row[0] for row in self.__get_connection().execute(sql, args)]
+
+        if max_ids is not None and len(ids) > max_ids:
+            return None
+
+        return ids
+
+
+def load_rtree_state(connection):
+    try:
+        rows = connection.execute('SELECT collection, matched, max_datetime, max_updated FROM item_state')
+    except OperationalError:
+        # the items of a file built without its state are taken as changed
+        logger.warning('load_rtree_state - the R-tree file has not the state of its items, build it again')
+        return {}
+
+    return {collection: (matched, max_datetime, max_updated) for collection, matched, max_datetime, max_updated in rows}
+
+
+rtree_index = RTreeIndex(INPE_STAC_RTREE_PATH)
+
+
+def migrate(batch_size=10000):
+    """
+    Add the `footprint` column to `stac_item`, fill it from the corner columns and create its spatial index.
+    The steps that have already been done are skipped, then it can be executed again after a failure.
+    """
+
+    engine = get_engine()
+
+    with engine.connect() as connection:
+        columns = [row[0] for row in connection.execute("SHOW COLUMNS FROM stac_item LIKE 'footprint'")]
+
+        if not columns:
+            for sql in MIGRATION_SQL:
+                logger.info('migrate() - %s', sql.split('\n')[0])
+                connection.execute(sql)
+
+        # the rows are updated in batches, in order to not lock the whole table at once
+        total = 0
+
+        while True:
+            updated = connection.execute(text(BACKFILL_SQL), batch_size=batch_size).rowcount
+            total += updated
+
+            logger.info('migrate() - backfilled footprints: %s', total)
+
+            if updated < batch_size:
+                break
+
+        indexes = list(connection.execute("SHOW INDEX FROM stac_item WHERE Key_name = 'stac_item_footprint_idx'"))
+
+        if not indexes:
+            for sql in INDEX_SQL:
+                logger.info('migrate() - %s', sql)
+                connection.execute(sql)
+
+
+def build_rtree(file_path=INPE_STAC_RTREE_PATH, batch_size=10000):
+    """
+    Create the R-tree file from all rows of `stac_item`. The file is written aside
+    and renamed at the end, then the running workers change to the new file at once.
+
+    The watermarks of the collections are recorded before the rows are read, then the items
+    that are written while the file is built are seen as changes by the searches.
+    """
+
+    from inpe_stac.data import load_watermarks
+
+    start_time = time()
+    tmp_path = file_path + '.tmp'
+
+    if path.exists(tmp_path):
+        remove(tmp_path)
+
+    rtree = connect(tmp_path)
+
+    for sql in RTREE_SCHEMA:
+        rtree.execute(sql)
+
+    rtree.executemany('INSERT INTO item_state VALUES (?, ?, ?, ?)', [
+        (collection,) + watermark for collection, watermark in load_watermarks().items()
+    ])
+
+    sql = '''
+        SELECT id, collection,
+               tl_longitude, tl_latitude, tr_longitude, tr_latitude,
+               bl_longitude, bl_latitude, br_longitude, br_latitude
+        FROM stac_item
+    '''
+
+    total = 0
+
+    with get_engine().connect() as connection:
+        result = connection.execution_options(stream_results=True).execute(text(sql))
+
+        while True:
+            rows = result.fetchmany(batch_size)
+
+            if not rows:
+                break
+
+            items, boxes = [], []
+
+            for rid, row in enumerate(rows, start=total + 1):
+                longitudes = (row['tl_longitude'], row['tr_longitude'], row['bl_longitude'], row['br_longitude'])
+                latitudes = (row['tl_latitude'], row['tr_latitude'], row['bl_latitude'], row['br_latitude'])
+
+                items.append((rid, row['id'], row['collection']))
+                boxes.append((rid, min(longitudes), max(longitudes), min(latitudes), max(latitudes)))
+
+            rtree.executemany('INSERT INTO item VALUES (?, ?, ?)', items)
+            rtree.executemany('INSERT INTO item_rtree VALUES (?, ?, ?, ?, ?)', boxes)
+
+            total += len(rows)
+
+            logger.info('build_rtree() - indexed rows: %s', total)
+
+    rtree.commit()
+    rtree.close()
+
+    rename(tmp_path, file_path)
+
+    logger.info('build_rtree() - %s rows have been indexed in %.1f seconds', total, time() - start_time)
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Create the spatial index of the scene footprints.')
+    parser.add_argument(
+        'command', choices=['migrate', 'rtree'],
+        help='`migrate` adds the indexed `footprint` column to MySQL, `rtree` creates the local R-tree file'
+    )
+    parser.add_argument('--batch-size', type=int, default=10000, help='number of rows by batch')
+    parser.add_argument('--output', default=INPE_STAC_RTREE_PATH, help='path of the R-tree file')
+
+    args = parser.parse_args()
+
+    if args.command == 'migrate':
+        migrate(batch_size=args.batch_size)
+    else:
+        build_rtree(file_path=args.output, batch_size=args.batch_size)
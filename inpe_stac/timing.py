@@ -0,0 +1,133 @@
+"""
+Timings of the stages of the current request (e.g. its queries), that are kept by thread
+(or by greenlet, inside the ASGI application) and written by the access log, the `Server-Timing`
+header and the metrics (see `inpe_stac.metrics`).
+
+The stages of the item searches are:
+    - `db_count`: the query that counts the matched items;
+    - `snapshot`: the search inside the snapshot of the items, instead of `db_count` (see `inpe_stac.snapshot`);
+    - `db_page`: the queries of the returned page;
+    - `serialise`: the creation of the features from the rows;
+    - `encode`: the encoding of the features to JSON;
+    - `compress`: the compression of the response (see `inpe_stac.compression`);
+and `db` is the time of all queries of the request.
+"""
+
+from functools import wraps
+from threading import Lock
+from time import perf_counter
+
+from werkzeug.local import Local
+
+
+class RequestTimings:
+    """
+    Sum of the seconds spent by a request on each stage. It is shared by the threads
+    that execute the queries of the request (see `bind`).
+    """
+
+    def __init__(self):
+        self.start_time = perf_counter()
+        self.stages = {}
+        # number of features returned by the request
+        self.rows = 0
+
+        self.__lock = Lock()
+
+    def add(self, stage, seconds):
+        with self.__lock:
+            self.stages[stage] = self.stages.get(stage, 0) + seconds
+
+    def add_rows(self, rows):
+        with self.__lock:
+            self.rows += rows
+
+    def get_elapsed(self):
+        return perf_counter() - self.start_time
+
+    def get_server_timing(self):
+        """
+        Return the value of the `Server-Timing` header (https://www.w3.org/TR/server-timing/) of the stages so far.
+        """
+
+        stages = list(self.stages.items()) + [('total', self.get_elapsed())]
+
+        return ', '.join('{};dur={:.3f}'.format(stage, seconds * 1000) for stage, seconds in stages)
+
+
+__local = Local()
+
+
+def start_request():
+    __local.timings = RequestTimings()
+
+    return __local.timings
+
+
+def get_request_timings():
+    """
+    Return the timings of the current request, or None outside a request.
+    """
+
+    return getattr(__local, 'timings', None)
+
+
+def end_request():
+    __local.__release_local__()
+
+
+def add_timing(stage, seconds):
+    timings = get_request_timings()
+
+    if timings is not None:
+        timings.add(stage, seconds)
+
+
+def add_rows(rows):
+    timings = get_request_timings()
+
+    if timings is not None:
+        timings.add_rows(rows)
+
+
+def timed(stage):
+    """
+    Decorator that adds the time of the function to the stage `stage` of the current request.
+    """
+
+    def decorator(function):
+
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            start_time = perf_counter()
+
+            try:
+                return function(*args, **kwargs)
+            finally:
+                add_timing(stage, perf_counter() - start_time)
+
+        return wrapper
+
+    return decorator
+
+
+def bind(function):
+    """
+    Return `function`, that adds its timings to the current request even if it is executed by another thread.
+    """
+
+    timings = get_request_timings()
+
+    if timings is None:
+        return function
+
+    @wraps(function)
+    def wrapper(*args, **kwargs):
+        __local.timings = timings
+
+        try:
+            return function(*args, **kwargs)
+        finally:
+            end_request()
+
+    return wrapper
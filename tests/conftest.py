@@ -0,0 +1,98 @@
+"""
+The tests run against a small synthetic catalog (see `benchmarks.catalog`). The settings are read
+from the environment variables when `inpe_stac` is imported, then they are set here before it.
+
+The catalog is written to a SQLite file, or to `INPE_STAC_TEST_DB_URL` if it is set (e.g. a MySQL 8
+database, that is needed by the tests of the `mysql` spatial index). Its tables are dropped first.
+"""
+
+from os import environ, path
+from tempfile import mkdtemp
+
+import pytest
+
+from benchmarks.catalog import load_catalog, make_sqlite_url
+
+
+TMP_DIR = mkdtemp(prefix='inpe_stac_tests_')
+
+DB_URL = environ.get('INPE_STAC_TEST_DB_URL') or make_sqlite_url(path.join(TMP_DIR, 'catalog.db'))
+
+CATALOG_ITEMS = 5000
+
+environ.update({
+    'DB_URL': DB_URL,
+    'TIF_ROOT': 'http://tif/',
+    'PNG_ROOT': 'http://png/',
+    'INPE_STAC_ACCESS_LOG': '0',
+    'INPE_STAC_METRICS_DIR': '',
+    'INPE_STAC_LOG_LEVELS': 'inpe_stac=WARNING',
+    'INPE_STAC_SINGLE_FLIGHT_DIR': path.join(TMP_DIR, 'single_flight'),
+    'INPE_STAC_RTREE_PATH': path.join(TMP_DIR, 'rtree.sqlite')
+})
+
+
+@pytest.fixture(scope='session', autouse=True)
+def catalog():
+    load_catalog(DB_URL, items=CATALOG_ITEMS)
+
+    return DB_URL
+
+
+@pytest.fixture
+def insert_item(monkeypatch):
+    """
+    Return the function that inserts an item into `CBERS4_MUX_L2_DN`, by copying its first item.
+    The inserted items are deleted at the end of the test.
+    """
+
+    from sqlalchemy.sql import text
+
+    from inpe_stac import data
+    from inpe_stac.cache import TTLCache
+    from inpe_stac.database import get_engine
+    from inpe_stac.query import quote_identifier
+
+    inserted = []
+
+    def insert():
+        with get_engine().connect() as connection:
+            result = connection.execute(
+                text('SELECT * FROM stac_item WHERE collection = :collection ORDER BY id LIMIT 1'),
+                collection='CBERS4_MUX_L2_DN'
+            )
+            row = dict(result.fetchone())
+            row['id'] = 'ZZ_{}_{}'.format(len(inserted), row['id'])
+
+            columns = ', '.join(quote_identifier(column) for column in row)
+            values = ', '.join(':' + column for column in row)
+            connection.execute(text('INSERT INTO stac_item ({}) VALUES ({})'.format(columns, values)), **row)
+
+        inserted.append(row['id'])
+
+        # the watermarks of the collections are read again, as after `INPE_STAC_WATERMARK_TTL`
+        monkeypatch.setattr(data, 'watermark_cache', TTLCache(ttl=60))
+
+        return row
+
+    yield insert
+
+    with get_engine().connect() as connection:
+        for id in inserted:
+            connection.execute(text('DELETE FROM stac_item WHERE id = :id'), id=id)
+
+    # the totals of the collections are read again with the watermarks
+    monkeypatch.setattr(data, 'watermark_cache', TTLCache(ttl=60))
+    data.get_watermarks()
+
+
+@pytest.fixture
+def app():
+    from inpe_stac.app import app
+
+    return app
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
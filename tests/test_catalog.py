@@ -0,0 +1,88 @@
+import pytest
+
+from sqlalchemy.sql import text
+
+from inpe_stac.catalog import CollectionCatalog
+from inpe_stac.data import collection_catalog
+from inpe_stac.database import get_engine
+from inpe_stac.query import quote_identifier
+
+
+@pytest.fixture
+def insert_collection():
+    """
+    Return the function that inserts a copy of the first collection.
+    The inserted collections are deleted at the end of the test.
+    """
+
+    inserted = []
+
+    def insert(collection_id):
+        with get_engine().connect() as connection:
+            row = dict(connection.execute(text('SELECT * FROM stac_collection ORDER BY id LIMIT 1')).fetchone())
+            row['id'] = collection_id
+
+            columns = ', '.join(quote_identifier(column) for column in row)
+            values = ', '.join(':' + column for column in row)
+            connection.execute(text('INSERT INTO stac_collection ({}) VALUES ({})'.format(columns, values)), **row)
+
+        inserted.append(collection_id)
+
+    yield insert
+
+    with get_engine().connect() as connection:
+        for collection_id in inserted:
+            connection.execute(text('DELETE FROM stac_collection WHERE id = :id'), id=collection_id)
+
+    collection_catalog.invalidate()
+
+
+def test_catalog_reload(client, insert_collection):
+    response = client.get('/collections')
+    ids = [c['id'] for c in response.get_json()['collections']]
+
+    insert_collection('ZZ_NEW_COLLECTION')
+
+    # the catalog is loaded again after `INPE_STAC_COLLECTION_CACHE_TTL`
+    assert [c['id'] for c in client.get('/collections').get_json()['collections']] == ids
+
+    collection_catalog.invalidate()
+
+    reloaded = client.get('/collections')
+
+    assert [c['id'] for c in reloaded.get_json()['collections']] == ids + ['ZZ_NEW_COLLECTION']
+    assert reloaded.headers['ETag'] != response.headers['ETag']
+    assert client.get('/collections/ZZ_NEW_COLLECTION').status_code == 200
+
+
+def test_catalog_keeps_the_documents():
+    rows = [{'id': 'A'}]
+    loads = []
+    builds = []
+
+    def load():
+        loads.append(1)
+        return list(rows)
+
+    catalog = CollectionCatalog(load, ttl=60)
+
+    assert catalog.get_rows() == [{'id': 'A'}]
+    assert catalog.exists('A') and not catalog.exists('B')
+    assert catalog.memoize('key', lambda: builds.append(1) or 'document') == 'document'
+    assert catalog.memoize('key', lambda: builds.append(1) or 'other') == 'document'
+    assert len(loads) == 1 and len(builds) == 1
+
+    digest, version = catalog.get_digest(), catalog.version
+
+    # the same rows keep the documents
+    catalog.invalidate()
+    assert catalog.memoize('key', lambda: 'other') == 'document'
+    assert (catalog.get_digest(), catalog.version) == (digest, version)
+
+    # the changed rows discard them
+    rows.append({'id': 'B'})
+    catalog.invalidate()
+    assert catalog.memoize('key', lambda: 'other') == 'other'
+    assert catalog.get_rows('B') == [{'id': 'B'}]
+    assert catalog.get_digest() != digest and catalog.version == version + 1
+    assert len(loads) == 3
@@ -0,0 +1,102 @@
+import gzip
+import zlib
+
+import pytest
+
+from werkzeug.datastructures import Accept
+from werkzeug.http import parse_accept_header
+
+from inpe_stac import compression
+from inpe_stac.compression import COMPRESSORS, get_level, negotiate, parse_levels
+
+
+SEARCH = '/stac/search?collections=CBERS4_MUX_L2_DN&limit=50'
+
+# streamed, since the limit is not lower than `INPE_STAC_STREAM_MIN_LIMIT`
+STREAMED_SEARCH = '/stac/search?collections=CBERS4_MUX_L2_DN&limit=1000'
+
+
+def decompress(data, encoding):
+    if encoding == 'gzip':
+        return gzip.decompress(data)
+    if encoding == 'br':
+        return compression.brotli.decompress(data)
+
+    return compression.zstandard.ZstdDecompressor().decompressobj().decompress(data)
+
+
+def test_parse_levels():
+    assert parse_levels('gzip=6, zstd=3,/stac/export:gzip=1,') == {
+        (None, 'gzip'): 6, (None, 'zstd'): 3, ('/stac/export', 'gzip'): 1
+    }
+
+
+def test_get_level():
+    assert get_level('gzip') == 6
+    assert get_level('gzip', '/collections/<collection_id>/export') == 1
+    assert get_level('gzip', '/stac/search') == 6
+
+
+@pytest.mark.parametrize('header, encodings, expected', [
+    ('gzip', ['zstd', 'br', 'gzip'], 'gzip'),
+    ('gzip, br, zstd', ['zstd', 'br', 'gzip'], 'zstd'),
+    ('gzip, br;q=0.5', ['zstd', 'br', 'gzip'], 'gzip'),
+    ('*', ['br', 'gzip'], 'br'),
+    ('identity', ['zstd', 'br', 'gzip'], None),
+    ('gzip;q=0', ['gzip'], None),
+    ('', ['gzip'], None)
+])
+def test_negotiate(monkeypatch, header, encodings, expected):
+    monkeypatch.setattr(compression, 'ENCODINGS', encodings)
+
+    assert negotiate(parse_accept_header(header, Accept)) == expected
+
+
+@pytest.mark.parametrize('encoding', sorted(COMPRESSORS))
+@pytest.mark.parametrize('url', [SEARCH, STREAMED_SEARCH])
+def test_compressed_response(client, encoding, url):
+    identity = client.get(url)
+    response = client.get(url, headers={'Accept-Encoding': encoding})
+
+    assert response.headers['Content-Encoding'] == encoding
+    assert 'Accept-Encoding' in response.headers['Vary']
+    assert decompress(response.get_data(), encoding) == identity.get_data()
+
+
+def test_compressor_flushes_each_chunk():
+    compressor = COMPRESSORS['gzip'](6)
+    chunks = [compressor.compress(b'{"type": "Feature"}\n' * 100) for _ in range(3)]
+
+    # the client decodes each chunk as soon as it arrives
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+    for chunk in chunks:
+        assert decompressor.decompress(chunk) == b'{"type": "Feature"}\n' * 100
+
+    assert decompressor.decompress(compressor.finish()) == b''
+    assert decompressor.eof
+
+
+def test_small_response_is_not_compressed(client):
+    response = client.get('/conformance', headers={'Accept-Encoding': 'gzip'})
+
+    assert 'Content-Encoding' not in response.headers
+    assert 'Accept-Encoding' in response.headers['Vary']
+
+
+def test_not_accepted(client):
+    response = client.get(SEARCH, headers={'Accept-Encoding': 'identity'})
+
+    assert 'Content-Encoding' not in response.headers
+    assert not response.headers['ETag'].startswith('W/')
+
+
+def test_compressed_etag_is_weak(client):
+    identity = client.get(SEARCH)
+    response = client.get(SEARCH, headers={'Accept-Encoding': 'gzip'})
+
+    assert response.headers['ETag'] == 'W/' + identity.headers['ETag']
+
+    # the representations of any encoding are not modified
+    for etag in (response.headers['ETag'], identity.headers['ETag']):
+        assert client.get(SEARCH, headers={'Accept-Encoding': 'gzip', 'If-None-Match': etag}).status_code == 304
@@ -0,0 +1,124 @@
+from asyncio import gather, get_event_loop_policy, sleep as async_sleep
+from threading import Event
+
+import pytest
+
+from inpe_stac.asgi import app as asgi_app, make_environ
+from inpe_stac.concurrency import Lock, await_only, greenlet_spawn, is_async, sleep, spawn, wait_event
+
+
+def run(coroutine):
+    loop = get_event_loop_policy().new_event_loop()
+
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+async def double(value):
+    await async_sleep(0)
+    return value * 2
+
+
+def test_greenlet_spawn():
+    def function(value):
+        assert is_async()
+        return await_only(double(value)) + 1
+
+    assert run(greenlet_spawn(function, 20)) == 41
+    assert not is_async()
+
+
+def test_await_only_outside_a_greenlet():
+    coroutine = double(1)
+
+    with pytest.raises(RuntimeError):
+        await_only(coroutine)
+
+    coroutine.close()
+
+
+def test_exception_of_the_awaitable():
+    async def fail():
+        raise ValueError('fail')
+
+    def function():
+        try:
+            await_only(fail())
+        except ValueError as error:
+            return str(error)
+
+    assert run(greenlet_spawn(function)) == 'fail'
+
+
+def test_spawned_greenlets_run_at_the_same_time():
+    events = []
+
+    def task(name):
+        events.append(('start', name))
+        sleep(0.01)
+        events.append(('end', name))
+        return name
+
+    def function():
+        tasks = [spawn(task, name) for name in ('a', 'b')]
+        return [t.result() for t in tasks]
+
+    assert run(greenlet_spawn(function)) == ['a', 'b']
+    # both tasks have started before any of them has ended
+    assert [e[0] for e in events[:2]] == ['start', 'start']
+
+
+def test_lock_and_wait_event_do_not_block_the_loop():
+    lock = Lock()
+    event = Event()
+    order = []
+
+    def holder():
+        with lock:
+            order.append('holder')
+            sleep(0.01)
+            event.set()
+
+    def waiter():
+        assert wait_event(event, timeout=1)
+
+        with lock:
+            order.append('waiter')
+
+    async def main():
+        await gather(greenlet_spawn(holder), greenlet_spawn(waiter))
+
+    run(main())
+
+    assert order == ['holder', 'waiter']
+    assert run(greenlet_spawn(wait_event, Event(), 0.01)) is False
+
+
+def test_make_environ():
+    environ = make_environ({
+        'method': 'GET', 'path': '/stac/search', 'query_string': b'limit=1',
+        'headers': [(b'accept-encoding', b'gzip'), (b'x-forwarded-for', b'a'), (b'x-forwarded-for', b'b')]
+    }, b'')
+
+    assert environ['PATH_INFO'] == '/stac/search' and environ['QUERY_STRING'] == 'limit=1'
+    assert environ['HTTP_ACCEPT_ENCODING'] == 'gzip'
+    assert environ['HTTP_X_FORWARDED_FOR'] == 'a,b'
+
+
+def test_asgi_response_is_the_wsgi_one(client):
+    messages = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b''}
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {'type': 'http', 'method': 'GET', 'path': '/', 'query_string': b'', 'headers': []}
+
+    run(asgi_app(scope, receive, send))
+
+    assert messages[0]['type'] == 'http.response.start' and messages[0]['status'] == 200
+    assert b''.join(m.get('body', b'') for m in messages[1:]) == client.get('/').get_data()
@@ -0,0 +1,129 @@
+from threading import Barrier, Thread
+
+from inpe_stac import data
+from inpe_stac.cache import TTLCache
+from inpe_stac.data import count_cache, estimate_stac_items, get_collection_items, get_collection_totals, \
+                           get_watermarks
+
+
+SEARCH = '/stac/search?collections=CBERS4_MUX_L2_DN,CBERS4_AWFI_L2_DN&time=2015-01-01/2015-01-05&limit=5'
+
+
+def test_context_none(client):
+    result = client.get(SEARCH + '&context=none').get_json()
+
+    assert result['context']['matched'] is None
+    assert [m['context']['matched'] for m in result['context']['meta']] == [None, None]
+    # the limit is the one of each collection
+    assert len(result['features']) == 10
+
+
+def test_context_estimate_without_explain(client):
+    exact = client.get(SEARCH).get_json()
+
+    # SQLite does not estimate the rows, then they are counted
+    assert client.get(SEARCH + '&context=estimate').get_json()['context']['matched'] == exact['context']['matched']
+
+
+def test_invalid_context(client):
+    assert client.get(SEARCH + '&context=foo').status_code == 400
+
+
+def test_estimate_by_collection(monkeypatch):
+    collections = [row['id'] for row in data.collection_catalog.get_rows()]
+    queries = []
+
+    def do_query(sql, **params):
+        queries.append(params['e_collection'])
+        return [{'rows': 200, 'filtered': 50.0}], 0
+
+    monkeypatch.setattr(data, 'is_async', lambda: True)
+    monkeypatch.setattr(data, 'do_query', do_query)
+
+    # a search without collections is estimated by the collections of the catalog
+    result_count = estimate_stac_items('cloud_cover < :cloud_cover', {'cloud_cover': 10})
+
+    assert [d['collection'] for d in result_count] == queries == collections
+    assert {d['matched'] for d in result_count} == {100}
+
+    assert estimate_stac_items('1 = 1', {'collections': ['CBERS4_MUX_L2_DN']}) == [
+        {'collection': 'CBERS4_MUX_L2_DN', 'matched': 100}
+    ]
+
+
+def test_cached_count():
+    search = dict(collections=['CBERS4_MUX_L2_DN'], time='2015-01-01/2015-01-03', limit=5)
+
+    _, matched, _, _ = get_collection_items(page=1, **search)
+    hits = count_cache.hits
+
+    # the count of the next page is the same one
+    _, next_matched, _, _ = get_collection_items(page=2, **search)
+
+    assert count_cache.hits == hits + 1
+    assert next_matched == matched
+
+
+def test_cached_count_changes_with_the_items(insert_item):
+    search = dict(collections=['CBERS4_MUX_L2_DN'], time='2015-01-01/2015-01-14', limit=5)
+
+    _, matched, _, _ = get_collection_items(page=1, **search)
+
+    insert_item()
+
+    assert get_collection_items(page=1, **search)[1] == matched + 1
+
+
+def test_unfiltered_count_uses_the_totals():
+    totals = get_collection_totals()
+    misses = count_cache.misses
+
+    _, matched, meta, _ = get_collection_items(collections=['CBERS4_MUX_L2_DN', 'UNKNOWN'], limit=5)
+
+    assert matched == totals['CBERS4_MUX_L2_DN']
+    assert [(m['name'], m['context']['matched']) for m in meta] == [
+        ('CBERS4_MUX_L2_DN', totals['CBERS4_MUX_L2_DN']), ('UNKNOWN', 0)
+    ]
+    assert get_collection_items(limit=5)[1] == sum(totals.values())
+    assert count_cache.misses == misses
+
+
+def test_watermarks_of_the_collections(monkeypatch):
+    monkeypatch.setattr(data, 'watermark_cache', TTLCache(ttl=60))
+
+    scoped = get_watermarks(['CBERS4_MUX_L2_DN', 'UNKNOWN'])
+
+    assert list(scoped) == ['CBERS4_MUX_L2_DN']
+    assert get_watermarks() == data.load_watermarks()
+    assert scoped['CBERS4_MUX_L2_DN'] == get_watermarks()['CBERS4_MUX_L2_DN']
+
+
+def test_watermarks_are_loaded_once(monkeypatch):
+    monkeypatch.setattr(data, 'watermark_cache', TTLCache(ttl=60))
+
+    load_watermarks = data.load_watermarks
+    loads = []
+    threads = 8
+    barrier = Barrier(threads)
+
+    def load(collections=None):
+        loads.append(collections)
+        return load_watermarks(collections)
+
+    monkeypatch.setattr(data, 'load_watermarks', load)
+
+    results = []
+
+    def run():
+        barrier.wait()
+        results.append(get_watermarks())
+
+    workers = [Thread(target=run) for _ in range(threads)]
+
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    assert loads == [None]
+    assert all(result == results[0] for result in results)
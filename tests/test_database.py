@@ -0,0 +1,59 @@
+from os import _exit, fork, waitpid, WEXITSTATUS
+from threading import current_thread
+
+from inpe_stac import data
+from inpe_stac.data import do_query, get_collection_items
+from inpe_stac.database import get_engine, get_executor, get_pool_status
+
+
+def test_engine_is_shared():
+    engine = get_engine()
+
+    do_query('SELECT COUNT(*) AS total FROM stac_item')
+
+    assert get_engine() is engine
+    # the connection has been given back to the pool
+    assert engine.pool.checkedout() == 0
+    assert get_pool_status()[('sync', 'checked_out')] == 0
+
+
+def test_forked_child_creates_its_engine():
+    engine, executor = get_engine(), get_executor()
+    total = do_query('SELECT COUNT(*) AS total FROM stac_item')[0][0]['total']
+
+    pid = fork()
+
+    if pid == 0:
+        # the child exits by its own code, then the errors do not run the tests of the parent again
+        try:
+            ok = get_engine() is not engine and get_executor() is not executor and \
+                do_query('SELECT COUNT(*) AS total FROM stac_item')[0][0]['total'] == total
+        except BaseException:
+            ok = False
+
+        _exit(0 if ok else 1)
+
+    assert WEXITSTATUS(waitpid(pid, 0)[1]) == 0
+    assert get_engine() is engine
+
+
+def test_count_and_page_at_the_same_time(monkeypatch):
+    threads = []
+    count_stac_items = data.count_stac_items
+
+    def spy(*args, **kwargs):
+        threads.append(current_thread().name)
+        return count_stac_items(*args, **kwargs)
+
+    monkeypatch.setattr(data, 'count_stac_items', spy)
+
+    search = dict(collections=['CBERS4_MUX_L2_DN', 'CBERS4_AWFI_L2_DN'], time='2015-01-01/2015-01-10')
+
+    items, matched, meta, _ = get_collection_items(limit=1000, page=1, **search)
+
+    # the count is executed by a query thread while the page is read, and both see the same rows
+    assert threads and all(name.startswith('inpe_stac_query') for name in threads)
+    assert 0 < matched == len(items)
+    assert [m['context']['matched'] for m in meta] == [
+        len([i for i in items if i['collection'] == m['name']]) for m in meta
+    ]
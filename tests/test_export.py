@@ -0,0 +1,130 @@
+import gzip
+
+from http.client import IncompleteRead
+from io import BytesIO
+from json import loads
+
+import pytest
+
+from inpe_stac.export import NDJSON_MIMETYPE, export, get_last_id, iter_response_lines, make_export_url
+
+
+EXPORT = '/collections/CBERS4_MUX_L2_DN/export'
+
+
+class FakeResponse(BytesIO):
+    """
+    Body of an HTTP response, with its headers.
+    """
+
+    def __init__(self, data, headers):
+        super().__init__(data)
+        self.headers = headers
+
+
+def read_features(response):
+    return [loads(line) for line in response.get_data().splitlines()]
+
+
+def search_ids(client, **body):
+    features = client.post('/stac/search', json=dict(body, limit=5000)).get_json()['features']
+
+    return sorted(f['id'] for f in features)
+
+
+def test_export_collection(client):
+    response = client.get(EXPORT)
+    features = read_features(response)
+    ids = [f['id'] for f in features]
+
+    assert response.mimetype == NDJSON_MIMETYPE
+    assert response.get_data().endswith(b'\n')
+    assert ids == sorted(ids)
+    assert ids == search_ids(client, collections=['CBERS4_MUX_L2_DN'])
+
+    # the features are the ones of the search
+    search = client.get('/collections/CBERS4_MUX_L2_DN/items?ids=' + ids[0]).get_json()['features'][0]
+    assert {key: features[0][key] for key in ('geometry', 'bbox', 'properties', 'assets')} == \
+           {key: search[key] for key in ('geometry', 'bbox', 'properties', 'assets')}
+
+
+def test_export_after(client):
+    ids = [f['id'] for f in read_features(client.get(EXPORT))]
+
+    assert [f['id'] for f in read_features(client.get(EXPORT + '?after=' + ids[99]))] == ids[100:]
+    assert client.get(EXPORT + '?after=' + ids[-1]).get_data() == b''
+
+
+@pytest.mark.parametrize('filters', [
+    {'collections': ['CBERS4_MUX_L2_DN', 'CBERS4_AWFI_L2_DN'], 'bbox': [-60, -20, -40, 0]},
+    {'time': '2015-01-01/2015-01-03', 'query': {'cloud_cover': {'lt': 30}}},
+    {'collections': ['LANDSAT8_OLI_L1_DN'], 'intersects': {'type': 'Polygon', 'coordinates': [[
+        [-60, -20], [-40, -20], [-40, 0], [-60, -20]
+    ]]}}
+])
+def test_export_filters(client, filters):
+    ids = [f['id'] for f in read_features(client.post('/stac/export', json=filters))]
+
+    assert ids
+    assert ids == search_ids(client, **filters)
+
+
+def test_export_unknown_collection(client):
+    assert client.get('/collections/UNKNOWN/export').get_data() == b''
+    assert client.get('/stac/export?collections=UNKNOWN').get_data() == b''
+
+
+def test_export_invalid_query(client):
+    assert client.get('/stac/export?query=invalid').status_code == 400
+
+
+def test_get_last_id(tmp_path):
+    file_path = str(tmp_path / 'items.ndjson')
+
+    assert get_last_id(file_path) is None
+
+    with open(file_path, 'wb') as output_file:
+        output_file.write(b'{"id": "A"}\n{"id": "B"}\n{"id": "C", "geom')
+
+    # the incomplete line of an interrupted export is removed
+    assert get_last_id(file_path) == 'B'
+
+    with open(file_path, 'rb') as output_file:
+        assert output_file.read() == b'{"id": "A"}\n{"id": "B"}\n'
+
+    with open(file_path, 'wb') as output_file:
+        output_file.write(b'{"id": "A"')
+
+    assert get_last_id(file_path) is None
+
+
+def test_export_resumes_the_file(client, tmp_path):
+    file_path = str(tmp_path / 'items.ndjson')
+    data = client.get(EXPORT).get_data()
+
+    with open(file_path, 'wb') as output_file:
+        output_file.write(data[:len(data) // 2])
+
+    export(['CBERS4_MUX_L2_DN'], {}, output=file_path)
+
+    with open(file_path, 'rb') as output_file:
+        assert output_file.read() == data
+
+
+def test_make_export_url():
+    assert make_export_url('http://host/', ['C1'], {'bbox': '1,2,3,4', 'time': None}, after='X') == \
+        'http://host/collections/C1/export?bbox=1%2C2%2C3%2C4&after=X'
+    assert make_export_url('http://host', ['C1', 'C2'], {}) == 'http://host/stac/export?collections=C1%2CC2'
+    assert make_export_url('http://host', None, {}) == 'http://host/stac/export'
+
+
+def test_iter_response_lines():
+    lines = [b'{"id": "%d"}\n' % i for i in range(1000)]
+
+    assert list(iter_response_lines(FakeResponse(b''.join(lines), {}))) == lines
+    assert list(iter_response_lines(FakeResponse(gzip.compress(b''.join(lines)), {'Content-Encoding': 'gzip'}))) == \
+        lines
+
+    # a line without its end has been interrupted
+    with pytest.raises(IncompleteRead):
+        list(iter_response_lines(FakeResponse(b''.join(lines) + b'{"id"', {})))
@@ -0,0 +1,76 @@
+import pytest
+
+from werkzeug.exceptions import BadRequest
+
+from inpe_stac.fields import FieldSelection, parse_fields
+
+
+SEARCH = '/stac/search?collections=CBERS4_MUX_L2_DN&limit=5'
+
+
+def test_parse_fields():
+    assert parse_fields(None) is None
+    assert parse_fields('') is None
+    assert parse_fields({'include': [], 'exclude': []}) is None
+
+    selection = parse_fields('id,+geometry,-links')
+
+    assert selection.fields == ('type', 'id', 'geometry')
+    assert selection.properties == ()
+    assert 'assets' not in selection.columns
+
+
+def test_properties_selection():
+    selection = FieldSelection(include=['properties.cloud_cover', 'properties.row'])
+
+    assert selection.fields == ('type', 'id', 'properties')
+    assert selection.properties == ('row', 'cloud_cover')
+    assert selection.get_columns('datetime') == ('id', 'collection', 'row', 'cloud_cover', 'datetime')
+
+    selection = FieldSelection(exclude=['properties.sync_loss', 'assets', 'id'])
+
+    # the required members are returned anyway
+    assert selection.fields == ('type', 'id', 'collection', 'geometry', 'bbox', 'properties', 'links')
+    assert selection.properties == ('datetime', 'path', 'row', 'satellite', 'sensor', 'cloud_cover')
+
+
+@pytest.mark.parametrize('fields', [
+    'foo', 'properties.foo', 'geometry.type', {'include': 'id'}, {'include': [1]}, ['id']
+])
+def test_invalid_fields(fields):
+    with pytest.raises(BadRequest):
+        parse_fields(fields)
+
+
+def test_get_fields(client):
+    whole = client.get(SEARCH).get_json()['features']
+    features = client.get(SEARCH + '&fields=id,properties.cloud_cover,-links').get_json()['features']
+
+    assert features == [
+        {'type': 'Feature', 'id': f['id'], 'properties': {'cloud_cover': f['properties']['cloud_cover']}}
+        for f in whole
+    ]
+
+    features = client.get(SEARCH + '&fields=-assets,-properties.sync_loss').get_json()['features']
+
+    for feature, f in zip(features, whole):
+        f.pop('assets')
+        f['properties'].pop('sync_loss')
+
+        assert feature == f
+
+
+def test_post_fields(client):
+    body = {'collections': ['CBERS4_MUX_L2_DN'], 'limit': 5, 'sortby': '-cloud_cover'}
+    whole = client.post('/stac/search', json=body).get_json()
+    result = client.post('/stac/search', json=dict(body, fields={'include': ['geometry', 'bbox']})).get_json()
+
+    assert [set(f) for f in result['features']] == [{'type', 'id', 'geometry', 'bbox'}] * 5
+    assert [f['geometry'] for f in result['features']] == [f['geometry'] for f in whole['features']]
+
+    # the token of a selection without the sort keys goes on after the same item
+    assert result['context']['next'] == whole['context']['next']
+
+
+def test_invalid_fields_response(client):
+    assert client.get(SEARCH + '&fields=properties.foo').status_code == 400
@@ -0,0 +1,108 @@
+from time import sleep
+
+from inpe_stac import http_cache, spatial
+from inpe_stac.cache import SizedLRUCache
+from inpe_stac.http_cache import get_watermark, response_cache
+
+
+SEARCH = '/stac/search?collections=CBERS4_MUX_L2_DN&limit=5'
+
+ITEMS = '/collections/CBERS4_AWFI_L2_DN/items?limit=5'
+
+
+def test_not_modified(client):
+    response = client.get(SEARCH)
+    etag = response.headers['ETag']
+
+    assert response.headers['Cache-Control'].startswith('public, max-age=')
+    assert client.get('/stac/search?limit=5&collections=CBERS4_MUX_L2_DN').headers['ETag'] == etag
+
+    not_modified = client.get(SEARCH, headers={'If-None-Match': etag})
+
+    assert not_modified.status_code == 304
+    assert not_modified.get_data() == b''
+    assert not_modified.headers['ETag'] == etag
+
+    assert client.get(SEARCH, headers={'If-None-Match': '"other"'}).status_code == 200
+
+
+def test_cached_response(client):
+    first = client.get(SEARCH + '&page=2')
+    hits = response_cache.hits
+
+    second = client.get(SEARCH + '&page=2')
+
+    assert response_cache.hits == hits + 1
+    assert second.get_data() == first.get_data()
+    assert second.headers['ETag'] == first.headers['ETag']
+
+
+def test_cached_post(client):
+    body = {'collections': ['CBERS4_MUX_L2_DN'], 'limit': 5, 'page': 2}
+    first = client.post('/stac/search', json=body)
+    hits = response_cache.hits
+
+    # the order of the JSON keys does not matter
+    second = client.post('/stac/search', json=dict(reversed(list(body.items()))))
+
+    assert response_cache.hits == hits + 1
+    assert second.get_data() == first.get_data()
+
+
+def test_etag_changes_with_the_items(client, insert_item):
+    search, items = client.get(SEARCH), client.get(ITEMS)
+
+    insert_item()
+
+    new_search = client.get(SEARCH, headers={'If-None-Match': search.headers['ETag']})
+
+    assert new_search.status_code == 200
+    assert new_search.headers['ETag'] != search.headers['ETag']
+    # the count of the search is not reused
+    assert new_search.get_json()['context']['matched'] == search.get_json()['context']['matched'] + 1
+
+    # the ETag of the items of a collection depends just on this collection
+    assert client.get(ITEMS, headers={'If-None-Match': items.headers['ETag']}).status_code == 304
+
+
+def test_sized_lru_cache():
+    cache = SizedLRUCache(max_size=2, max_bytes=10, max_item_bytes=6, max_age=0.05)
+
+    assert cache.set('a', 'A', 4)
+    assert not cache.set('b', 'B', 7)
+    assert cache.set('c', 'C', 5)
+
+    # the least recently used entry is removed when the entries are larger than `max_bytes`
+    assert cache.set('d', 'D', 5)
+    assert (cache.get('a'), cache.get('c'), cache.get('d')) == (None, 'C', 'D')
+    assert cache.size_bytes == 10
+
+    sleep(0.1)
+
+    assert cache.get('c') is None
+    assert cache.size_bytes == 5
+
+
+def test_etag_epoch(monkeypatch):
+    monkeypatch.setattr(http_cache, 'INPE_STAC_UPDATED_COLUMN', '')
+    monkeypatch.setattr(http_cache, 'time', lambda: 0)
+    watermark = get_watermark()
+
+    monkeypatch.setattr(http_cache, 'time', lambda: http_cache.INPE_STAC_RESPONSE_CACHE_TTL - 1)
+    assert get_watermark() == watermark
+
+    # without an updated column, the changes of the existing items are seen once by `INPE_STAC_RESPONSE_CACHE_TTL`
+    monkeypatch.setattr(http_cache, 'time', lambda: http_cache.INPE_STAC_RESPONSE_CACHE_TTL)
+    assert get_watermark() != watermark
+
+
+def test_etag_changes_with_the_rtree(tmp_path, monkeypatch):
+    file_path = str(tmp_path / 'rtree.sqlite')
+
+    monkeypatch.setattr(http_cache, 'INPE_STAC_SPATIAL_INDEX', 'rtree')
+    monkeypatch.setattr(http_cache, 'rtree_index', spatial.RTreeIndex(file_path))
+
+    watermark = get_watermark()
+    spatial.build_rtree(file_path)
+
+    assert get_watermark() != watermark
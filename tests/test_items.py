@@ -0,0 +1,98 @@
+from sqlalchemy.sql import text
+
+from inpe_stac import data
+from inpe_stac.cache import TTLCache
+from inpe_stac.data import get_collection_items, get_items_by_ids, make_ids_where
+from inpe_stac.database import get_engine
+
+
+def get_ids(collection='CBERS4_MUX_L2_DN', limit=5):
+    return [item['id'] for item in get_collection_items(collections=[collection], limit=limit)[0]]
+
+
+def test_bulk_items(client):
+    ids = get_ids()
+    requested = ids[::-1] + ['UNKNOWN', ids[0]]
+
+    result = client.post('/stac/items', json={'ids': requested}).get_json()
+
+    # in the order of the ids, without the unknown and the repeated ones
+    assert [f['id'] for f in result['features']] == ids[::-1]
+    assert result['context'] == {'requested': 6, 'returned': 5}
+
+    search = client.get('/stac/search?ids=' + ids[0]).get_json()['features'][0]
+    assert result['features'][-1] == search
+
+
+def test_bulk_items_cached(client):
+    ids = get_ids(limit=3)
+    first = client.post('/stac/items', json={'ids': ids}).get_data()
+    hits = data.item_cache.hits
+
+    assert client.post('/stac/items', json={'ids': ids}).get_data() == first
+    assert data.item_cache.hits == hits + 3
+
+
+def test_bulk_items_after_a_change(client, insert_item, monkeypatch):
+    row = insert_item()
+    ids = get_ids(limit=2) + [row['id']]
+
+    assert len(client.post('/stac/items', json={'ids': ids}).get_json()['features']) == 3
+
+    with get_engine().connect() as connection:
+        connection.execute(text('UPDATE stac_item SET deleted = 1 WHERE id = :id'), id=row['id'])
+
+    # the cached features of a collection are not used after its watermark changes
+    monkeypatch.setattr(data, 'watermark_cache', TTLCache(ttl=60))
+
+    assert [f['id'] for f in client.post('/stac/items', json={'ids': ids}).get_json()['features']] == ids[:2]
+
+
+def test_invalid_bulk_items(client, monkeypatch):
+    assert client.post('/stac/items', json={'ids': 'A'}).status_code == 400
+    assert client.post('/stac/items', data='ids').status_code == 400
+
+    monkeypatch.setattr('inpe_stac.app.INPE_STAC_BULK_MAX_IDS', 2)
+    assert client.post('/stac/items', json={'ids': ['A', 'B', 'C']}).status_code == 400
+
+
+def test_make_ids_where_batches(monkeypatch):
+    monkeypatch.setattr(data, 'INPE_STAC_IDS_BATCH_SIZE', 2)
+
+    params = {}
+
+    assert make_ids_where(params, ['A', 'B', 'C']) == '(id IN :ids_0 OR id IN :ids_1)'
+    assert params == {'ids_0': ['A', 'B'], 'ids_1': ['C']}
+
+    params = {}
+
+    assert make_ids_where(params, ['A']) == 'id IN :ids'
+    assert params == {'ids': ['A']}
+
+    assert make_ids_where({}, []) == '1 = 0'
+
+
+def test_search_ids_in_batches(client, monkeypatch):
+    ids = get_ids(limit=5) + get_ids('CBERS4_AWFI_L2_DN', limit=2)
+
+    monkeypatch.setattr(data, 'INPE_STAC_IDS_BATCH_SIZE', 2)
+
+    result = client.get('/stac/search?limit=10&ids=' + ','.join(ids)).get_json()
+
+    assert sorted(f['id'] for f in result['features']) == sorted(ids)
+    assert result['context']['matched'] == 7
+
+    assert sorted(row['id'] for row in get_items_by_ids(ids + ['UNKNOWN'])) == sorted(ids)
+
+
+def test_intersects_ids_in_batches(client, monkeypatch):
+    intersects = {'type': 'Polygon', 'coordinates': [[[-60, -20], [-40, -20], [-40, 0], [-60, -20]]]}
+    body = {'collections': ['CBERS4_AWFI_L2_DN'], 'intersects': intersects, 'limit': 500}
+    ids = sorted(f['id'] for f in client.post('/stac/search', json=body).get_json()['features'])
+
+    monkeypatch.setattr(data, 'INPE_STAC_IDS_BATCH_SIZE', 2)
+
+    result = client.post('/stac/search', json=dict(body, limit=499)).get_json()
+
+    assert len(ids) > 2
+    assert sorted(f['id'] for f in result['features']) == ids
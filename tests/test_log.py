@@ -0,0 +1,78 @@
+import logging
+
+from json import loads
+from sys import exc_info
+
+from inpe_stac import app as app_module
+from inpe_stac.http_cache import response_cache
+from inpe_stac.log import SAMPLED, AccessFormatter, LazyQueueHandler, LoggerFilter, SamplingFilter, parse_levels
+
+
+def make_record(msg='message', args=(), name='inpe_stac.data', extra=None, exc_info=None):
+    record = logging.LogRecord(name, logging.INFO, __file__, 1, msg, args, exc_info)
+    record.__dict__.update(extra or {})
+
+    return record
+
+
+def test_sampling_filter():
+    sampling = SamplingFilter(3)
+
+    # one by three records of each sampled message pass
+    assert [sampling.filter(make_record('a', extra=SAMPLED)) for _ in range(6)] == [True, False, False] * 2
+    assert sampling.filter(make_record('b', extra=SAMPLED))
+    # the other messages are not sampled
+    assert all(sampling.filter(make_record('a')) for _ in range(3))
+    assert all(SamplingFilter(1).filter(make_record('a', extra=SAMPLED)) for _ in range(3))
+
+
+def test_parse_levels():
+    assert parse_levels('inpe_stac=WARNING, inpe_stac.data=debug,') == {
+        'inpe_stac': 'WARNING', 'inpe_stac.data': 'DEBUG'
+    }
+    assert parse_levels('') == {}
+
+
+def test_logger_filter():
+    assert LoggerFilter('inpe_stac.access').filter(make_record(name='inpe_stac.access'))
+    assert not LoggerFilter('inpe_stac.access', exclude=True).filter(make_record(name='inpe_stac.access'))
+    assert LoggerFilter('inpe_stac.access', exclude=True).filter(make_record())
+
+
+def test_access_formatter():
+    record = make_record('access', ({'method': 'GET', 'status': 200},), name='inpe_stac.access')
+
+    fields = loads(AccessFormatter().format(record))
+
+    assert fields['method'] == 'GET' and fields['status'] == 200
+    assert 'time' in fields
+
+
+def test_traceback_is_formatted_by_the_request_thread():
+    try:
+        raise ValueError('fail')
+    except ValueError:
+        record = make_record(exc_info=exc_info())
+
+    record = LazyQueueHandler(None).prepare(record)
+
+    assert record.exc_info is None
+    assert 'ValueError: fail' in record.exc_text
+    # the message is not formatted yet
+    assert record.msg == 'message'
+
+
+def test_access_log(client, monkeypatch):
+    logged = []
+
+    monkeypatch.setattr(app_module, 'INPE_STAC_ACCESS_LOG', True)
+    monkeypatch.setattr(app_module, 'log_access', logged.append)
+    # the rows are read from the database, instead of the cached response
+    response_cache.clear()
+
+    client.get('/stac/search?collections=CBERS4_MUX_L2_DN&limit=5').close()
+
+    assert len(logged) == 1
+    assert logged[0]['path'] == '/stac/search' and logged[0]['status'] == 200
+    assert logged[0]['rows'] == 5
+    assert 'db' in logged[0]['timings_ms']
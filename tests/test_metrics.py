@@ -0,0 +1,123 @@
+from os import _exit, fork, getppid, path, waitpid
+from pickle import dumps
+
+from inpe_stac import metrics as metrics_module
+from inpe_stac.http_cache import response_cache
+from inpe_stac.metrics import Metrics, BUCKETS, merge_snapshots, read_snapshots, render_metrics, write_metrics
+
+
+SEARCH = '/stac/search?collections=CBERS4_MUX_L2_DN&limit=5'
+
+
+def get_dead_pid():
+    pid = fork()
+
+    if pid == 0:
+        _exit(0)
+
+    waitpid(pid, 0)
+
+    return pid
+
+
+def make_snapshot(requests, entries):
+    return {
+        'counters': {('inpe_stac_requests_total', (('route', '/stac/search'),)): requests},
+        'histograms': {('inpe_stac_request_duration_seconds', (('route', '/stac/search'),)): [1] + [0] * len(BUCKETS)},
+        'gauges': {('inpe_stac_cache_entries', (('cache', 'count'),)): entries}
+    }
+
+
+def write_snapshot(directory, pid, snapshot):
+    with open(path.join(directory, '{}.metrics'.format(pid)), 'wb') as metrics_file:
+        metrics_file.write(dumps(snapshot))
+
+
+def get_sample(text, prefix):
+    return [float(line.rsplit(' ', 1)[1]) for line in text.splitlines() if line.startswith(prefix)]
+
+
+def test_metrics_route(client):
+    route = 'inpe_stac_requests_total{route="/stac/search",method="GET",status="200"}'
+
+    before = get_sample(client.get('/metrics').get_data(as_text=True), route) or [0]
+
+    # the stages of the database are not skipped by the cached response
+    response_cache.clear()
+    client.get(SEARCH).close()
+
+    response = client.get('/metrics')
+    text = response.get_data(as_text=True)
+
+    assert response.mimetype == 'text/plain'
+    assert get_sample(text, route) == [before[0] + 1]
+    assert '# TYPE inpe_stac_request_duration_seconds histogram' in text
+    assert 'inpe_stac_stage_duration_seconds_bucket{route="/stac/search",stage="db",le="+Inf"}' in text
+    assert 'inpe_stac_cache_hits_total{cache="count"}' in text
+
+
+def test_metrics_route_can_be_disabled(client, monkeypatch):
+    monkeypatch.setattr('inpe_stac.app.INPE_STAC_METRICS', False)
+
+    assert client.get('/metrics').status_code == 404
+
+
+def test_server_timing(client, monkeypatch):
+    response_cache.clear()
+    response = client.get(SEARCH)
+
+    stages = [stage.split(';')[0] for stage in response.headers['Server-Timing'].split(', ')]
+
+    assert 'db' in stages and stages[-1] == 'total'
+
+    monkeypatch.setattr('inpe_stac.app.INPE_STAC_SERVER_TIMING', False)
+
+    assert 'Server-Timing' not in client.get(SEARCH).headers
+
+
+def test_counters_of_the_histograms():
+    metrics = Metrics()
+
+    metrics.inc('inpe_stac_requests_total', ())
+    metrics.inc('inpe_stac_requests_total', (), 2)
+    metrics.observe('inpe_stac_request_duration_seconds', (), 0.003)
+    metrics.observe('inpe_stac_request_duration_seconds', (), 100)
+
+    counters, histograms = metrics.snapshot()
+    histogram = histograms[('inpe_stac_request_duration_seconds', ())]
+
+    assert counters == {('inpe_stac_requests_total', ()): 3}
+    assert histogram[BUCKETS.index(0.005)] == 1 and histogram[len(BUCKETS) - 1] == 1
+    assert histogram[-2:] == [100.003, 2]
+
+
+def test_snapshots_of_the_other_processes(tmpdir, monkeypatch):
+    monkeypatch.setattr(metrics_module, 'INPE_STAC_METRICS_DIR', str(tmpdir))
+
+    write_snapshot(str(tmpdir), getppid(), make_snapshot(2, 10))
+    write_snapshot(str(tmpdir), get_dead_pid(), make_snapshot(3, 20))
+    tmpdir.join('ignored.tmp').write('')
+
+    snapshots = read_snapshots()
+    merged = merge_snapshots(snapshots)
+
+    assert len(snapshots) == 2
+    # the counters of a process that does not exist anymore are kept, but not its gauges
+    assert merged['counters'] == {('inpe_stac_requests_total', (('route', '/stac/search'),)): 5}
+    assert merged['gauges'] == {('inpe_stac_cache_entries', (('cache', 'count'),)): 10}
+    assert merged['histograms'][('inpe_stac_request_duration_seconds', (('route', '/stac/search'),))][0] == 2
+
+    text = render_metrics()
+
+    # the metrics of this process are summed to the ones of the files
+    assert get_sample(text, 'inpe_stac_cache_entries{cache="count"}')[0] >= 10
+
+
+def test_write_metrics(tmpdir, monkeypatch):
+    directory = tmpdir.join('metrics')
+    monkeypatch.setattr(metrics_module, 'INPE_STAC_METRICS_DIR', str(directory))
+
+    write_metrics(force=True)
+
+    # the file of this process is not read again
+    assert directory.listdir() and read_snapshots() == []
@@ -0,0 +1,148 @@
+import pytest
+
+from inpe_stac.pagination import KeysetTracker, decode_token, encode_token, make_keyset_where, make_order_by, \
+                                 parse_sortby
+
+
+SEARCH = '/stac/search?collections=CBERS4_MUX_L2_DN&time=2015-01-01/2015-01-02'
+
+
+def follow_tokens(client, url, max_pages=100):
+    """
+    Return the pages of a search, following its `next` tokens.
+    """
+
+    pages = [client.get(url).get_json()]
+
+    while pages[-1]['context']['next'] is not None and len(pages) < max_pages:
+        pages.append(client.get('{}&token={}'.format(url, pages[-1]['context']['next'])).get_json())
+
+    return pages
+
+
+def get_ids(pages):
+    return [feature['id'] for page in pages for feature in page['features']]
+
+
+def test_encode_token():
+    positions = [['CBERS4_MUX_L2_DN', '2015-01-01 13:00:00', 'CBERS4MUX10010020150101']]
+
+    assert decode_token(encode_token(positions)) == [tuple(position) for position in positions]
+
+
+def test_parse_sortby():
+    # the id is the last key, then the order is unique
+    assert parse_sortby('path,-row') == (('path', False), ('row', True), ('id', False))
+    assert make_order_by(parse_sortby('path,-row')) == '`path` ASC, `row` DESC, `id` ASC'
+
+
+def test_make_keyset_where_quotes_the_columns():
+    params = {}
+    where = make_keyset_where([100, 5], [('path', False), ('row', True)], params, 0)
+
+    assert '`row`' in where
+    assert sorted(params.values()) == [5, 100]
+
+
+def test_keyset_tracker():
+    rows = [{'collection': 'A', 'datetime': '2015-01-01', 'id': str(i)} for i in range(3)]
+
+    tracker = KeysetTracker(3, per_collection=False)
+    list(tracker.track(rows))
+    assert decode_token(tracker.next_token()) == [('2015-01-01', '2')]
+
+    # the whole search has been returned
+    tracker = KeysetTracker(3, per_collection=False, max_rows={None: 3})
+    list(tracker.track(rows))
+    assert tracker.next_token() is None
+
+    tracker = KeysetTracker(4, per_collection=True)
+    list(tracker.track(rows))
+    assert tracker.next_token() is None
+
+
+def test_first_page_is_the_page_1(client):
+    first = client.get(SEARCH + '&limit=5').get_json()
+    second = client.get('{}&limit=5&token={}'.format(SEARCH, first['context']['next'])).get_json()
+
+    assert first['context']['page'] == 1
+    assert [meta['context']['page'] for meta in first['context']['meta']] == [1]
+    assert second['context']['page'] is None
+    assert [meta['context']['page'] for meta in second['context']['meta']] == [None]
+
+    assert client.get(SEARCH + '&limit=5&page=2').get_json()['context']['page'] == 2
+
+
+@pytest.mark.parametrize('sortby', ['', '&sortby=-cloud_cover', '&sortby=path,-row'])
+def test_tokens_return_each_item_once(client, sortby):
+    url = SEARCH + '&limit=7' + sortby
+    pages = follow_tokens(client, url)
+    everything = client.get(SEARCH + '&limit=500' + sortby).get_json()
+
+    assert get_ids(pages) == get_ids([everything])
+    assert len(get_ids(pages)) == everything['context']['matched']
+    assert all(len(page['features']) == 7 for page in pages[:-1])
+    assert 'links' not in pages[-1]
+
+
+def test_tokens_of_each_collection(client):
+    url = '/stac/search?collections=CBERS4_MUX_L2_DN,CBERS4_AWFI_L2_DN&time=2015-01-01/2015-01-01T13:00:02&limit=5'
+    pages = follow_tokens(client, url)
+    first = pages[0]['context']
+
+    # the collection with 5 items is exhausted by the first page
+    assert [(meta['name'], meta['context']['matched']) for meta in first['meta']] == [
+        ('CBERS4_AWFI_L2_DN', 5), ('CBERS4_MUX_L2_DN', 74)
+    ]
+    assert [collection for collection, *_ in decode_token(first['next'])] == ['CBERS4_MUX_L2_DN']
+    assert len(set(get_ids(pages))) == len(get_ids(pages)) == first['matched']
+
+
+def test_no_next_page_after_all_items(client):
+    ids = get_ids([client.get(SEARCH + '&limit=3').get_json()])
+
+    for url in (
+        '/stac/search?ids={}&limit=3'.format(','.join(ids)),
+        '/stac/search?ids={}&limit=3&context=none'.format(','.join(ids)),
+        '/collections/CBERS4_MUX_L2_DN/items?ids={}&limit=3'.format(','.join(ids)),
+        SEARCH + '&limit={}'.format(client.get(SEARCH + '&limit=1').get_json()['context']['matched'])
+    ):
+        page = client.get(url).get_json()
+
+        assert page['context']['next'] is None, url
+        assert 'links' not in page, url
+
+    page = client.get('/stac/search?ids={}&limit=2'.format(','.join(ids))).get_json()
+    assert get_ids(follow_tokens(client, '/stac/search?ids={}&limit=2'.format(','.join(ids)))) == ids
+    assert page['links'][0]['rel'] == 'next'
+
+
+def test_post_token(client):
+    body = {'collections': ['CBERS4_MUX_L2_DN'], 'time': '2015-01-01/2015-01-02', 'limit': 4}
+    first = client.post('/stac/search', json=body).get_json()
+    link = first['links'][0]
+
+    assert link['method'] == 'POST' and link['merge']
+
+    second = client.post('/stac/search', json=dict(body, **link['body'])).get_json()
+
+    assert get_ids([first, second]) == get_ids([client.post('/stac/search', json=dict(body, limit=8)).get_json()])
+
+
+def test_invalid_token(client):
+    assert client.get(SEARCH + '&token=invalid').status_code == 400
+    assert client.get(SEARCH + '&sortby=path&token=' + encode_token([['CBERS4_MUX_L2_DN', 'x']])).status_code == 400
+
+
+def test_single_item_is_not_paginated(client, monkeypatch):
+    id = get_ids([client.get(SEARCH + '&limit=1').get_json()])[0]
+
+    def tracker(*args, **kwargs):
+        raise AssertionError('the item has been paginated by keyset')
+
+    monkeypatch.setattr('inpe_stac.data.KeysetTracker', tracker)
+
+    feature = client.get('/collections/CBERS4_MUX_L2_DN/items/' + id).get_json()
+
+    assert feature['id'] == id
+    assert feature['type'] == 'Feature'
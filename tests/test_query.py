@@ -0,0 +1,79 @@
+import pytest
+
+from werkzeug.exceptions import BadRequest
+
+from inpe_stac.query import compile_query, compile_query_shape, get_query_shape, make_positional_query
+
+
+COLLECTIONS = ['CBERS4_MUX_L2_DN', 'CBERS4_AWFI_L2_DN']
+
+
+def search(client, query, **body):
+    return client.post('/stac/search', json=dict({'collections': COLLECTIONS, 'limit': 200, 'query': query}, **body))
+
+
+def test_compile_query():
+    params = {}
+    where = compile_query({'row': {'gte': 110, 'lt': 115}, 'sensor': {'startsWith': 'MU_'}}, params)
+
+    assert where == ['`row` < :q_0', '`row` >= :q_1', "`sensor` LIKE :q_2 ESCAPE '!'"]
+    assert params == {'q_0': 115, 'q_1': 110, 'q_2': 'MU!_%'}
+
+
+def test_same_shape_same_sql():
+    compile_query_shape.cache_clear()
+
+    first, second = {}, {}
+    assert compile_query({'cloud_cover': {'lt': 10}}, first) == compile_query({'cloud_cover': {'lt': 90}}, second)
+    assert (first, second) == ({'q_0': 10}, {'q_0': 90})
+    assert compile_query_shape.cache_info().hits == 1
+
+    # the operators are sorted, then the order of the filter does not change the SQL
+    assert get_query_shape({'path': {'lt': 1, 'gt': 0}}) == get_query_shape({'path': {'gt': 0, 'lt': 1}})
+
+
+@pytest.mark.parametrize('query', [
+    [],
+    {'foo': {'eq': 1}},
+    {'path': {}},
+    {'path': {'like': 1}},
+    {'path': {'in': []}},
+    {'path': {'in': [{}]}},
+    {'sensor': {'contains': 1}},
+    {'path': {'eq': True}},
+    {'path': {'eq': None}}
+])
+def test_invalid_query(query, client):
+    with pytest.raises(BadRequest):
+        compile_query(query, {})
+
+    assert search(client, query).status_code == 400
+
+
+def test_make_positional_query():
+    sql, values = make_positional_query(
+        "SELECT * FROM stac_item WHERE path IN :q_0 AND sensor LIKE :q_1 AND datetime > '2015-01-01 00::00'",
+        {'q_0': [100, 101], 'q_1': 'M%'}, placeholder='%s'
+    )
+
+    assert sql == "SELECT * FROM stac_item WHERE path IN (%s, %s) AND sensor LIKE %s AND datetime > '2015-01-01 00::00'"
+    assert values == [100, 101, 'M%']
+
+
+@pytest.mark.parametrize('query, check', [
+    ({'row': {'gte': 110}}, lambda p: p['row'] >= 110),
+    ({'path': {'in': [100, 102]}}, lambda p: p['path'] in (100, 102)),
+    ({'cloud_cover': {'lt': 20}, 'sensor': {'neq': 'MUX'}}, lambda p: p['cloud_cover'] < 20 and p['sensor'] != 'MUX'),
+    ({'eo:cloud_cover': {'gte': 50}}, lambda p: p['cloud_cover'] >= 50),
+    ({'sensor': {'endsWith': 'FI'}}, lambda p: p['sensor'] == 'AWFI'),
+    ({'satellite': {'contains': 'ERS'}}, lambda p: p['satellite'] == 'CBERS4')
+])
+def test_query_filters_the_items(client, query, check):
+    everything = search(client, None, limit=2000).get_json()
+    expected = [f['id'] for f in everything['features'] if check(f['properties'])]
+
+    result = search(client, query, limit=2000).get_json()
+
+    assert expected
+    assert sorted(f['id'] for f in result['features']) == sorted(expected)
+    assert result['context']['matched'] == len(expected)
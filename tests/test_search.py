@@ -0,0 +1,32 @@
+import pytest
+
+
+COLLECTIONS = ['CBERS2B_CCD_L2_DN', 'CBERS4_AWFI_L2_DN', 'CBERS4_MUX_L2_DN']
+
+
+@pytest.mark.parametrize('limit', [5, 1000])
+def test_returned_by_collection(client, limit):
+    # the page of 1000 items is streamed and its items are counted while they are read
+    response = client.get('/stac/search?collections={}&limit={}'.format(','.join(COLLECTIONS), limit))
+    result = response.get_json()
+    response.close()
+
+    meta = result['context']['meta']
+
+    assert [m['name'] for m in meta] == COLLECTIONS
+
+    for m in meta:
+        features = [f for f in result['features'] if f['collection'] == m['name']]
+
+        # each collection is limited by itself
+        assert m['context']['returned'] == len(features) == min(limit, m['context']['matched'])
+        assert len({f['id'] for f in features}) == len(features)
+
+
+def test_collection_without_items_in_the_page(client):
+    result = client.get('/stac/search?collections={}&time=2015-01-01/2015-01-05'.format(','.join(COLLECTIONS))) \
+        .get_json()
+
+    assert [(m['name'], m['context']['returned']) for m in result['context']['meta']] == [
+        ('CBERS2B_CCD_L2_DN', 0), ('CBERS4_AWFI_L2_DN', 10), ('CBERS4_MUX_L2_DN', 10)
+    ]
@@ -0,0 +1,110 @@
+from os import listdir
+from threading import Barrier, Thread
+from time import sleep
+
+from inpe_stac.singleflight import SingleFlight
+
+
+def call_together(calls):
+    """
+    Start the calls at the same time, then return their results in order.
+    """
+
+    results = [None] * len(calls)
+    barrier = Barrier(len(calls))
+
+    def run(index, call):
+        barrier.wait()
+        results[index] = call()
+
+    threads = [Thread(target=run, args=(index, call)) for index, call in enumerate(calls)]
+
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return results
+
+
+def make_function(calls, result, delay=0.3):
+    def function():
+        calls.append(result)
+        sleep(delay)
+        return result
+
+    return function
+
+
+def test_threads_share_the_call():
+    single_flight = SingleFlight()
+    calls = []
+    function = make_function(calls, 'result')
+
+    assert call_together([lambda: single_flight.do('key', function)] * 4) == ['result'] * 4
+    assert len(calls) == 1
+
+
+def test_error_is_shared():
+    single_flight = SingleFlight()
+
+    def function():
+        sleep(0.2)
+        raise ValueError('error')
+
+    def call():
+        try:
+            single_flight.do('key', function)
+        except ValueError as error:
+            return str(error)
+
+    assert call_together([call] * 3) == ['error'] * 3
+
+
+def test_processes_share_the_call(tmp_path):
+    # each instance has its own lock files, like the processes
+    leader, waiter = SingleFlight(str(tmp_path)), SingleFlight(str(tmp_path))
+    calls = []
+
+    def wait_and_call():
+        sleep(0.1)
+        return waiter.do('key', make_function(calls, 'waiter'))
+
+    results = call_together([lambda: leader.do('key', make_function(calls, 'leader')), wait_and_call])
+
+    assert results == ['leader', 'leader']
+    assert calls == ['leader']
+
+
+def test_result_is_written_just_for_waiting_processes(tmp_path):
+    single_flight = SingleFlight(str(tmp_path))
+
+    assert single_flight.do('key', lambda: 'result') == 'result'
+    assert listdir(str(tmp_path)) == ['key.lock']
+
+
+def test_large_result_is_not_shared(tmp_path):
+    leader, waiter = SingleFlight(str(tmp_path), max_result_bytes=100), SingleFlight(str(tmp_path))
+    calls = []
+
+    def wait_and_call():
+        sleep(0.1)
+        return waiter.do('key', make_function(calls, 'waiter' * 100, delay=0))
+
+    results = call_together([lambda: leader.do('key', make_function(calls, 'leader' * 100)), wait_and_call])
+
+    assert results == ['leader' * 100, 'waiter' * 100]
+    assert len(calls) == 2
+
+
+def test_timeout(tmp_path):
+    leader, waiter = SingleFlight(str(tmp_path)), SingleFlight(str(tmp_path), timeout=0)
+    calls = []
+
+    def wait_and_call():
+        sleep(0.1)
+        return waiter.do('key', make_function(calls, 'waiter', delay=0))
+
+    assert call_together([lambda: leader.do('key', make_function(calls, 'leader')), wait_and_call]) == [
+        'leader', 'waiter'
+    ]
@@ -0,0 +1,154 @@
+import numpy as np
+import pytest
+
+from inpe_stac import data, spatial
+from inpe_stac.cache import TTLCache
+from inpe_stac.data import get_collection_items, get_collections, snapshot_engine
+from inpe_stac.snapshot import CollectionColumns, SnapshotFilter, Vocabulary, check, get_sample_searches, \
+                               make_arrays, CATEGORY_COLUMNS, SNAPSHOT_COLUMNS
+
+
+SEARCHES = [
+    {},
+    {'limit': 50, 'page': 2},
+    {'collections': ['CBERS4_MUX_L2_DN'], 'sortby': 'path,-row', 'limit': 30},
+    {'collections': ['CBERS4_MUX_L2_DN', 'CBERS4_AWFI_L2_DN'], 'bbox': '-60,-20,-40,0', 'limit': 50},
+    {'collection_id': 'CBERS4_AWFI_L2_DN', 'bbox': '-50,-15,-45,-10', 'sortby': '-cloud_cover', 'limit': 10},
+    {
+        'collections': ['CBERS4_MUX_L2_DN', 'LANDSAT8_OLI_L1_DN'], 'query': {'cloud_cover': {'lt': 30}},
+        'sortby': '-datetime', 'limit': 25
+    },
+    {'query': {'path': {'gte': 110}, 'sensor': {'in': ['MUX', 'OLI']}}, 'sortby': 'datetime', 'limit': 40},
+    {'collections': ['CBERS2B_CCD_L2_DN'], 'time': '2007-10-05/2007-10-10', 'sortby': 'id', 'limit': 20}
+]
+
+
+@pytest.fixture(scope='module')
+def snapshot():
+    snapshot_engine.refresh()
+
+    assert snapshot_engine.is_ready()
+
+    return snapshot_engine
+
+
+def search_pages(search, backend, pages=3):
+    """
+    Return the ids, `matched`, metadata and next token of the first `pages` pages of a search, following its tokens.
+    """
+
+    results = []
+    token = {}
+
+    for _ in range(pages):
+        items, matched, metadata, tracker = get_collection_items(**search, **token, count='exact', backend=backend)
+        next_token = tracker.next_token() if tracker is not None else None
+
+        results.append(([item['id'] for item in items], matched, metadata, next_token))
+
+        if next_token is None:
+            break
+
+        token = {'token': next_token}
+
+    return results
+
+
+@pytest.mark.parametrize('search', SEARCHES)
+def test_snapshot_answers_as_sql(snapshot, search, monkeypatch):
+    searches = []
+    search_snapshot = snapshot.search
+
+    def spy(*args, **kwargs):
+        searches.append(args)
+        return search_snapshot(*args, **kwargs)
+
+    monkeypatch.setattr(snapshot, 'search', spy)
+
+    results = search_pages(search, 'snapshot')
+
+    assert searches, 'the search has been answered by SQL'
+    assert results == search_pages(search, 'sql')
+    assert any(ids for ids, _, _, _ in results)
+
+
+def make_mbr_where(params, bbox, collections=None, prefix=''):
+    """
+    The predicate of `MBRIntersects` of MySQL, over the corners of the scenes (SQLite does not have it).
+    """
+
+    params[prefix + 'min_x'], params[prefix + 'min_y'], params[prefix + 'max_x'], params[prefix + 'max_y'] = \
+        [float(value) for value in bbox]
+
+    return ' AND '.join([
+        'MAX(tl_longitude, bl_longitude, br_longitude, tr_longitude) >= :{}min_x'.format(prefix),
+        'MIN(tl_longitude, bl_longitude, br_longitude, tr_longitude) <= :{}max_x'.format(prefix),
+        'MAX(tl_latitude, bl_latitude, br_latitude, tr_latitude) >= :{}min_y'.format(prefix),
+        'MIN(tl_latitude, bl_latitude, br_latitude, tr_latitude) <= :{}max_y'.format(prefix)
+    ])
+
+
+@pytest.mark.parametrize('spatial_index', ['mysql', 'rtree'])
+@pytest.mark.parametrize('search', [search for search in SEARCHES if 'bbox' in search])
+def test_snapshot_answers_the_bbox_as_the_spatial_index(snapshot, search, spatial_index, tmp_path, monkeypatch):
+    monkeypatch.setattr(snapshot, 'spatial_index', spatial_index)
+
+    if spatial_index == 'mysql':
+        monkeypatch.setattr(data, 'make_bbox_where', make_mbr_where)
+    else:
+        file_path = str(tmp_path / 'rtree.sqlite')
+        spatial.build_rtree(file_path)
+
+        monkeypatch.setattr(spatial, 'INPE_STAC_SPATIAL_INDEX', 'rtree')
+        monkeypatch.setattr(spatial, 'rtree_index', spatial.RTreeIndex(file_path))
+        monkeypatch.setattr(data, 'watermark_cache', TTLCache(ttl=60))
+
+    assert search_pages(search, 'snapshot') == search_pages(search, 'sql')
+
+
+def test_snapshot_answers_the_ids_as_sql(snapshot):
+    ids = [item['id'] for item in get_collection_items(limit=5, backend='sql')[0]]
+    search = {'ids': ids[::-1] + ['UNKNOWN'], 'limit': 2}
+
+    assert search_pages(search, 'snapshot') == search_pages(search, 'sql')
+
+
+def test_check_sample_searches(snapshot):
+    assert check(get_sample_searches(get_collections()), pages=2) == 0
+
+
+def make_rows(*ids):
+    return [dict({column: None for column in SNAPSHOT_COLUMNS}, id=id, deleted=0) for id in ids]
+
+
+def test_make_arrays_fixed_width_ids():
+    vocabularies = {column: Vocabulary() for column in CATEGORY_COLUMNS}
+    arrays = make_arrays(make_rows('CBERS4MUX11210920150109', 'cbers4mux1'), vocabularies)
+
+    assert arrays['id'].dtype == np.dtype('<U23')
+    assert arrays['id_key'].tolist() == ['CBERS4MUX11210920150109', 'CBERS4MUX1']
+
+
+def test_merge_widens_the_ids():
+    vocabularies = {column: Vocabulary() for column in CATEGORY_COLUMNS}
+    columns = CollectionColumns.from_rows('C', make_rows('B', 'A'), vocabularies)
+    columns = columns.merge(make_rows('A', 'LONGER_ID'), vocabularies)
+
+    assert sorted(columns.arrays['id'].tolist()) == ['A', 'B', 'LONGER_ID']
+    assert columns.compare('id', np.arange(3), 'longer_id')[0].sum() == 1
+
+
+def test_bbox_filter_by_spatial_index():
+    vocabularies = {column: Vocabulary() for column in CATEGORY_COLUMNS}
+    row = make_rows('A')[0]
+    row.update(
+        tl_longitude=0, tl_latitude=1, tr_longitude=1, tr_latitude=1,
+        br_longitude=1, br_latitude=0, bl_longitude=2, bl_latitude=0
+    )
+    columns = CollectionColumns.from_rows('C', [row], vocabularies)
+    search_filter = {'bbox': ['1.5', '0', '3', '1']}
+
+    # the bbox is beyond the corners compared by `CORNERS_WHERE`, but inside the MBR of the scene
+    assert SnapshotFilter(search_filter, '0').get_mask(columns).tolist() == [False]
+    assert SnapshotFilter(search_filter, '0', 'mysql').get_mask(columns).tolist() == [True]
+    assert SnapshotFilter(search_filter, '0', 'rtree').get_mask(columns).tolist() == [True]
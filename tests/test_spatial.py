@@ -0,0 +1,147 @@
+from os import path
+
+import pytest
+
+from sqlalchemy.sql import bindparam, text
+
+from inpe_stac import data, spatial
+from inpe_stac.cache import TTLCache
+from inpe_stac.database import get_engine
+
+
+COLLECTION = 'CBERS4_MUX_L2_DN'
+
+BBOXES = [
+    ('-60', '-20', '-40', '0'),
+    ('-47.5', '-16.0', '-46.5', '-15.0'),
+    ('10', '10', '20', '20')
+]
+
+
+def select_ids(where, params):
+    statement = text('SELECT id FROM stac_item WHERE {} ORDER BY id'.format(where))
+    lists = [bindparam(key, expanding=True) for key, value in params.items() if isinstance(value, list)]
+
+    if lists:
+        statement = statement.bindparams(*lists)
+
+    with get_engine().connect() as connection:
+        return [row[0] for row in connection.execute(statement, **params)]
+
+
+def select_corners_ids(bbox, collections=None):
+    params = {}
+    where = spatial.CORNERS_WHERE.format('').replace('\n', ' ')
+    params['min_x'], params['min_y'], params['max_x'], params['max_y'] = bbox
+
+    if collections is not None:
+        where += ' AND collection IN :collections'
+        params['collections'] = collections
+
+    return select_ids(where, params)
+
+
+@pytest.fixture
+def rtree(tmp_path, monkeypatch):
+    """
+    R-tree file built from the catalog, that is used by the `bbox` filter.
+    """
+
+    file_path = str(tmp_path / 'rtree.sqlite')
+    spatial.build_rtree(file_path, batch_size=1000)
+
+    monkeypatch.setattr(spatial, 'INPE_STAC_SPATIAL_INDEX', 'rtree')
+    monkeypatch.setattr(spatial, 'rtree_index', spatial.RTreeIndex(file_path))
+    monkeypatch.setattr(data, 'watermark_cache', TTLCache(ttl=60))
+
+    return file_path
+
+
+def test_make_bbox_where_compares_the_corners():
+    params = {}
+
+    assert spatial.make_bbox_where(params, BBOXES[0], prefix='i_') == spatial.CORNERS_WHERE.format('i_')
+    assert params == {'i_min_x': '-60', 'i_min_y': '-20', 'i_max_x': '-40', 'i_max_y': '0'}
+
+
+@pytest.mark.parametrize('bbox', BBOXES)
+@pytest.mark.parametrize('collections', [None, [COLLECTION]])
+def test_make_bbox_where_rtree_selects_the_corners_items(rtree, bbox, collections):
+    params = {}
+    where = spatial.make_bbox_where(params, bbox, collections=collections)
+
+    assert 'rtree_changed' not in params
+
+    if collections is not None:
+        where += ' AND collection IN :collections'
+        params['collections'] = collections
+
+    assert select_ids(where, params) == select_corners_ids(bbox, collections)
+
+
+def test_make_bbox_where_rtree_without_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(spatial, 'INPE_STAC_SPATIAL_INDEX', 'rtree')
+    monkeypatch.setattr(spatial, 'rtree_index', spatial.RTreeIndex(str(tmp_path / 'missing.sqlite')))
+
+    assert spatial.make_bbox_where({}, BBOXES[0]) == spatial.CORNERS_WHERE.format('')
+
+
+def test_make_bbox_where_rtree_without_scenes(rtree):
+    assert spatial.make_bbox_where({}, BBOXES[2], collections=[COLLECTION]) == '1 = 0'
+
+
+def test_make_bbox_where_rtree_too_many_scenes(rtree, monkeypatch):
+    monkeypatch.setattr(spatial, 'INPE_STAC_RTREE_MAX_IDS', 1)
+
+    assert spatial.make_bbox_where({}, BBOXES[0]) == spatial.CORNERS_WHERE.format('')
+
+
+def test_make_bbox_where_rtree_searches_the_changed_collections(rtree, insert_item):
+    new_item = insert_item()
+    bbox = (
+        new_item['tl_longitude'] - 0.01, new_item['bl_latitude'] - 0.01,
+        new_item['tr_longitude'] + 0.01, new_item['tl_latitude'] + 0.01
+    )
+    params = {}
+    where = spatial.make_bbox_where(params, bbox, collections=[COLLECTION, 'CBERS4_AWFI_L2_DN'])
+
+    assert params['rtree_changed'] == [COLLECTION]
+    assert new_item['id'] in select_ids(where, params)
+    assert select_ids(where, params) == select_corners_ids(bbox, [COLLECTION, 'CBERS4_AWFI_L2_DN'])
+
+
+def test_build_rtree(rtree):
+    index = spatial.RTreeIndex(rtree)
+    watermarks = data.get_watermarks()
+
+    assert not path.exists(rtree + '.tmp')
+    assert index.get_version() == path.getmtime(rtree)
+    assert index.get_state() == watermarks
+    assert sorted(index.search(-180, -90, 180, 90)) == select_ids('1 = 1', {})
+    assert index.search(-180, -90, 180, 90, collections=[COLLECTION], max_ids=10) is None
+
+
+def test_build_rtree_replaces_the_file(rtree):
+    index = spatial.RTreeIndex(rtree)
+    index.get_state()
+
+    spatial.build_rtree(rtree, batch_size=1000)
+
+    assert index.get_state() == data.get_watermarks()
+    assert index.search(10, 10, 20, 20) == []
+
+
+@pytest.mark.skipif(get_engine().dialect.name != 'mysql', reason='the `footprint` column requires MySQL 8')
+def test_migrate(monkeypatch):
+    # the steps that have been done are skipped the second time
+    spatial.migrate(batch_size=1000)
+    spatial.migrate(batch_size=1000)
+
+    monkeypatch.setattr(spatial, 'INPE_STAC_SPATIAL_INDEX', 'mysql')
+
+    for bbox in BBOXES:
+        params = {}
+        where = spatial.make_bbox_where(params, bbox)
+
+        assert where.startswith('MBRIntersects(footprint')
+        assert set(select_corners_ids(bbox)) <= set(select_ids(where, params))
@@ -0,0 +1,54 @@
+import pytest
+
+from inpe_stac import data
+from inpe_stac.data import do_query, do_query_stream
+from inpe_stac.database import get_engine
+
+
+SQL = 'SELECT id, collection FROM stac_item WHERE collection = :collection ORDER BY id'
+
+
+@pytest.mark.parametrize('url', [
+    '/stac/search?collections=CBERS4_MUX_L2_DN,CBERS4_AWFI_L2_DN&limit=1000',
+    '/collections/CBERS4_MUX_L2_DN/items?limit=1000'
+])
+def test_streamed_response(client, monkeypatch, url):
+    response = client.get(url)
+    # a streamed response does not know its length
+    assert 'Content-Length' not in response.headers
+    streamed = response.get_json()
+    response.close()
+
+    # the same page is built in memory when it is lower than the limit
+    monkeypatch.setattr('inpe_stac.app.INPE_STAC_STREAM_MIN_LIMIT', 1001)
+
+    response = client.get(url)
+    assert 'Content-Length' in response.headers
+
+    assert response.get_json() == streamed
+    assert len(streamed['features']) > 0
+
+
+def test_small_response_is_not_streamed(client):
+    response = client.get('/stac/search?collections=CBERS4_MUX_L2_DN&limit=999')
+
+    assert 'Content-Length' in response.headers
+
+
+def test_do_query_stream(monkeypatch):
+    monkeypatch.setattr(data, 'INPE_STAC_STREAM_BATCH_SIZE', 7)
+
+    rows, _ = do_query(SQL, collection='CBERS2B_CCD_L2_DN')
+
+    assert list(do_query_stream(SQL, collection='CBERS2B_CCD_L2_DN')) == rows
+    assert get_engine().pool.checkedout() == 0
+
+
+def test_closed_stream_gives_back_the_connection():
+    rows = do_query_stream(SQL, collection='CBERS4_MUX_L2_DN')
+
+    next(rows)
+    assert get_engine().pool.checkedout() == 1
+
+    rows.close()
+    assert get_engine().pool.checkedout() == 0